@@ -5,7 +5,9 @@ import re
 import sys
 import time
 import signal
-import subprocess
+
+# The spool and record parsing come with rsv-core, like the Supervisor
+from rsv import Spool, Results, Consumer
 
 class InvalidRecordError(Exception):
     """ Custom exception for a bad record format """
@@ -25,12 +27,22 @@ class RSVConsumer:
 
     rsv_control = os.path.join("/", "usr", "bin", "rsv-control")
 
+    # Consumers that never look at detailsData set this, and are handed the
+    # parsed Results.ResultRecord instead of its text, so compressed details
+    # in the spool are never inflated for them
+    lazy_details = False
+
     def __init__(self):
         """ Constructor """
 
         # Register variables
         self.__consumer_done = False
-        self.__records_dir = os.path.join("/", "var", "spool", "rsv", "%s-consumer" % self.name)
+        self.__spool = Spool.Spool(log=self.log_warning)
+        self.__cursor_name = "%s-consumer" % self.name
+        # Records were written to a directory per consumer before the shared
+        # spool, any left there are processed first
+        self.__records_dir = os.path.join(Spool.SPOOL_DIR, "%s-consumer" % self.name)
+        self.__time_format = ""
         self.__log_file = os.path.join("/", "var", "log", "rsv", "consumers", "%s-consumer.output" % self.name)
 
         # Initialize
@@ -39,6 +51,7 @@ class RSVConsumer:
         self.parse_arguments()
         self.register_signal_handlers()
         self.validate_records_dir()
+        self.__time_format = self.get_time_format()
 
         return
 
@@ -76,6 +89,11 @@ class RSVConsumer:
         return
 
 
+    def log_warning(self, msg):
+        self.log("WARNING: %s" % msg)
+        return
+
+
     def parse_arguments(self):
         """ Specific to each subclass. """
         pass
@@ -97,19 +115,114 @@ class RSVConsumer:
 
     def validate_records_dir(self):
         # Where records will be read from
-        # This script will delete files from this directory, so it also needs write access.
-        if not os.access(self.__records_dir, os.F_OK):
-            self.die("ERROR: Records directory does not exist '%s'" % self.__records_dir)
-        if not os.access(self.__records_dir, os.R_OK):
-            self.die("ERROR: Cannot read records directory '%s'" % self.__records_dir)
-        if not os.access(self.__records_dir, os.W_OK):
-            self.die("ERROR: Cannot write records directory '%s'" % self.__records_dir)
+        # Segments are removed from the spool once every consumer has processed
+        # them, and the cursor is updated as each record is processed, so this
+        # script needs write access to both.
+        for directory in (self.__spool.journal_dir, self.__spool.cursor_dir):
+            if not os.access(directory, os.F_OK):
+                self.die("ERROR: Records directory does not exist '%s'" % directory)
+            if not os.access(directory, os.R_OK):
+                self.die("ERROR: Cannot read records directory '%s'" % directory)
+            if not os.access(directory, os.W_OK):
+                self.die("ERROR: Cannot write records directory '%s'" % directory)
 
         return
 
 
+    def get_time_format(self):
+        """ Return the time format this consumer wants timestamps in: 'local',
+        'epoch' or '' for UTC, as rsv-control sees it """
+        return Consumer.read_time_format("%s-consumer" % self.name)
+
+
     def process_files(self, sort_by_time=False, failed_records_dir=None):
-        """ Open the records directory and load each file """
+        """ Process the records in the spool that this consumer has not processed
+        yet, in the order they were written.  sort_by_time only applies to
+        records left in the old per-consumer directory: the spool is always in
+        order. """
+
+        if os.path.isdir(self.__records_dir):
+            self.process_old_files(sort_by_time, failed_records_dir)
+
+        cursor = self.__spool.open_cursor(self.__cursor_name)
+        if cursor is None:
+            self.log("No records have been written for the %s-consumer yet" % self.name)
+            return
+
+        self.log("Processing records from position %s in the spool" % (cursor.position,))
+        count = 0
+        skipped = 0
+
+        try:
+            for (position, sequence, recipients, record) in self.__spool.read(cursor.position):
+                if self.__consumer_done == 1:
+                    break
+
+                if record is None:
+                    self.log("ERROR: Skipping corrupt data in the spool before position %s" % (position,))
+                elif recipients is not None and self.__cursor_name not in recipients:
+                    # Held back by the emission policy (emit-policy = changes)
+                    skipped += 1
+                else:
+                    count += 1
+                    self.process_spooled_record(sequence, record, failed_records_dir)
+
+                try:
+                    cursor.set(position)
+                except OSError, err:
+                    # If we cannot move the cursor then we are going to process the records again
+                    # So stop processing now to avoid duplicate data.
+                    self.die("ERROR: Failed to update the spool cursor past record %s.  Error: %s" % (sequence, err))
+
+        except (IOError, OSError), err:
+            self.log("ERROR: Failed to read the spool.  Error: %s" % err)
+
+        self.log("Processed %s records (%s were not for the %s-consumer)" % (count, skipped, self.name))
+
+        # Make sure the cursor survives a crash before the segments behind it go
+        try:
+            try:
+                cursor.set(cursor.position, sync=True)
+                self.__spool.collect()
+            except (IOError, OSError), err:
+                self.log("ERROR: Failed to clean up the spool.  Error: %s" % err)
+        finally:
+            cursor.close()
+
+        return
+
+
+    def process_spooled_record(self, sequence, record, failed_records_dir=None):
+        """ Process a record from the spool, saving it to failed_records_dir if
+        that does not work """
+
+        # Records are spooled with UTC timestamps, and their details may be
+        # compressed
+        if isinstance(record, Spool.PackedRecord):
+            record = Results.parse_wlcg_record(record.head, record.packed)
+        elif self.__time_format or self.lazy_details:
+            record = Results.parse_wlcg_record(record)
+        if not self.lazy_details and isinstance(record, Results.ResultRecord):
+            record = record.render(self.__time_format)
+
+        name = "record %s in the spool" % sequence
+        if self.handle_record(record, name) or not failed_records_dir:
+            return
+
+        if isinstance(record, Results.ResultRecord):
+            record = record.render(self.__time_format)
+        failed_file = os.path.join(failed_records_dir, "%s.%012d" % (self.name, sequence))
+        try:
+            Spool.write_file(failed_file, record)
+        except (IOError, OSError), err:
+            # If we cannot save the record we would lose it by going past it
+            # So stop processing now, it will be processed again next time.
+            self.die("ERROR: Failed to save %s to '%s'.  Error: %s" % (name, failed_file, err))
+        return
+
+
+    def process_old_files(self, sort_by_time=False, failed_records_dir=None):
+        """ Open the old records directory and load each file """
 
         files = os.listdir(self.__records_dir)
         self.log("Processing %s files" % len(files))
@@ -141,18 +254,7 @@ class RSVConsumer:
                 self.log("ERROR: Failed to read from file '%s'. Error: %s" % (file_path, err))
                 continue
             
-
-            success = False
-            try:
-                self.process_record(record)
-                success = True
-            except InvalidRecordError, err:
-                self.log("ERROR: Invalid record in file '%s'.  Error: %s" % (file_path, err))
-            except GratiaException, err:
-                self.log("ERROR: Failed to send record '%s' via Gratia: %s" % (file_path, err))
-            except Exception, err:
-                self.log("ERROR: An unknown exception occurred when processing file '%s'. Error: " % file_path)
-                self.log(err)
+            success = self.handle_record(record, "file '%s'" % file_path)
 
             if failed_records_dir and not success:
                 failed_file = os.path.join(failed_records_dir, filename)
@@ -171,6 +273,31 @@ class RSVConsumer:
                     # So stop processing now to avoid duplicate data.
                     self.die("ERROR: Failed to remove record '%s'.  Error: %s" % (file_path, err))
 
+        # Once it is empty, only the spool is left
+        try:
+            os.rmdir(self.__records_dir)
+        except OSError:
+            pass
+
+
+    def handle_record(self, record, source):
+        """ Process one record.  source says where it came from, for error
+        messages.  Returns True on success. """
+
+        success = False
+        try:
+            self.process_record(record)
+            success = True
+        except InvalidRecordError, err:
+            self.log("ERROR: Invalid record in %s.  Error: %s" % (source, err))
+        except GratiaException, err:
+            self.log("ERROR: Failed to send record from %s via Gratia: %s" % (source, err))
+        except Exception, err:
+            self.log("ERROR: An unknown exception occurred when processing %s. Error: " % source)
+            self.log(err)
+
+        return success
+
 
     def process_record(self):
         """ Specific to each subclass """
@@ -193,8 +320,18 @@ class RSVConsumer:
         EOT
 
         Note: for local probe serviceURI and gatheredAt are replaced by hostName
+
+        raw_record can also be a Results.ResultRecord (see lazy_details).  Its
+        detailsData is then None, and is not inflated.
         """
 
+        if isinstance(raw_record, Results.ResultRecord):
+            if not raw_record.has_details():
+                raise InvalidRecordError("'EOT' marker missing")
+            record = self.parse_wlcg_record(raw_record.get_head(self.__time_format) + "detailsData:\nEOT\n")
+            record["detailsData"] = None
+            return record
+
         record = {}
 
         # detailsData will always come last, and might be multiple lines
@@ -250,34 +387,33 @@ class RSVConsumer:
 
 
     def run_command(self, command, timeout):
-        """ Run a shell command with a timeout specified (in seconds).
+        """ Run a shell command with a timeout specified (in seconds).  STDERR is
+        merged into STDOUT.
         Returns:
         1) exit code
         2) STDOUT
         3) STDERR
         """
 
+        # The supervisor comes with rsv-core, which rsv-control is part of.  It
+        # kills the command (and anything it started) when it times out.
+        from rsv import Supervisor
+
+        supervisor = Supervisor.Supervisor()
+        child = supervisor.spawn(command, timeout, merge_stderr=True)
         try:
-            signal.signal(signal.SIGALRM, alarm_handler)
-            signal.alarm(timeout)
-
-            # Run and return command
-            p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            (stdout, stderr) = p.communicate(None)
-            signal.alarm(0)
-        except TimeoutError:
+            supervisor.wait(child)
+        finally:
+            supervisor.kill_all()
+
+        if child.timed_out:
             self.log("ERROR: Command timed out (timeout=%s): %s" % (timeout, " ".join(command)))
-            #os.kill(child.pid, signal.SIGKILL) # TODO - fix this 
             raise TimeoutError("Command timed out (timeout=%s)" % timeout)
 
-        return (p.returncode, stdout, stderr)
+        return (child.exit_code, child.stdout.getvalue(), None)
     
 
     def die(self, msg):
         """ Print an error message and exit with a non-zero status """
         self.log(msg)
         sys.exit(1)
-
-
-def alarm_handler(signum, frame):
-    raise TimeoutError("System call timed out")
@@ -0,0 +1,263 @@
+#!/usr/bin/python
+
+# How much to read from a pipe at a time
+CHUNK_SIZE = 65536
+
+# Bytes kept from the end of the output once the beginning is full.  The end of
+# a WLCG record holds the EOT terminator.
+TAIL_SIZE = 4096
+
+# Room for the record header lines that come before detailsData, on top of
+# details-data-trim-length
+HEADER_SIZE = 4096
+
+# The most kept from the beginning of the output when details-data-trim-length
+# is 0 (do not trim)
+MAX_HEAD_SIZE = 16 * 1024 * 1024
+
+
+class CapturedOutput(str):
+    """ The output kept by a BoundedBuffer.  It is a str, with the total size of
+    the output, the number of bytes that were dropped from the middle and the
+    number of WLCG EOT lines seen in all of the output attached.  Output
+    collected by a RecordSplitter also has the list of WLCG records in it as
+    records (None otherwise). """
+
+    def __new__(cls, value, dropped=0, eot_count=0, size=None, records=None):
+        self = str.__new__(cls, value)
+        self.dropped = dropped
+        self.eot_count = eot_count
+        if size is None:
+            size = len(value)
+        self.size = size
+        self.records = records
+        return self
+
+
+class BoundedBuffer:
+    """ Collect output a chunk at a time, keeping at most the first head_size and
+    the last tail_size bytes.  Everything in between is counted but dropped, so
+    memory use does not depend on how much is written.  A head_size of None
+    keeps everything. """
+
+    def __init__(self, head_size=None, tail_size=TAIL_SIZE):
+        self.head_size = head_size
+        self.tail_size = tail_size
+
+        self.head = []
+        self.head_length = 0
+        self.tail = ""
+        self.dropped = 0
+        self.size = 0
+
+        # The beginning of the current line, to spot EOT across chunks
+        self.line = ""
+        self.eot_count = 0
+
+
+    def write(self, data):
+        self.size += len(data)
+        self.count_eot(data)
+
+        if self.head_size is not None:
+            room = self.head_size - self.head_length
+            if room < len(data):
+                if room > 0:
+                    self.head.append(data[:room])
+                    self.head_length += room
+                    data = data[room:]
+                self.add_to_tail(data)
+                return
+
+        self.head.append(data)
+        self.head_length += len(data)
+        return
+
+
+    def add_to_tail(self, data):
+        tail = self.tail + data
+        excess = len(tail) - self.tail_size
+        if excess > 0:
+            self.dropped += excess
+            tail = tail[excess:]
+        self.tail = tail
+        return
+
+
+    def count_eot(self, data):
+        """ Count lines consisting of 'EOT', which end WLCG records """
+
+        text = self.line + data
+        if text.find("EOT") >= 0:
+            for line in text.split("\n")[:-1]:
+                if line.strip() == "EOT":
+                    self.eot_count += 1
+
+        # Only the start of a line matters, a long line is not EOT
+        self.line = text[text.rfind("\n") + 1:][:16]
+        return
+
+
+    def getvalue(self):
+        """ Return the kept output as a CapturedOutput """
+
+        eot_count = self.eot_count
+        if self.line.strip() == "EOT":
+            # The output ended without a newline
+            eot_count += 1
+
+        value = "".join(self.head)
+        if self.dropped:
+            value += "\n[... %s bytes of output were not kept ...]\n" % self.dropped
+        value += self.tail
+
+        return CapturedOutput(value, self.dropped, eot_count, self.size)
+
+
+class RecordSplitter:
+    """ Split output holding any number of WLCG records, each ending with an EOT
+    line, into records as it is written.
+
+    Every complete record is kept until the job has exited and its records
+    can be published, with its detailsData cut down to about trim_length
+    bytes (0 keeps all of it) as it arrives, so a metric printing
+    thousands of records never has all of its output in memory or copied
+    around at once.  The output itself goes to a BoundedBuffer(head_size) as
+    well, for error messages.  Text after the last EOT counts as a record that
+    was cut short. """
+
+    def __init__(self, head_size=None, trim_length=0, tail_size=TAIL_SIZE):
+        self.output = BoundedBuffer(head_size, tail_size)
+        self.trim_length = trim_length
+        self.size = 0
+
+        self.records = []
+        self.line = []
+        self.line_length = 0
+        self.record = []
+        self.in_details = False
+        # Bytes of detailsData that can still be kept in the current record,
+        # None for no limit
+        self.room = None
+        self.done = False
+
+
+    def write(self, data):
+        self.output.write(data)
+        self.size += len(data)
+
+        lines = data.split("\n")
+        if len(lines) > 1:
+            self.line.append(lines[0])
+            self.add_line("".join(self.line))
+            for line in lines[1:-1]:
+                self.add_line(line)
+            self.line = []
+            self.line_length = 0
+
+        # The start of a line that has not ended yet, up to what could be kept
+        # of it (and enough to tell whether it is EOT)
+        piece = lines[-1]
+        limit = self.get_line_limit()
+        if limit is not None:
+            piece = piece[:max(0, limit - self.line_length)]
+        if piece:
+            self.line.append(piece)
+            self.line_length += len(piece)
+        return
+
+
+    def get_line_limit(self):
+        if self.trim_length <= 0:
+            return None
+        if self.in_details:
+            return max(self.room, 16)
+        return self.trim_length + HEADER_SIZE
+
+
+    def add_line(self, line):
+        if line.strip() == "EOT":
+            self.end_record()
+            return
+
+        if not self.in_details:
+            if not self.record and not line.strip():
+                # Blank lines between records
+                return
+            if line.startswith("detailsData:"):
+                self.in_details = True
+                if self.trim_length > 0:
+                    # Keeps a byte or so extra, the record is trimmed exactly
+                    # later on (Results.trim_details_data)
+                    start = len(line) - len(line[len("detailsData:"):].lstrip(" "))
+                    line = line[:start + self.trim_length + 1]
+                    self.room = self.trim_length - (len(line) - start)
+            self.record.append(line)
+            return
+
+        if self.room is None:
+            self.record.append(line)
+        elif self.room > 0:
+            line = line[:self.room]
+            self.record.append(line)
+            self.room -= len(line) + 1
+        return
+
+
+    def end_record(self):
+        if self.record:
+            self.records.append("\n".join(self.record) + "\nEOT\n")
+        self.record = []
+        self.in_details = False
+        self.room = None
+        return
+
+
+    def getvalue(self):
+        """ Return the kept output as a CapturedOutput, with the records in it """
+
+        if not self.done:
+            if self.line:
+                self.add_line("".join(self.line))
+                self.line = []
+                self.line_length = 0
+            self.end_record()
+            self.done = True
+
+        value = self.output.getvalue()
+        return CapturedOutput(value, value.dropped, value.eot_count, value.size, self.records)
+
+
+def get_head_size(trim_length):
+    """ Return how much of the start of a metric's output to keep so that
+    details-data-trim-length bytes of detailsData survive """
+
+    if trim_length <= 0:
+        return MAX_HEAD_SIZE
+    return min(MAX_HEAD_SIZE, trim_length + HEADER_SIZE)
+
+
+def read_file(path, head_size=None, tail_size=TAIL_SIZE):
+    """ Read a file through a BoundedBuffer.  Returns a CapturedOutput, which is
+    empty if the file cannot be read. """
+    return read_into(path, BoundedBuffer(head_size, tail_size))
+
+
+def read_into(path, buffer_):
+    """ Read a file through buffer_ (a BoundedBuffer or RecordSplitter) and
+    return its value """
+
+    try:
+        fp = open(path, 'rb')
+        try:
+            while 1:
+                data = fp.read(CHUNK_SIZE)
+                if not data:
+                    break
+                buffer_.write(data)
+        finally:
+            fp.close()
+    except IOError:
+        pass
+
+    return buffer_.getvalue()
@@ -7,7 +7,6 @@ import time
 import commands
 from time import strftime
 
-import Host
 
 class Condor:
     """ Define the interface to condor-cron """
@@ -24,7 +23,7 @@ class Condor:
         (ret, out) = self.commands_getstatusoutput("condor_cron_q")
 
         if not ret:
-            self.rsv.log("DEBUG", "Condor is running.  Output of condor_cron_q:\n%s" % out)
+            self.rsv.log("DEBUG", "Condor is running.  Output of condor_cron_q:\n%s", out)
             return True
 
         self.rsv.log("INFO", "Condor-Cron does not seem to be running.  " +
@@ -59,7 +58,7 @@ class Condor:
         If there is an error, return None
         """
         if constraint:
-            self.rsv.log("DEBUG", "Getting Condor classads with constraint '%s'" % constraint)
+            self.rsv.log("DEBUG", "Getting Condor classads with constraint '%s'", constraint)
         else:
             self.rsv.log("DEBUG", "Getting Condor classads with no constraint")
 
@@ -76,7 +75,7 @@ class Condor:
 
         # Run the command and parse the classad
         if ret != 0:
-            self.rsv.log("ERROR", "Command returned error code '%i': '%s'" % (ret, cmd))
+            self.rsv.log("ERROR", "Command returned error code '%i': '%s'", ret, cmd)
             return None
         else:
             return parse_classads(out)
@@ -104,21 +103,21 @@ class Condor:
         Takes a Metric and Host object as input.
         """
         
-        self.rsv.log("INFO", "Submitting metric job to condor: metric '%s' - host '%s'" %
-                     (metric.name, metric.host))
+        self.rsv.log("INFO", "Submitting metric job to condor: metric '%s' - host '%s'",
+                     metric.name, metric.host)
 
         condor_id = metric.get_unique_name()
 
         # Make sure that the metric is enabled
         if not host.metric_enabled(metric.name):
-            self.rsv.log("ERROR", "The metric '%s' is not enabled on host '%s'." %
-                         (metric.name, host.host))
+            self.rsv.log("ERROR", "The metric '%s' is not enabled on host '%s'.",
+                         metric.name, host.host)
             return False
 
         # Check if the metric is already running in condor_cron
         if self.is_job_running(condor_id):
-            self.rsv.log("INFO", "Metric '%s' is already running against host '%s'" %
-                         (metric.name, host.host))
+            self.rsv.log("INFO", "Metric '%s' is already running against host '%s'",
+                         metric.name, host.host)
             return True
 
         # Generate a submission file
@@ -130,23 +129,23 @@ class Condor:
     def start_consumer(self, rsv, consumer):
         """ Start a single consumer condor-cron job. """
         
-        self.rsv.log("INFO", "Submitting consumer job to condor: consumer '%s'" % consumer)
+        self.rsv.log("INFO", "Submitting consumer job to condor: consumer '%s'", consumer)
 
         condor_id = consumer.get_unique_name()
 
         # Check if the consumer is enabled
         if not rsv.is_consumer_enabled(consumer.name):
-            self.rsv.log("ERROR", "The consumer '%s' is not enabled." % consumer.name)
+            self.rsv.log("ERROR", "The consumer '%s' is not enabled.", consumer.name)
             return False
 
         # Check if the consumer is already running in condor_cron
         if self.is_job_running(condor_id):
-            self.rsv.log("INFO", "Consumer '%s' is already running" % consumer.name)
+            self.rsv.log("INFO", "Consumer '%s' is already running", consumer.name)
             return True
 
         # Generate a submission file
         submit_file_contents = self.build_consumer_submit_file(consumer)
-        self.rsv.log("DEBUG", "%s submit file:\n%s" % (consumer.name, submit_file_contents), 4)
+        self.rsv.log("DEBUG", "%s submit file:\n%s", consumer.name, submit_file_contents, indent=4)
         return self.submit_job(submit_file_contents, condor_id)
 
 
@@ -162,8 +161,8 @@ class Condor:
             file_handle.write(submit_file_contents)
             file_handle.close()
         except IOError, err:
-            self.rsv.log("ERROR", "Cannot write temporary submission file '%s'." % sub_file_name)
-            self.rsv.log("ERROR", "Error message: %s" % err)
+            self.rsv.log("ERROR", "Cannot write temporary submission file '%s'.", sub_file_name)
+            self.rsv.log("ERROR", "Error message: %s", err)
             return False
 
         # We need to change to a directory that can be read by the RSV user.  This is
@@ -176,24 +175,24 @@ class Condor:
         cmd = "condor_cron_submit %s" % sub_file_name
         raw_ec, out = self.commands_getstatusoutput(cmd, self.rsv.get_user())
         exit_code = os.WEXITSTATUS(raw_ec)
-        self.rsv.log("INFO", "Condor submission: %s" % out)
-        self.rsv.log("DEBUG", "Condor submission completed: %s (%s)" % (exit_code, raw_ec))
+        self.rsv.log("INFO", "Condor submission: %s", out)
+        self.rsv.log("DEBUG", "Condor submission completed: %s (%s)", exit_code, raw_ec)
 
         if remove:
             os.remove(sub_file_name)
 
         if exit_code != 0:
-            self.rsv.log("ERROR", "Problem submitting job to condor.  Command output:\n%s" % out)
+            self.rsv.log("ERROR", "Problem submitting job to condor.  Command output:\n%s", out)
             return False
 
         # Determine the job cluster ID
         match = re.search("submitted to cluster (\d+)\.", out)
         if match:
             job_id = match.group(1)
-            self.rsv.log("DEBUG", "Condor job cluster ID: %s" % job_id)
+            self.rsv.log("DEBUG", "Condor job cluster ID: %s", job_id)
             return job_id
         else:
-            self.rsv.log("ERROR", "Could not determine job cluster ID from output:\n%s" % out)
+            self.rsv.log("ERROR", "Could not determine job cluster ID from output:\n%s", out)
             return False
 
 
@@ -203,7 +202,7 @@ class Condor:
         Return True if jobs are stopped successfully, False otherwise
         """
 
-        self.rsv.log("INFO", "Stopping all metrics with constraint '%s'" % constraint)
+        self.rsv.log("INFO", "Stopping all metrics with constraint '%s'", constraint)
 
         if not self.is_condor_running():
             self.rsv.log("ERROR", "Cannot stop jobs because Condor-Cron is not running")
@@ -215,7 +214,7 @@ class Condor:
             self.rsv.log("ERROR", "Problem stopping RSV jobs.  Condor may not be running")
             return False
         if len(jobs) == 0:
-            self.rsv.log("INFO", "No jobs to be removed with constraint '%s'" % constraint)
+            self.rsv.log("INFO", "No jobs to be removed with constraint '%s'", constraint)
             return True
 
         # Build the command
@@ -226,8 +225,8 @@ class Condor:
         (ret, out) = self.commands_getstatusoutput(cmd)
 
         if ret != 0:
-            self.rsv.log("ERROR", "Command returned error code '%i': '%s'.  Output:\n%s" %
-                         (ret, cmd, out))
+            self.rsv.log("ERROR", "Command returned error code '%i': '%s'.  Output:\n%s",
+                         ret, cmd, out)
             return False
 
         return True
@@ -246,8 +245,8 @@ class Condor:
         if not probe_interval:
             cron = metric.get_cron_entry()
             if not cron:
-                self.rsv.log("ERROR", "Invalid cron time for metric %s on host %s.  Will not start." %
-                             (metric.name, metric.host))
+                self.rsv.log("ERROR", "Invalid cron time for metric %s on host %s.  Will not start.",
+                             metric.name, metric.host)
                 return ""
 
         submit = ""
@@ -326,7 +325,7 @@ class Condor:
 
     def commands_getstatusoutput(self, command, user=None):
         """Run a command in a subshell using commands module and setting up the environment"""
-        self.rsv.log("DEBUG", "commands_getstatusoutput: command='%s' user='%s'" % (command, user))
+        self.rsv.log("DEBUG", "commands_getstatusoutput: command='%s' user='%s'", command, user)
 
         if user:
             this_uid = os.getuid()
@@ -419,7 +418,8 @@ class Condor:
                 hosts[host] += text
 
             # Add in any hosts that have ALL their metric missing
-            for host in self.rsv.get_hosts():
+            registry = self.rsv.get_host_registry()
+            for host in registry.get_host_names():
                 if host not in hosts:
                     hosts[host] = "Hostname: %s\n\tThis host has no running metrics.\n" % host
                     running_metrics[host] = []
@@ -431,8 +431,7 @@ class Condor:
 
                 # Determine if any metrics are enabled on this host, but not running
                 missing_metrics = []
-                enabled_metrics = Host.Host(host, self.rsv).get_enabled_metrics()
-                for metric in enabled_metrics:
+                for metric in registry.get_enabled_metrics(host):
                     if metric not in running_metrics[host]:
                         missing_metrics.append(metric)
 
@@ -4,13 +4,17 @@ import os
 import re
 import pwd
 import sys    # for sys.exit
+import time
 import shutil
 import tempfile
 
 import Condor
+import Capture
 import Sysutils
+import CondorLog
 
-KEYWORDS = ["return value", "error", "abort", "Globus job submission failed", "Detected Down Globus Resource"]
+# wait() returns one of the CondorLog statuses, or this
+TIMED_OUT = 5
 
 class CondorG:
     """ Interface to submit Condor-G jobs """
@@ -24,6 +28,10 @@ class CondorG:
     tempdir = None
     cleanup = True
     cluster_id = None
+    proc_id = None
+    env = None
+    deadline = None
+    events = None
 
     def __init__(self, rsv, cleanup=True):
         """ Constructor """
@@ -33,29 +41,23 @@ class CondorG:
 
     def __del__(self):
         """ Destructor - do filesystem cleanup """
-        if self.cleanup:
+        if self.cleanup and self.tempdir:
             if os.path.exists(self.tempdir):
                 try:
                     shutil.rmtree(self.tempdir)
                 except OSError, err:
-                    self.rsv.log("WARNING", "Could not remove Condor-G temporary directory '%s'.  Error %s" % (self.tempdir, err))
+                    self.rsv.log("WARNING", "Could not remove Condor-G temporary directory '%s'.  Error %s", self.tempdir, err)
 
 
-    def submit(self, metric, attrs=None, timeout=None):
-        """ Form a grid submit file and submit the job to Condor """
+    def submit(self, metric, attrs=None, timeout=None, env=None):
+        """ Form a grid submit file and submit the job to Condor.  The variables
+        that the metric sets in env (a JobEnvironment) are passed to the job. """
 
         self.metric = metric
 
         # Make a temporary directory to store submit file, input, output, and log
-        parent_dir = os.path.join("/", "var", "tmp", "rsv")
-        if not os.path.exists(parent_dir):
-            # /var/tmp/rsv can be periodically deleted by system cleanup utilities so we sometimes
-            # have to re-create it
-            os.mkdir(parent_dir, 0755)
-            (uid, gid) = pwd.getpwnam('rsv')[2:4]
-            os.chown(parent_dir, uid, gid)
-        self.tempdir = tempfile.mkdtemp(prefix="condor_g-", dir=parent_dir)
-        self.rsv.log("INFO", "Condor-G working directory: %s" % self.tempdir)
+        self.tempdir = make_tempdir()
+        self.rsv.log("INFO", "Condor-G working directory: %s", self.tempdir)
         
         self.log = os.path.join(self.tempdir, "%s.log" % metric.name)
         self.out = os.path.join(self.tempdir, "%s.out" % metric.name)
@@ -64,6 +66,34 @@ class CondorG:
         #
         # Build the submit file
         #
+        submit_file = self.get_grid_resource(metric)
+
+        # Add in custom attributes
+        if attrs:
+            for key in attrs.keys():
+                submit_file += "%s = %s\n" % (key, attrs[key])
+
+        submit_file += self.get_job_commands(env)
+        submit_file += "Log = %s\n" % self.log
+        submit_file += "Notification = never\n"
+        submit_file += "WhenToTransferOutput = ON_EXIT_OR_EVICT\n\n"
+        submit_file += "Queue\n"
+
+        condor = Condor.Condor(self.rsv)
+        self.cluster_id = condor.submit_job(submit_file, metric.name, dir=self.tempdir, remove=0)
+
+        if not self.cluster_id:
+            return False
+
+        self.rsv.log("DEBUG", "Condor-G submission job ID - %s", self.cluster_id)
+        return True
+
+
+    def get_grid_resource(self, metric):
+        """ Return the submit commands that say where metric's job goes: the
+        grid_resource and the proxy to use.  Metrics that get the same commands
+        can be submitted in one cluster (see CondorGBatch). """
+
         ce_type = (  metric.config_get("ce-type")
                   or metric.config_get("gatekeeper-type")
                   or getattr(metric, "ce-type", None)
@@ -110,67 +140,85 @@ class CondorG:
             submit_file += "grid_resource = gt2 %s/jobmanager-%s\n\n" % (metric.host, jobmanager)
         
         # The user proxy should be in the submit file regardless of the CE type
-        if 'X509_USER_PROXY' in os.environ:
-                submit_file += "x509userproxy = %s\n" % os.environ['X509_USER_PROXY']
+        proxy = self.rsv.get_proxy() or os.environ.get("X509_USER_PROXY")
+        if proxy:
+            submit_file += "x509userproxy = %s\n" % proxy
+
+        return submit_file
+
+
+    def get_job_commands(self, env=None, batch=False):
+        """ Return the submit commands for the job itself: what to run, with what
+        environment and files, and where its output goes.  In a batch, where
+        these change from one job to the next, every one of them is given so
+        that nothing carries over from the job before. """
 
-        submit_file += "Executable = %s\n" % metric.executable
+        metric = self.metric
+
+        submit_file = "Executable = %s\n" % metric.executable
 
         args = ['-m', metric.name, '-u', metric.host] + metric.get_args_list()
         submit_file += "Arguments  = %s\n" % quote_arguments(args)
 
-        # Add in custom attributes
-        if attrs:
-            for key in attrs.keys():
-                submit_file += "%s = %s\n" % (key, attrs[key])
+        if env is not None and env.get_changed():
+            submit_file += "environment = %s\n" % env.condor_environment()
+        elif batch:
+            submit_file += 'environment = ""\n'
 
         transfer_files = metric.get_transfer_files()
         if transfer_files:
             submit_file += "transfer_input_files = %s\n" % ", ".join(transfer_files)
+        elif batch:
+            submit_file += "transfer_input_files =\n"
             
-        submit_file += "Log = %s\n" % self.log
         submit_file += "Output = %s\n" % self.out
         submit_file += "Error = %s\n\n" % self.err
-        submit_file += "Notification = never\n"
-        submit_file += "WhenToTransferOutput = ON_EXIT_OR_EVICT\n\n"
-        submit_file += "Queue\n"
-
-        condor = Condor.Condor(self.rsv)
-        self.cluster_id = condor.submit_job(submit_file, metric.name, dir=self.tempdir, remove=0)
-
-        if not self.cluster_id:
-            return False
-
-        self.rsv.log("DEBUG", "Condor-G submission job ID - %s" % self.cluster_id)
-        return True
+        return submit_file
         
 
     def wait(self):
-        """ Wait for the job to complete """
+        """ Wait for the job to complete.  Returns the status of the job (see
+        CondorLog.STATUS_ORDER) or TIMED_OUT. """
         
-        # Monitor the job's log and watch for it to finish
-        job_timeout = self.metric.get_timeout() or self.rsv.config.get("rsv", "job-timeout")
+        # Follow the job's log and watch for it to finish
+        deadline = time.time() + self.get_timeout()
+        log = CondorLog.CondorLog(self.log)
+        watcher = CondorLog.LogWatcher(self.rsv, [self.log])
+        self.rsv.log("DEBUG", "Following log '%s' until the job finishes", self.log)
 
         try:
-            (keyword, log_contents) = self.utils.watch_log(self.log, KEYWORDS, job_timeout)
-        except Sysutils.TimeoutError, err:
-            self.remove()
-            return 5
-
-        if keyword == "return value":
-            return 0
-        elif keyword == "abort":
-            return 1
-        elif keyword == "error":
-            return 2
-        elif keyword == "Globus job submission failed":
-            self.remove()
-            return 3
-        elif keyword == "Detected Down Globus Resource":
-            self.remove()
-            return 4
+            while 1:
+                log.read()
+                self.events = log.get_events()
+                status = CondorLog.get_status(self.events)
+                if status is not None:
+                    return self.finish(status)
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.remove()
+                    return TIMED_OUT
+                watcher.wait(remaining)
+        finally:
+            watcher.close()
+
 
-        # We should not reach here, but just in case
-        return False
+    def get_timeout(self):
+        return self.metric.get_timeout() or self.rsv.config.getint("rsv", "job-timeout")
+
+
+    def finish(self, status):
+        """ Return status, removing the job from the queue if it will not leave
+        by itself """
+
+        if status in (CondorLog.SUBMISSION_FAILED, CondorLog.RESOURCE_DOWN):
+            self.remove()
+        elif status == CondorLog.JOB_FAILED:
+            codes = [event.code for event in self.events]
+            if CondorLog.JOB_TERMINATED not in codes and CondorLog.JOB_ABORTED not in codes:
+                # Held, or an error on the remote side
+                self.remove()
+        return status
         
 
     def remove(self):
@@ -178,26 +226,203 @@ class CondorG:
 
         if self.cluster_id:
             constraint = "ClusterId==%s" % self.cluster_id
+            if self.proc_id is not None:
+                constraint += " && ProcId==%s" % self.proc_id
             condor = Condor.Condor(self.rsv)
             if not condor.stop_jobs(constraint):
-                self.rsv.log("WARNING", "Could not stop Condor-G jobs.  Constraint: %s" % constraint)
+                self.rsv.log("WARNING", "Could not stop Condor-G jobs.  Constraint: %s", constraint)
                 return False
 
         return True
 
 
-    def get_stdout(self):
-        """ Return the STDOUT of the job """
-        return self.utils.slurp(self.out)
+    def get_stdout(self, buffer_=None):
+        """ Return the STDOUT of the job, bounded like the output of local jobs,
+        or read through buffer_ if one is given """
+        if buffer_ is not None:
+            return Capture.read_into(self.out, buffer_)
+        return Capture.read_file(self.out, Capture.get_head_size(self.rsv.get_trim_length()))
 
     def get_stderr(self):
-        """ Return the STDERR of the job """
-        return self.utils.slurp(self.err)
+        """ Return the STDERR of the job, bounded like the output of local jobs """
+        return Capture.read_file(self.err, Capture.get_head_size(self.rsv.get_trim_length()))
+
+    def get_usage(self, wall):
+        """ Return the resources used by the job (see Ledger.new_usage), from the
+        usage Condor reports in its log """
+        import Ledger
+        (user, system, max_rss) = Ledger.parse_condor_usage(self.get_log_contents())
+        output_bytes = Ledger.file_size(self.out) + Ledger.file_size(self.err)
+        return Ledger.new_usage(wall, user, system, max_rss, output_bytes)
 
     def get_log_contents(self):
-        """ Return the log contents of the job """
+        """ Return the log contents of the job.  For a job in a CondorGBatch this
+        is only the events of this job from the shared log. """
+        if self.events is not None:
+            return "".join([event.text for event in self.events])
         return self.utils.slurp(self.log)
 
+    def get_event_history(self):
+        """ Return the events of the job, one per line, for the records of jobs
+        that failed """
+        if self.events is None:
+            return self.get_log_contents()
+        return CondorLog.format_history(self.events)
+
+
+
+class CondorGBatch:
+    """ Submit the jobs of many grid metrics at once, as one cluster per CE.
+
+    Each metric added gets a CondorG object for its job, with its own output
+    and error files.  The jobs going to the same grid_resource (with the same
+    proxy) are queued in one submit file, with the Executable, Arguments,
+    environment, transfer_input_files, Output and Error of each job given
+    before its Queue command, and share one user log.  wait() watches the log
+    of every cluster and hands each job back as soon as it finishes, so one
+    slow metric does not hold up the results of the others. """
+
+    def __init__(self, rsv, attrs=None):
+        self.rsv = rsv
+        self.attrs = attrs
+        self.tempdir = None
+        # grid_resource commands -> list of CondorG jobs, in the order added
+        self.groups = {}
+        self.order = []
+        self.jobs = []
+
+
+    def __del__(self):
+        """ Do filesystem cleanup """
+        if self.tempdir and os.path.exists(self.tempdir):
+            try:
+                shutil.rmtree(self.tempdir)
+            except OSError, err:
+                self.rsv.log("WARNING", "Could not remove Condor-G temporary directory '%s'.  Error %s", self.tempdir, err)
+
+
+    def add(self, metric, env=None):
+        """ Add the job for metric, with the variables set in env (a JobEnvironment) """
+
+        if self.tempdir is None:
+            self.tempdir = make_tempdir()
+            self.rsv.log("INFO", "Condor-G batch working directory: %s", self.tempdir)
+
+        # The temporary directory belongs to the batch
+        job = CondorG(self.rsv, cleanup=False)
+        job.metric = metric
+        job.env = env
+
+        # The same metric may run against several hosts
+        name = "%s.%s" % (metric.name, len(self.jobs))
+        job.out = os.path.join(self.tempdir, "%s.out" % name)
+        job.err = os.path.join(self.tempdir, "%s.err" % name)
+
+        resource = job.get_grid_resource(metric)
+        if resource not in self.groups:
+            self.groups[resource] = []
+            self.order.append(resource)
+        self.groups[resource].append(job)
+        self.jobs.append(job)
+        return job
+
+
+    def submit(self):
+        """ Submit one cluster for each CE.  Returns the jobs that could not be
+        submitted. """
+
+        failed = []
+        condor = Condor.Condor(self.rsv)
+        for index in range(len(self.order)):
+            resource = self.order[index]
+            jobs = self.groups[resource]
+            log = os.path.join(self.tempdir, "cluster-%s.log" % index)
+
+            submit_file = resource
+            if self.attrs:
+                for key in self.attrs.keys():
+                    submit_file += "%s = %s\n" % (key, self.attrs[key])
+            submit_file += "Log = %s\n" % log
+            submit_file += "Notification = never\n"
+            submit_file += "WhenToTransferOutput = ON_EXIT_OR_EVICT\n\n"
+            for job in jobs:
+                submit_file += job.get_job_commands(job.env, batch=True)
+                submit_file += "Queue\n\n"
+
+            self.rsv.log("INFO", "Submitting %s jobs in one Condor-G cluster", len(jobs))
+            cluster_id = condor.submit_job(submit_file, "cluster-%s" % index, dir=self.tempdir, remove=0)
+            if not cluster_id:
+                failed.extend(jobs)
+                continue
+
+            self.rsv.log("DEBUG", "Condor-G submission job ID - %s", cluster_id)
+            start = time.time()
+            for proc_id in range(len(jobs)):
+                job = jobs[proc_id]
+                job.log = log
+                job.cluster_id = cluster_id
+                job.proc_id = proc_id
+                job.start = start
+                job.deadline = start + job.get_timeout()
+
+        return failed
+
+
+    def wait(self, callback):
+        """ Follow the logs until every submitted job has finished or timed out,
+        calling callback(job, status) for each job as soon as it is done, where
+        status is the same as CondorG.wait() would return """
+
+        running = [job for job in self.jobs if job.cluster_id]
+        logs = {}
+        for job in running:
+            if job.log not in logs:
+                logs[job.log] = CondorLog.CondorLog(job.log)
+        watcher = CondorLog.LogWatcher(self.rsv, logs.keys())
+
+        try:
+            while running:
+                for path in logs.keys():
+                    log = logs[path]
+                    if not log.read():
+                        continue
+                    for job in [job for job in running if job.log == path]:
+                        job.events = log.get_events(job.proc_id)
+                        status = CondorLog.get_status(job.events)
+                        if status is not None:
+                            running.remove(job)
+                            callback(job, job.finish(status))
+
+                now = time.time()
+                for job in [job for job in running if job.deadline <= now]:
+                    self.rsv.log("WARNING", "Condor-G job %s.%s (%s) timed out", job.cluster_id, job.proc_id,
+                                 job.metric.name)
+                    running.remove(job)
+                    job.events = logs[job.log].get_events(job.proc_id)
+                    job.remove()
+                    callback(job, TIMED_OUT)
+
+                if running:
+                    watcher.wait(min([job.deadline for job in running]) - time.time())
+        finally:
+            watcher.close()
+
+        return
+
+
+
+def make_tempdir():
+    """ Make a temporary directory for the submit file, output and log """
+
+    parent_dir = os.path.join("/", "var", "tmp", "rsv")
+    if not os.path.exists(parent_dir):
+        # /var/tmp/rsv can be periodically deleted by system cleanup utilities so we sometimes
+        # have to re-create it
+        os.mkdir(parent_dir, 0755)
+        (uid, gid) = pwd.getpwnam('rsv')[2:4]
+        os.chown(parent_dir, uid, gid)
+    return tempfile.mkdtemp(prefix="condor_g-", dir=parent_dir)
+
 
 def quote_arguments(args):
     """ Generate an Arguments string for a condor submit file with proper quoting """
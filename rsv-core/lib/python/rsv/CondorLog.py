@@ -0,0 +1,243 @@
+#!/usr/bin/python
+
+import os
+import re
+import time
+import errno
+import select
+
+# Condor user log event codes
+SUBMIT                = 0
+EXECUTE               = 1
+EXECUTABLE_ERROR      = 2
+JOB_TERMINATED        = 5
+JOB_ABORTED           = 9
+JOB_HELD              = 12
+GLOBUS_SUBMIT_FAILED  = 18
+GLOBUS_RESOURCE_DOWN  = 20
+REMOTE_ERROR          = 21
+GRID_RESOURCE_DOWN    = 26
+
+# What a job's events mean for CondorG.wait(), which returns these
+JOB_SUCCEEDED = 0
+JOB_WAS_ABORTED = 1
+JOB_FAILED = 2
+SUBMISSION_FAILED = 3
+RESOURCE_DOWN = 4
+
+# The order to decide in when a job has more than one final event.  This is
+# the order of the keywords that were searched for in the whole log before.
+STATUS_ORDER = (JOB_SUCCEEDED, JOB_FAILED, JOB_WAS_ABORTED, SUBMISSION_FAILED, RESOURCE_DOWN)
+
+# e.g. 005 (123.004.000) 10/16 12:00:00 Job terminated.
+EVENT_HEADER_RE = re.compile("^(\d\d\d) \((\d+)\.(\d+)\.(\d+)\) (\S+ \S+) (.*)$")
+
+# The line that ends each event
+EVENT_END = "..."
+
+# How often (seconds) to check the logs when inotify is not available.  Only
+# what was added to a log since the last check is read, so this is cheap.
+DEFAULT_POLL_INTERVAL = 1
+
+# inotify(7) events for a file being written to
+IN_MODIFY = 0x00000002
+
+
+class Event:
+    """ One event from a Condor user log """
+
+    def __init__(self, code, cluster, proc, when, description, details, text):
+        self.code = code
+        self.cluster = cluster
+        self.proc = proc
+        self.time = when
+        self.description = description
+        self.details = details
+        self.text = text
+
+
+    def get_status(self):
+        """ Return the status this event gives its job (see STATUS_ORDER), or
+        None if the job is not finished by it """
+
+        if self.code == JOB_TERMINATED:
+            if self.details and self.details[0].find("return value") >= 0:
+                return JOB_SUCCEEDED
+            # Killed by a signal
+            return JOB_FAILED
+        elif self.code == JOB_ABORTED:
+            return JOB_WAS_ABORTED
+        elif self.code in (EXECUTABLE_ERROR, JOB_HELD, REMOTE_ERROR):
+            return JOB_FAILED
+        elif self.code == GLOBUS_SUBMIT_FAILED:
+            return SUBMISSION_FAILED
+        elif self.code in (GLOBUS_RESOURCE_DOWN, GRID_RESOURCE_DOWN):
+            return RESOURCE_DOWN
+        return None
+
+
+    def summary(self):
+        """ One line describing the event, e.g.
+        10/16 12:00:05 012 Job was held. - Globus error 10: data transfer to the server failed """
+        line = "%s %03d %s" % (self.time, self.code, self.description)
+        if self.details and self.code != SUBMIT:
+            line += " - " + self.details[0]
+        return line
+
+
+class CondorLog:
+    """ A Condor user log that is read as it grows.
+
+    Each read() starts at the byte offset where the last one stopped, so the
+    log is only ever read once however often it is checked.  Complete events
+    are parsed into Event objects and kept, and a partly written event is left
+    for the next read(). """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.partial = ""
+        self.events = []
+
+
+    def read(self):
+        """ Read what was added to the log.  Returns the list of new events. """
+
+        try:
+            fp = open(self.path, 'r')
+        except IOError, err:
+            if err.errno == errno.ENOENT:
+                # Not written yet
+                return []
+            raise
+
+        try:
+            fp.seek(self.offset)
+            data = fp.read()
+        finally:
+            fp.close()
+
+        if not data:
+            return []
+        self.offset += len(data)
+
+        (events, self.partial) = parse_events(self.partial + data)
+        self.events.extend(events)
+        return events
+
+
+    def get_events(self, proc=None):
+        """ Return the events so far, only those of the given proc ID if one is given """
+        if proc is None:
+            return self.events
+        return [event for event in self.events if event.proc == proc]
+
+
+class LogWatcher:
+    """ Sleep until a Condor user log may have changed.
+
+    inotify watches the directories of the logs (a log may not exist until
+    Condor writes its first event), so a waiting process wakes up as soon as
+    an event is written.  Without inotify, wait() sleeps for poll_interval. """
+
+    def __init__(self, rsv, paths, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.rsv = rsv
+        self.poll_interval = poll_interval
+        self.inotify = None
+
+        directories = dict([(os.path.dirname(path), 1) for path in paths]).keys()
+        try:
+            import ConfigWatcher
+            self.inotify = ConfigWatcher.Inotify()
+            for directory in directories:
+                self.inotify.add_watch(directory, IN_MODIFY | ConfigWatcher.IN_CREATE | ConfigWatcher.IN_MOVED_TO)
+        except (ImportError, AttributeError, OSError), err:
+            if self.inotify:
+                self.inotify.close()
+                self.inotify = None
+            self.rsv.log("DEBUG", "inotify is not available (%s).  Checking Condor logs every %s seconds.",
+                         err, self.poll_interval)
+
+
+    def wait(self, timeout):
+        """ Return when a log may have changed, or after timeout seconds """
+
+        if not self.inotify:
+            time.sleep(max(0, min(timeout, self.poll_interval)))
+            return
+
+        try:
+            (readable, writable, exceptional) = select.select([self.inotify.fileno()], [], [], max(0, timeout))
+        except select.error, err:
+            if err[0] != errno.EINTR:
+                raise
+            return
+
+        if readable:
+            self.inotify.read_events()
+        return
+
+
+    def close(self):
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+        return
+
+
+def parse_events(text):
+    """ Parse the complete events in text.  Returns (the list of events, what is
+    left over after the last complete event). """
+
+    events = []
+    start = 0
+    while 1:
+        end = text.find("\n" + EVENT_END, start)
+        if end < 0:
+            break
+        # The end line may still be being written
+        line_end = text.find("\n", end + 1)
+        if line_end < 0:
+            break
+
+        event = parse_event(text[start:line_end + 1])
+        if event:
+            events.append(event)
+        start = line_end + 1
+
+    return (events, text[start:])
+
+
+def parse_event(text):
+    """ Parse the text of one event, including its end line.  Returns None if
+    the text does not start with an event header. """
+
+    lines = text.lstrip("\n").split("\n")
+    match = EVENT_HEADER_RE.match(lines[0])
+    if not match:
+        return None
+
+    details = [line.strip() for line in lines[1:-2] if line.strip()]
+    return Event(int(match.group(1)), int(match.group(2)), int(match.group(3)), match.group(5),
+                 match.group(6).strip(), details, text)
+
+
+def get_status(events):
+    """ Return the status a job with these events finished with (one of
+    STATUS_ORDER), or None if it has not finished """
+
+    statuses = {}
+    for event in events:
+        status = event.get_status()
+        if status is not None:
+            statuses[status] = 1
+
+    for status in STATUS_ORDER:
+        if status in statuses:
+            return status
+    return None
+
+
+def format_history(events):
+    """ The events of a job, one per line, for the records of failed jobs """
+    return "\n".join([event.summary() for event in events])
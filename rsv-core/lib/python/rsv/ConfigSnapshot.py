@@ -0,0 +1,226 @@
+#!/usr/bin/python
+
+import os
+import marshal
+import tempfile
+import ConfigParser
+
+# Bump this whenever the layout of the compiled snapshot changes so that old
+# snapshots are thrown away instead of misread.
+SNAPSHOT_VERSION = 1
+
+# Only INI files are compiled into the snapshot
+CONFIG_EXTENSIONS = [".conf", ".meta"]
+
+class ConfigSnapshot:
+    """ A compiled copy of every INI file in the RSV configuration tree.
+
+    Every rsv-control invocation used to re-parse rsv.conf, consumers.conf and
+    the meta/conf files of every metric, host and consumer it touched.  This
+    class parses the whole tree once and stores the result in a compact binary
+    file, along with a manifest of (path, mtime, size) for every file.  On the
+    next invocation the tree is only stat'ed; if the manifest still matches the
+    snapshot is used as-is, and otherwise only the files that changed are
+    re-parsed. """
+
+    def __init__(self, rsv, config_dir, snapshot_file):
+        self.rsv = rsv
+        self.config_dir = config_dir
+        self.snapshot_file = snapshot_file
+
+        # manifest maps path -> (mtime, size) for every config file on disk.
+        # files maps path -> (defaults, sections) for every file that parsed.
+        self.manifest = {}
+        self.files = {}
+
+        # Paths written by this process since the snapshot was loaded
+        self.dirty = {}
+
+        self.load()
+
+
+    def scan(self):
+        """ Walk the configuration tree and return the current manifest """
+        return scan_tree(self.config_dir)
+
+
+    def load(self):
+        """ Load the snapshot from disk, rebuilding whatever is out of date """
+
+        current = self.scan()
+        (cached_manifest, cached_files) = self.read_snapshot()
+
+        if cached_manifest == current:
+            self.rsv.log("DEBUG", "Using configuration snapshot '%s'", self.snapshot_file)
+            self.manifest = current
+            self.files = cached_files
+            return
+
+        self.rsv.log("INFO", "Rebuilding configuration snapshot '%s'", self.snapshot_file)
+        files = {}
+        for path in current.keys():
+            if path in cached_files and cached_manifest.get(path) == current[path]:
+                files[path] = cached_files[path]
+            else:
+                entry = compile_file(path)
+                if entry is not None:
+                    files[path] = entry
+
+        self.manifest = current
+        self.files = files
+        self.write_snapshot()
+        return
+
+
+    def read_snapshot(self):
+        """ Read the compiled snapshot.  Returns (manifest, files), both empty if
+        the snapshot is missing, unreadable, corrupt or from another version. """
+
+        try:
+            fp = open(self.snapshot_file, 'rb')
+            try:
+                data = marshal.load(fp)
+            finally:
+                fp.close()
+        except (IOError, EOFError, ValueError, TypeError):
+            return {}, {}
+
+        try:
+            if data["version"] != SNAPSHOT_VERSION or data["config_dir"] != self.config_dir:
+                return {}, {}
+            return data["manifest"], data["files"]
+        except (KeyError, TypeError):
+            return {}, {}
+
+
+    def write_snapshot(self):
+        """ Atomically replace the compiled snapshot on disk.  Failure to write it
+        is not an error, the next invocation will simply rebuild it again. """
+
+        data = {"version"    : SNAPSHOT_VERSION,
+                "config_dir" : self.config_dir,
+                "manifest"   : self.manifest,
+                "files"      : self.files}
+
+        snapshot_dir = os.path.dirname(self.snapshot_file)
+        if not os.access(snapshot_dir, os.W_OK):
+            self.rsv.log("DEBUG", "Cannot write configuration snapshot to '%s'", snapshot_dir)
+            return
+
+        temp_path = None
+        try:
+            (file_handle, temp_path) = tempfile.mkstemp(prefix=".config-snapshot.", dir=snapshot_dir)
+            try:
+                os.write(file_handle, marshal.dumps(data))
+            finally:
+                os.close(file_handle)
+            os.chmod(temp_path, 0644)
+            os.rename(temp_path, self.snapshot_file)
+        except (IOError, OSError), err:
+            self.rsv.log("WARNING", "Failed to write configuration snapshot '%s': %s", self.snapshot_file, err)
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        return
+
+
+    def in_tree(self, path):
+        """ Return true if path is inside the configuration tree """
+        return path.startswith(self.config_dir + os.sep)
+
+
+    def exists(self, path):
+        """ os.path.exists() that is answered from the manifest when possible """
+        if path in self.dirty or not self.in_tree(path):
+            return os.path.exists(path)
+        elif os.path.splitext(path)[1] in CONFIG_EXTENSIONS:
+            return path in self.manifest
+        return os.path.exists(path)
+
+
+    def is_readable(self, path):
+        """ os.access(path, os.R_OK) that is answered from the snapshot when possible """
+        if path in self.files:
+            return True
+        return os.access(path, os.R_OK)
+
+
+    def read(self, config_obj, path):
+        """ Load a file into config_obj, the same way config_obj.read(path) would.
+        Files that are not in the snapshot (e.g. --extra-config-file, or files that
+        failed to parse) are read from disk so errors surface exactly as before. """
+
+        entry = self.files.get(path)
+        if entry is None:
+            return config_obj.read(path)
+
+        (defaults, sections) = entry
+        for (option, value) in defaults:
+            config_obj.set(ConfigParser.DEFAULTSECT, option, value)
+
+        for (section, items) in sections:
+            if not config_obj.has_section(section):
+                config_obj.add_section(section)
+            for (option, value) in items:
+                config_obj.set(section, option, value)
+
+        return [path]
+
+
+    def invalidate(self, path):
+        """ Forget what we know about a file (e.g. because we just wrote it) so that
+        later reads in this process go to disk.  The on-disk snapshot will notice the
+        new mtime the next time it is loaded. """
+
+        self.dirty[path] = 1
+        if path in self.files:
+            del self.files[path]
+        if path in self.manifest:
+            del self.manifest[path]
+        return
+
+
+def scan_tree(config_dir):
+    """ Return a manifest mapping path -> (mtime, size) for every configuration
+    file under config_dir """
+
+    manifest = {}
+    for (dirpath, dirnames, filenames) in os.walk(config_dir):
+        # Skip '.svn' and friends
+        dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+
+        for filename in filenames:
+            if os.path.splitext(filename)[1] not in CONFIG_EXTENSIONS:
+                continue
+
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            manifest[path] = (stat.st_mtime, stat.st_size)
+
+    return manifest
+
+
+def compile_file(path):
+    """ Parse a single INI file into a (defaults, sections) tuple of plain lists
+    that marshal can store.  Returns None if the file cannot be read or parsed. """
+
+    if not os.access(path, os.R_OK):
+        return None
+
+    config = ConfigParser.RawConfigParser()
+    config.optionxform = str # make keys case-sensitive
+    try:
+        if path not in (config.read(path) or []):
+            return None
+    except ConfigParser.Error:
+        return None
+
+    defaults = config.defaults().items()
+    sections = []
+    for section in config.sections():
+        sections.append((section, config.items(section)))
+
+    return defaults, sections
@@ -0,0 +1,315 @@
+#!/usr/bin/python
+
+import os
+import time
+import errno
+import struct
+
+import ConfigSnapshot
+
+# inotify(7) constants
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ISDIR       = 0x40000000
+IN_NONBLOCK    = 04000
+IN_CLOEXEC     = 02000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+# struct inotify_event, without the trailing name
+EVENT_HEADER = "iIII"
+EVENT_HEADER_SIZE = struct.calcsize(EVENT_HEADER)
+
+# How often (seconds) to scan the tree when inotify is not available
+DEFAULT_POLL_INTERVAL = 10
+
+
+class Inotify:
+    """ Minimal ctypes interface to the Linux inotify API.  The constructor raises
+    ImportError (no ctypes) or OSError (no inotify) if it cannot be used. """
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.get_errno = ctypes.get_errno
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = self.get_errno()
+            raise OSError(err, "inotify_init1: %s" % os.strerror(err))
+
+        # watch descriptor -> directory
+        self.watches = {}
+
+
+    def fileno(self):
+        return self.fd
+
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """ Watch a directory.  Returns the watch descriptor. """
+        wd = self.libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            err = self.get_errno()
+            raise OSError(err, "inotify_add_watch: %s" % os.strerror(err), path)
+        self.watches[wd] = path
+        return wd
+
+
+    def read_events(self):
+        """ Return a list of (path, mask) for every pending event without blocking """
+
+        events = []
+        while 1:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError, err:
+                if err.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            if not data:
+                break
+
+            offset = 0
+            while offset + EVENT_HEADER_SIZE <= len(data):
+                (wd, mask, cookie, length) = struct.unpack(EVENT_HEADER, data[offset:offset + EVENT_HEADER_SIZE])
+                offset += EVENT_HEADER_SIZE
+                name = data[offset:offset + length].rstrip("\0")
+                offset += length
+
+                directory = self.watches.get(wd)
+                if mask & IN_IGNORED:
+                    # The directory was removed or unwatched
+                    if wd in self.watches:
+                        del self.watches[wd]
+                    continue
+
+                if directory is None:
+                    events.append((None, mask))
+                elif name:
+                    events.append((os.path.join(directory, name), mask))
+                else:
+                    events.append((directory, mask))
+
+        return events
+
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        return
+
+
+class ConfigWatcher:
+    """ Notice changes to the RSV configuration for long-running processes.
+
+    Short-lived rsv-control invocations read the configuration once and exit, but
+    a process that keeps RSV loaded (like rsvd) would otherwise keep running with
+    the configuration it started with.  The watcher notices files that are
+    changed by 'rsv-control --enable' or by hand and drops only the cached state
+    that came from them: the metric definition in the MetricCatalog, the host in
+    the HostRegistry, rsv.conf or consumers.conf.  Other interested parties can
+    subscribe() to be told which paths changed.
+
+    inotify is used when it is available.  Otherwise the tree is stat'ed every
+    poll_interval seconds, the same way ConfigSnapshot checks it. """
+
+    def __init__(self, rsv, config_dir, metrics_dir, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.rsv = rsv
+        self.config_dir = config_dir
+        self.metrics_dir = metrics_dir
+        self.poll_interval = poll_interval
+        self.subscribers = []
+
+        self.inotify = None
+        self.manifest = None
+        self.installed_metrics = None
+        self.next_scan = 0
+
+        try:
+            self.inotify = Inotify()
+            self.watch_tree(self.config_dir)
+            self.inotify.add_watch(self.metrics_dir, IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO)
+            self.rsv.log("INFO", "Watching '%s' for configuration changes using inotify", self.config_dir)
+        except (ImportError, AttributeError, OSError), err:
+            if self.inotify:
+                self.inotify.close()
+                self.inotify = None
+            self.rsv.log("INFO", "inotify is not available (%s).  Checking '%s' for changes every %s seconds.",
+                         err, self.config_dir, self.poll_interval)
+            self.manifest = ConfigSnapshot.scan_tree(self.config_dir)
+            self.installed_metrics = self.list_metrics_dir()
+            self.next_scan = time.time() + self.poll_interval
+
+
+    def subscribe(self, callback):
+        """ Call callback(paths) with the list of changed paths after each change """
+        self.subscribers.append(callback)
+
+
+    def fileno(self):
+        """ Return a file descriptor that becomes readable when there are changes to
+        check for, or None if check() must simply be called periodically """
+        if self.inotify:
+            return self.inotify.fileno()
+        return None
+
+
+    def watch_tree(self, top):
+        """ Watch top and every directory below it.  Returns the configuration files
+        found, which matters for directories that were just created. """
+
+        found = []
+        for (dirpath, dirnames, filenames) in os.walk(top):
+            dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            self.inotify.add_watch(dirpath)
+            for filename in filenames:
+                if os.path.splitext(filename)[1] in ConfigSnapshot.CONFIG_EXTENSIONS:
+                    found.append(os.path.join(dirpath, filename))
+        return found
+
+
+    def list_metrics_dir(self):
+        try:
+            return dict.fromkeys(os.listdir(self.metrics_dir), 1)
+        except OSError:
+            return {}
+
+
+    def check(self):
+        """ Look for changes, drop the state they affect and tell the subscribers.
+        Returns the list of changed paths. """
+
+        if self.inotify:
+            paths = self.read_inotify()
+        else:
+            paths = self.scan()
+
+        if paths:
+            self.invalidate(paths)
+            for callback in self.subscribers:
+                callback(paths)
+
+        return paths
+
+
+    def read_inotify(self):
+        """ Turn pending inotify events into a list of changed paths """
+
+        paths = {}
+        for (path, mask) in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW or path is None:
+                # Events were lost, so assume that everything changed
+                return [self.config_dir, self.metrics_dir]
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and path.startswith(self.config_dir):
+                    try:
+                        for found in self.watch_tree(path):
+                            paths[found] = 1
+                    except OSError:
+                        pass
+                continue
+
+            if path.startswith(self.metrics_dir + os.sep):
+                paths[path] = 1
+            elif os.path.splitext(path)[1] in ConfigSnapshot.CONFIG_EXTENSIONS:
+                paths[path] = 1
+
+        return paths.keys()
+
+
+    def scan(self):
+        """ Compare the tree against the last scan, at most every poll_interval seconds """
+
+        now = time.time()
+        if now < self.next_scan:
+            return []
+        self.next_scan = now + self.poll_interval
+
+        paths = []
+        manifest = ConfigSnapshot.scan_tree(self.config_dir)
+        for path in manifest.keys():
+            if self.manifest.get(path) != manifest[path]:
+                paths.append(path)
+        for path in self.manifest.keys():
+            if path not in manifest:
+                paths.append(path)
+        self.manifest = manifest
+
+        installed = self.list_metrics_dir()
+        for name in installed.keys():
+            if name not in self.installed_metrics:
+                paths.append(os.path.join(self.metrics_dir, name))
+        for name in self.installed_metrics.keys():
+            if name not in installed:
+                paths.append(os.path.join(self.metrics_dir, name))
+        self.installed_metrics = installed
+
+        return paths
+
+
+    def invalidate(self, paths):
+        """ Drop the cached state that came from the changed paths """
+
+        snapshot = self.rsv.config_snapshot
+        catalog = self.rsv.get_metric_catalog()
+        registry = self.rsv.get_host_registry()
+
+        for path in paths:
+            if path == self.config_dir or path == self.metrics_dir:
+                self.rsv.log("INFO", "Reloading all configuration")
+                for known in snapshot.manifest.keys():
+                    snapshot.invalidate(known)
+                self.rsv.setup_config()
+                self.rsv.setup_log_format()
+                self.rsv.setup_consumer_config()
+                catalog.invalidate()
+                registry.clear()
+                return
+
+            if path.startswith(self.metrics_dir + os.sep):
+                self.rsv.log("INFO", "Installed metrics changed: '%s'", path)
+                catalog.rescan()
+                catalog.invalidate(os.path.basename(path))
+                continue
+
+            self.rsv.log("INFO", "Configuration file changed: '%s'", path)
+            snapshot.invalidate(path)
+
+            parts = path[len(self.config_dir) + 1:].split(os.sep)
+            name = os.path.splitext(parts[-1])[0]
+            if len(parts) == 1:
+                if parts[0] == "rsv.conf":
+                    self.rsv.setup_config()
+                    self.rsv.setup_log_format()
+                elif parts[0] == "consumers.conf":
+                    self.rsv.setup_consumer_config()
+                else:
+                    registry.forget(name)
+            elif parts[:-1] == ["metrics"] or parts[:-1] == ["meta", "metrics"]:
+                catalog.invalidate(name)
+
+            # Metric/host configuration and consumer configuration are read each
+            # time a Metric or Consumer is built, so dropping them from the
+            # snapshot is enough.
+
+        return
+
+
+    def close(self):
+        if self.inotify:
+            self.inotify.close()
+        return
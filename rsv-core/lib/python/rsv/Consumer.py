@@ -4,6 +4,9 @@ import os
 import sys
 import ConfigParser
 
+CONF_DIR = os.path.join("/", "etc", "rsv", "consumers")
+META_DIR = os.path.join("/", "etc", "rsv", "meta", "consumers")
+
 class Consumer:
     """ Instantiable class to read and store configuration about a single consumer """
     
@@ -11,13 +14,13 @@ class Consumer:
         # Initialize vars
         self.name = consumer
         self.rsv  = rsv
-        self.conf_dir = os.path.join("/", "etc", "rsv", "consumers")
-        self.meta_dir = os.path.join("/", "etc", "rsv", "meta", "consumers")
+        self.conf_dir = CONF_DIR
+        self.meta_dir = META_DIR
 
         # Find executable
         self.executable = os.path.join("/", "usr", "libexec", "rsv", "consumers", consumer)
         if not os.path.exists(self.executable):
-            rsv.log("ERROR", "Consumer does not exist at %s" % self.executable)
+            rsv.log("ERROR", "Consumer does not exist at %s", self.executable)
             sys.exit(1)
 
         # Load configuration
@@ -40,12 +43,12 @@ class Consumer:
 
         # Load the consumer's meta file
         meta_file = os.path.join(self.meta_dir, self.name + ".meta")
-        if not os.path.exists(meta_file):
-            self.rsv.log("INFO", "Consumer meta file '%s' does not exist" % meta_file)
+        if not self.rsv.config_snapshot.exists(meta_file):
+            self.rsv.log("INFO", "Consumer meta file '%s' does not exist", meta_file)
             return
         else:
             try:
-                self.config.read(meta_file)
+                self.rsv.config_snapshot.read(self.config, meta_file)
             except ConfigParser.ParsingError, err:
                 self.rsv.log("CRITICAL", err)
                 # TODO - return exception, don't exit
@@ -54,12 +57,12 @@ class Consumer:
         # Load the consumer's general configuration file
         # Load this after the meta file so it can override that file
         config_file = os.path.join(self.conf_dir, self.name + ".conf")
-        if not os.path.exists(config_file):
-            self.rsv.log("INFO", "Consumer config file '%s' does not exist" % config_file)
+        if not self.rsv.config_snapshot.exists(config_file):
+            self.rsv.log("INFO", "Consumer config file '%s' does not exist", config_file)
             return
         else:
             try:
-                self.config.read(config_file)
+                self.rsv.config_snapshot.read(self.config, config_file)
             except ConfigParser.ParsingError, err:
                 self.rsv.log("CRITICAL", err)
                 # TODO - return exception, don't exit
@@ -72,8 +75,8 @@ class Consumer:
         
         try:
             return self.config.get(self.name, key)
-        except ConfigParser.NoOptionError:
-            self.rsv.log("DEBUG", "consumer.config_get - no key '%s'" % key)
+        except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+            self.rsv.log("DEBUG", "consumer.config_get - no key '%s'", key)
             return None
 
 
@@ -102,12 +105,7 @@ class Consumer:
     def requested_time_format(self):
         """ Determine what time format the consumer is requesting.  Options include
         local, epoch, and GMT """
-
-        try:
-            value = self.config.get(self.name, "timestamp")
-            return value.lower()
-        except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
-            return ""
+        return get_time_format(self.config, self.name)
 
 
     def get_environment(self):
@@ -173,3 +171,28 @@ def get_consumer_defaults(consumer_name):
     # There are currently no consumer defaults
 
     return defaults
+
+
+def get_time_format(config, consumer_name):
+    """ Return the time format set by the 'timestamp' option of the consumer in
+    config: 'local', 'epoch', or '' for UTC """
+
+    try:
+        return config.get(consumer_name, "timestamp").lower()
+    except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+        return ""
+
+
+def read_time_format(consumer_name):
+    """ Return the time format the consumer is requesting, from its meta and
+    config files.  This is for the consumers themselves, which run without an
+    RSV object to build a Consumer with. """
+
+    config = ConfigParser.RawConfigParser()
+    config.optionxform = str
+    try:
+        config.read([os.path.join(META_DIR, consumer_name + ".meta"),
+                     os.path.join(CONF_DIR, consumer_name + ".conf")])
+    except ConfigParser.Error:
+        return ""
+    return get_time_format(config, consumer_name)
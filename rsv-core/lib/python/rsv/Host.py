@@ -22,11 +22,11 @@ class Host:
         """ Load host specific configuration file """
 
         self.config_file = os.path.join(self.conf_dir, self.host + ".conf")
-        if not os.path.exists(self.config_file):
-            self.rsv.log("INFO", "Host config file '%s' does not exist" % self.config_file)
+        if not self.rsv.config_snapshot.exists(self.config_file):
+            self.rsv.log("INFO", "Host config file '%s' does not exist", self.config_file)
         else:
             try:
-                self.config.read(self.config_file)
+                self.rsv.config_snapshot.read(self.config, self.config_file)
             except ConfigParser.ParsingError, err:
                 self.rsv.log("CRITICAL", err)
                 sys.exit(1)
@@ -68,7 +68,7 @@ class Host:
     def write_config_file(self):
         """ Write the config back to the INI file on disk """
         
-        self.rsv.log("INFO", "Writing configuration file '%s'" % self.config_file)
+        self.rsv.log("INFO", "Writing configuration file '%s'", self.config_file)
         
         if not os.path.exists(self.config_file):
             self.rsv.echo("Creating configuration file '%s'" % self.config_file)
@@ -76,3 +76,7 @@ class Host:
         config_fp = open(self.config_file, 'w')
         self.config.write(config_fp)
         config_fp.close()
+        self.rsv.config_snapshot.invalidate(self.config_file)
+
+        # Let everyone sharing this Host see the new set of enabled metrics
+        self.rsv.get_host_registry().refresh(self.host)
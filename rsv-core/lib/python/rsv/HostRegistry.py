@@ -0,0 +1,150 @@
+#!/usr/bin/python
+
+import Host
+
+class HostRegistry:
+    """ Every configured host, loaded once.
+
+    Each host configuration file is read at most once per process.  For every
+    host the registry keeps the enabled metrics (in configuration file order,
+    and as a frozenset for membership tests), plus a reverse index from each
+    metric to the hosts it is enabled on, so the usual questions ('which metrics
+    run on this host?', 'is this metric enabled here?', 'which hosts run this
+    metric?') do not depend on how many hosts are configured. """
+
+    def __init__(self, rsv):
+        self.rsv = rsv
+        self.names = None
+
+        # host name -> Host object
+        self.hosts = {}
+
+        # host name -> tuple/frozenset of enabled metrics
+        self.enabled_list = {}
+        self.enabled_set = {}
+
+        # metric name -> { host name : 1 }
+        self.metric_index = {}
+
+
+    def load(self):
+        """ Load every host that has a configuration file """
+        self.names = self.rsv.get_hosts() or []
+        for name in self.names:
+            if name not in self.hosts:
+                self.hosts[name] = Host.Host(name, self.rsv)
+            self.index_host(name)
+        return
+
+
+    def index_host(self, name):
+        """ (Re)compute the enabled metrics of a host and update the reverse index """
+
+        self.unindex_host(name)
+
+        enabled = tuple(self.hosts[name].get_enabled_metrics())
+        self.enabled_list[name] = enabled
+        self.enabled_set[name] = frozenset(enabled)
+
+        for metric in enabled:
+            self.metric_index.setdefault(metric, {})[name] = 1
+        return
+
+
+    def unindex_host(self, name):
+        """ Remove a host from the reverse index """
+        for metric in self.enabled_set.get(name, ()):
+            hosts = self.metric_index.get(metric)
+            if hosts and name in hosts:
+                del hosts[name]
+                if not hosts:
+                    del self.metric_index[metric]
+        return
+
+
+    def get_host_names(self):
+        """ Return the names of all hosts that have configuration files """
+        if self.names is None:
+            self.load()
+        return self.names
+
+
+    def get_hosts(self):
+        """ Return a Host object for each host that has a configuration file """
+        return [self.hosts[name] for name in self.get_host_names()]
+
+
+    def get_host(self, name):
+        """ Return the Host object for a host.  A host that is not configured yet
+        gets an empty Host which is kept so that later changes to it are seen by
+        everyone who asks. """
+
+        self.get_host_names()
+        if name not in self.hosts:
+            self.hosts[name] = Host.Host(name, self.rsv)
+        return self.hosts[name]
+
+
+    def get_enabled_metrics(self, name):
+        """ Return the metrics enabled on a host, in configuration file order """
+        self.get_host_names()
+        if name not in self.enabled_list:
+            if name not in self.hosts:
+                return []
+            self.index_host(name)
+        return list(self.enabled_list[name])
+
+
+    def metric_enabled(self, name, metric_name):
+        """ Return true if metric_name is enabled on host name """
+        self.get_host_names()
+        if name not in self.enabled_set:
+            return False
+        return metric_name in self.enabled_set[name]
+
+
+    def get_hosts_for_metric(self, metric_name):
+        """ Return the names of the hosts that a metric is enabled on """
+        self.get_host_names()
+        return self.metric_index.get(metric_name, {}).keys()
+
+
+    def refresh(self, name):
+        """ Re-index a host whose configuration changed in this process (e.g. it
+        was just written by --enable) """
+
+        self.get_host_names()
+        if name not in self.hosts:
+            return
+
+        if name not in self.names and self.rsv.config_snapshot.exists(self.hosts[name].config_file):
+            self.names.append(name)
+        self.index_host(name)
+        return
+
+
+    def forget(self, name):
+        """ Drop everything known about a host, so it is read from disk the next
+        time it is needed """
+
+        if self.names is None:
+            return
+
+        self.unindex_host(name)
+        for table in (self.hosts, self.enabled_list, self.enabled_set):
+            if name in table:
+                del table[name]
+
+        # The host may have been added or removed
+        self.names = None
+        return
+
+
+    def clear(self):
+        """ Drop everything, so every host is read from disk again """
+        self.names = None
+        self.hosts = {}
+        self.enabled_list = {}
+        self.enabled_set = {}
+        self.metric_index = {}
+        return
@@ -0,0 +1,35 @@
+#!/usr/bin/python
+
+import os
+import time
+import logging
+
+# json is only in Python 2.6 and later
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+class JSONFormatter(logging.Formatter):
+    """ Format log records as one JSON object per line, for machine parsing.
+
+    Every line has the time, level and message, plus the fields in the context
+    dictionary (see RSV.set_log_context): the run id, and the metric, host and
+    phase of the run when they are known. """
+
+    def __init__(self, context):
+        logging.Formatter.__init__(self)
+        self.context = context
+
+
+    def format(self, record):
+        entry = {"time"    : time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(record.created)),
+                 "level"   : record.levelname,
+                 "pid"     : os.getpid(),
+                 "message" : record.getMessage().strip()}
+        entry.update(self.context)
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, sort_keys=True)
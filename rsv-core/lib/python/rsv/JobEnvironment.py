@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+import os
+
+class JobEnvironment:
+    """ The environment a metric job runs with.
+
+    The environment is never changed in place: with_settings() and with_values()
+    return a new JobEnvironment, and os.environ is left alone.  The job gets it
+    passed straight to the command that runs it (see Sysutils.system), or, for
+    Condor-G jobs, in the 'environment' submit command, so any number of jobs
+    with different environments can be prepared in the same process.
+
+    Besides the full environment, each JobEnvironment remembers which variables
+    were set by the metric, since those are the only ones that make sense to
+    send along with a job to a remote host. """
+
+    def __init__(self, values=None, changed=()):
+        if values is None:
+            values = os.environ
+        self._values = dict(values)
+        self._changed = tuple(changed)
+
+
+    def with_settings(self, settings):
+        """ Return a new JobEnvironment with the settings in the format returned by
+        Metric.get_environment() ({ var : [action, value] }) applied """
+
+        values = dict(self._values)
+        changed = list(self._changed)
+
+        for var in sorted(settings.keys()):
+            (action, value) = settings[var]
+            action = action.upper()
+            if action == "APPEND":
+                if var in values:
+                    values[var] = values[var] + ":" + value
+                else:
+                    values[var] = value
+            elif action == "PREPEND":
+                if var in values:
+                    values[var] = value + ":" + values[var]
+                else:
+                    values[var] = value
+            elif action == "SET":
+                values[var] = value
+            elif action == "UNSET":
+                if var in values:
+                    del values[var]
+            else:
+                continue
+
+            if var not in changed:
+                changed.append(var)
+
+        return JobEnvironment(values, changed)
+
+
+    def with_values(self, values):
+        """ Return a new JobEnvironment with the variables in the values dictionary set """
+        return self.with_settings(dict([(var, ["SET", values[var]]) for var in values.keys()]))
+
+
+    def get_changed(self):
+        """ Return the names of the variables set (or unset) by the metric """
+        return self._changed
+
+
+    def to_dict(self):
+        """ Return a copy of the environment as a plain dictionary, e.g. for subprocess """
+        return dict(self._values)
+
+
+    def condor_environment(self):
+        """ Return the variables set by the metric as the value of a Condor
+        'environment' submit command, in the quoted (new) syntax """
+
+        pairs = []
+        for var in self._changed:
+            if var not in self._values:
+                # There is no way to unset a variable on the remote side
+                continue
+            value = self._values[var].replace('"', '""').replace("'", "''")
+            pairs.append("%s='%s'" % (var, value))
+
+        return '"%s"' % " ".join(pairs)
+
+
+    #
+    # Read-only dictionary interface
+    #
+    def __getitem__(self, var):
+        return self._values[var]
+
+    def __contains__(self, var):
+        return var in self._values
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __setitem__(self, var, value):
+        raise TypeError("JobEnvironment cannot be modified, use with_values()")
+
+    def __delitem__(self, var):
+        raise TypeError("JobEnvironment cannot be modified, use with_settings()")
+
+    def get(self, var, default=None):
+        return self._values.get(var, default)
+
+    def keys(self):
+        return self._values.keys()
+
+    def items(self):
+        return self._values.items()
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+
+import os
+import re
+import time
+
+import StateFile
+
+# Days of history to keep for each metric
+LEDGER_DAYS = 14
+
+# Per-day totals, in this order
+RUNS         = 0
+WALL         = 1
+USER_CPU     = 2
+SYSTEM_CPU   = 3
+MAX_RSS      = 4   # the largest seen, in KB
+OUTPUT_BYTES = 5
+NUM_FIELDS   = 6
+
+
+def new_usage(wall=0.0, user=0.0, system=0.0, max_rss=0, output_bytes=0):
+    """ Return a dictionary describing what one metric run used.  CPU and wall
+    times are in seconds, max_rss in KB (0 if unknown). """
+    return {"wall" : wall, "user" : user, "system" : system,
+            "max_rss" : max_rss, "output_bytes" : output_bytes}
+
+
+def child_usage(child):
+    """ Return the usage of a Supervisor.Child """
+
+    output_bytes = getattr(child.stdout, "size", 0) + getattr(child.stderr, "size", 0)
+    usage = new_usage(child.elapsed or 0.0, output_bytes=output_bytes)
+    if child.rusage:
+        usage["user"] = child.rusage.ru_utime
+        usage["system"] = child.rusage.ru_stime
+        usage["max_rss"] = child.rusage.ru_maxrss
+    return usage
+
+
+def file_size(path):
+    """ Bytes in the file at path, or 0 if there is no such file """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def parse_condor_usage(log_contents):
+    """ Return (user, system) CPU seconds from the 'Total Remote Usage' line of
+    a Condor job's termination event, and the memory usage in KB (or 0) """
+
+    user = system = 0.0
+    max_rss = 0
+
+    match = re.search("Usr (\d+) (\d+):(\d+):(\d+), Sys (\d+) (\d+):(\d+):(\d+)\s+-\s+Total Remote Usage", log_contents)
+    if match:
+        fields = [int(value) for value in match.groups()]
+        user = fields[0] * 86400 + fields[1] * 3600 + fields[2] * 60 + fields[3]
+        system = fields[4] * 86400 + fields[5] * 3600 + fields[6] * 60 + fields[7]
+
+    # Newer Condor versions report "Memory (MB) : Usage Request Allocated"
+    match = re.search("Memory \(MB\)\s*:\s*(\d+)", log_contents)
+    if match:
+        max_rss = int(match.group(1)) * 1024
+
+    return (float(user), float(system), max_rss)
+
+
+def format_performance_data(usage):
+    """ Format usage as Nagios-style performance data for a WLCG record """
+    return "wall=%.2fs cpu_user=%.2fs cpu_system=%.2fs max_rss=%dKB output=%dB" % \
+           (usage["wall"], usage["user"], usage["system"], usage["max_rss"], usage["output_bytes"])
+
+
+class Ledger:
+    """ What each metric's runs cost, per day.
+
+    After every run the wall time, CPU time, memory and output size are added
+    to the metric's totals for the day in a state file under /var/lib/rsv, so
+    'rsv-control --cost-report' can show which metrics are the expensive ones.
+    Only the last LEDGER_DAYS days are kept. """
+
+    def __init__(self, rsv, path):
+        self.rsv = rsv
+        self.state = StateFile.StateFile(rsv, path)
+
+
+    def record(self, metric_name, usage, when=None):
+        """ Add the usage of one run of a metric """
+
+        day = get_day(when)
+        oldest = day - LEDGER_DAYS + 1
+
+        def add(data):
+            days = data.setdefault(metric_name, {})
+            totals = days.get(day) or [0] * NUM_FIELDS
+            totals[RUNS] += 1
+            totals[WALL] += usage["wall"]
+            totals[USER_CPU] += usage["user"]
+            totals[SYSTEM_CPU] += usage["system"]
+            totals[MAX_RSS] = max(totals[MAX_RSS], usage["max_rss"])
+            totals[OUTPUT_BYTES] += usage["output_bytes"]
+            days[day] = totals
+
+            # Forget old days, and metrics that have not run in that time
+            for name in data.keys():
+                for old_day in [d for d in data[name].keys() if d < oldest]:
+                    del data[name][old_day]
+                if not data[name]:
+                    del data[name]
+
+        self.state.update(add)
+        return
+
+
+    def get_costs(self):
+        """ Return a list of (metric, days, totals) with the number of days in the
+        ledger that the metric ran on, and its totals over those days """
+
+        costs = []
+        data = self.state.read()
+        for name in data.keys():
+            totals = [0] * NUM_FIELDS
+            for day_totals in data[name].values():
+                for field in range(NUM_FIELDS):
+                    if field == MAX_RSS:
+                        totals[field] = max(totals[field], day_totals[field])
+                    else:
+                        totals[field] += day_totals[field]
+            costs.append((name, len(data[name]), totals))
+        return costs
+
+
+def get_day(when=None):
+    """ Days since the epoch (local time) """
+    if when is None:
+        when = time.time()
+    return int((when - time.timezone) / 86400)
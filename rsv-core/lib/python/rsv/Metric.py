@@ -7,42 +7,39 @@ import ConfigParser
 
 VALID_OUTPUT_FORMATS = ["wlcg", "wlcg-multiple", "brief"]
 
+CONF_DIR = os.path.join("/", "etc", "rsv", "metrics")
+META_DIR = os.path.join("/", "etc", "rsv", "meta", "metrics")
+METRICS_DIR = os.path.join("/", "usr", "libexec", "rsv", "metrics")
+
 class Metric:
     """ Instantiable class to read and store configuration for a single metric """
 
-    def __init__(self, metric, rsv, host=None, options=None):
+    def __init__(self, metric, rsv, host=None, options=None, base_config=None):
         # Initialize vars
         self.name = metric
         self.rsv  = rsv
-        conf_dir = os.path.join("/", "etc", "rsv", "metrics")
-        meta_dir = os.path.join("/", "etc", "rsv", "meta", "metrics")
 
-        self.meta_file = os.path.join(meta_dir, metric + ".meta")
-        self.top_config_file = os.path.join(conf_dir, metric + ".conf") 
+        self.meta_file = os.path.join(META_DIR, metric + ".meta")
+        self.top_config_file = os.path.join(CONF_DIR, metric + ".conf")
 
-        # Find executable
-        self.executable = os.path.join("/", "usr", "libexec", "rsv", "metrics", metric)
-        if os.path.islink(self.executable) and not os.path.exists(self.executable):
-            rsv.log("ERROR", "Metric is a broken symlink at %s" % self.executable)
-            sys.exit(1)
-        elif not os.path.exists(self.executable):
-            rsv.log("ERROR", "Metric does not exist at %s" % self.executable)
-            sys.exit(1)
+        # Find executable.  Metrics handed out by the MetricCatalog were found by
+        # listing the installed metrics, so the catalog decides when to check.
+        self.executable = os.path.join(METRICS_DIR, metric)
+        if base_config is None:
+            self.check_executable()
 
         self.host = None
         if host:
             self.host = host
-            self.host_config_file = os.path.join(conf_dir, host, metric + ".conf")
-            self.host_allmetrics_config_file = os.path.join(conf_dir, host, "allmetrics.conf")
+            self.host_config_file = os.path.join(CONF_DIR, host, metric + ".conf")
+            self.host_allmetrics_config_file = os.path.join(CONF_DIR, host, "allmetrics.conf")
 
         # Load configuration
-        defaults = get_metric_defaults(metric)
-        self.config = ConfigParser.RawConfigParser()
-        self.config.optionxform = str
-        self.load_config(defaults, options)
+        self.config = None
+        self.load_config(options, base_config)
 
         if not self.validate_config():
-            self.rsv.log("ERROR", "Metric %s is not configured correctly." % self.name)
+            self.rsv.log("ERROR", "Metric %s is not configured correctly.", self.name)
 
         self.ce_type = None
         if options and options.ce_type:
@@ -51,32 +48,19 @@ class Metric:
         return
 
 
-    def load_config_file(self, file, required=0):
-        """ Load a single configuration file """
-        log_level = "INFO"
-        prefix = "Optional"
-        if required:
-            log_level = "ERROR"
-            prefix = "Mandatory"
+    def check_executable(self):
+        """ Exit if the metric's executable is missing """
+        if os.path.islink(self.executable) and not os.path.exists(self.executable):
+            self.rsv.log("ERROR", "Metric is a broken symlink at %s", self.executable)
+            sys.exit(1)
+        elif not os.path.exists(self.executable):
+            self.rsv.log("ERROR", "Metric does not exist at %s", self.executable)
+            sys.exit(1)
 
-        if not os.path.exists(file):
-            self.rsv.log(log_level, "%s config file '%s' does not exist" % (prefix, file))
-        elif not os.access(file, os.R_OK):
-            self.rsv.log("WARNING", "Config file '%s' is not readable by RSV user" % file)
-        else:
-            self.rsv.log("INFO", "Loading config file '%s'" % file)
-            try:
-                ret = self.config.read(file)
-                # Python 2.3 (RHEL-4) does not return anything so we can only do this check
-                # if we get an array back.
-                if ret is not None:
-                    if file not in ret:
-                        self.rsv.log("ERROR", "An unknown error occurred while trying to load config file '%s'" %
-                                     file)
-            except ConfigParser.ParsingError, err:
-                self.rsv.log("CRITICAL", err)
-                sys.exit(1)
 
+    def load_config_file(self, file, required=0):
+        """ Load a single configuration file """
+        read_config_file(self.rsv, self.config, file, required)
         return
 
 
@@ -88,12 +72,13 @@ class Metric:
         above.
 
         """
-        if not os.path.exists(file):
-            self.rsv.log("DEBUG", "Config file '%s' does not exist" % file)
-        elif not os.access(file, os.R_OK):
-            self.rsv.log("WARNING", "Config file '%s' exists but is not readable by RSV user" % file)
+        snapshot = self.rsv.config_snapshot
+        if not snapshot.exists(file):
+            self.rsv.log("DEBUG", "Config file '%s' does not exist", file)
+        elif not snapshot.is_readable(file):
+            self.rsv.log("WARNING", "Config file '%s' exists but is not readable by RSV user", file)
         else:
-            self.rsv.log("INFO", "Loading config file '%s'" % file)
+            self.rsv.log("INFO", "Loading config file '%s'", file)
             try:
                 # Use a separate config parser to read this and then combine
                 # the results into self.config.  Two reasons for this: first,
@@ -105,20 +90,20 @@ class Metric:
                 # [allmetrics env] should go into [foo env], etc).
                 allmetrics = ConfigParser.RawConfigParser()
                 allmetrics.optionxform = str
-                ret = allmetrics.read(file)
+                ret = snapshot.read(allmetrics, file)
                 # Python 2.3 (RHEL-4) does not return anything so we can only do this check
                 # if we get an array back.
                 if ret is not None:
                     if file not in ret:
-                        self.rsv.log("ERROR", "An unknown error occurred while trying to load config file '%s'" % file)
+                        self.rsv.log("ERROR", "An unknown error occurred while trying to load config file '%s'", file)
 
                 # Now combine the sections
                 for section in allmetrics.sections():
                     if section == 'allmetrics args':
-                        self.rsv.log("WARNING", "Config file '%s' contains deprecated section '%s', which will be ignored" % (file, section))
+                        self.rsv.log("WARNING", "Config file '%s' contains deprecated section '%s', which will be ignored", file, section)
                         continue
                     if section not in ['allmetrics', 'allmetrics env']:
-                        self.rsv.log("CRITICAL", "Config file '%s' contains forbidden section '%s'" % (file, section))
+                        self.rsv.log("CRITICAL", "Config file '%s' contains forbidden section '%s'", file, section)
                         sys.exit(1)
                     metric_section = re.sub(r'allmetrics', self.name, section)
                     if not self.config.has_section(metric_section):
@@ -126,8 +111,8 @@ class Metric:
                     for opt in allmetrics.options(section):
                         value = allmetrics.get(section, opt)
                         self.rsv.log("DEBUG",
-                                     "Setting option '%s' for section '%s' to '%s' (from allmetrics section)" %
-                                         (opt, metric_section, value))
+                                     "Setting option '%s' for section '%s' to '%s' (from allmetrics section)",
+                                         opt, metric_section, value)
                         self.config.set(metric_section, opt, value)
             except ConfigParser.ParsingError, err:
                 self.rsv.log("CRITICAL", err)
@@ -136,21 +121,20 @@ class Metric:
         return
 
 
-    def load_config(self, defaults, options=None):
-        """ Load metric configuration files """
-        if defaults:
-            for section in defaults.keys():
-                if not self.config.has_section(section):
-                    self.config.add_section(section)
-
-                for item in defaults[section].keys():
-                    self.config.set(section, item, defaults[section][item])
+    def load_config(self, options=None, base_config=None):
+        """ Load metric configuration files.  The defaults, meta file and general
+        configuration file make up the base definition of the metric, which can be
+        shared between Metric objects (see MetricCatalog).  Host and command line
+        configuration is layered on top of a private copy of it. """
 
-        # Load the metric's meta information file
-        self.load_config_file(self.meta_file, required=1)
-
-        # Load the metric's general configuration file
-        self.load_config_file(self.top_config_file, required=0)
+        if base_config is None:
+            self.config = load_base_config(self.rsv, self.name)
+        elif self.host or (options and options.extra_config_file):
+            self.config = copy_config(base_config)
+        else:
+            # Nothing will be layered on top, so the base definition can be shared
+            self.config = base_config
+            return
 
         # If this is for a specified host, load the metric/host config file and the allmetrics conf file
         if self.host:
@@ -178,8 +162,8 @@ class Metric:
             output_format = self.config_get("output-format").lower()
             if output_format not in VALID_OUTPUT_FORMATS:
                 valid_formats = " ".join(VALID_OUTPUT_FORMATS)
-                self.rsv.log("ERROR", "output-format '%s' is not supported.  Valid formats: %s\n" %
-                        (output_format, valid_formats))
+                self.rsv.log("ERROR", "output-format '%s' is not supported.  Valid formats: %s\n",
+                        output_format, valid_formats)
                 return False
 
         except ConfigParser.NoOptionError:
@@ -196,7 +180,7 @@ class Metric:
         try:
             return self.config.get(self.name, "service-type")
         except ConfigParser.NoOptionError:
-            self.rsv.log("ERROR", "Metric '%s' missing serviceType" % self.name)
+            self.rsv.log("ERROR", "Metric '%s' missing serviceType", self.name)
             return "UNKNOWN"
 
 
@@ -205,7 +189,7 @@ class Metric:
         try:
             return self.config.get(self.name, key)
         except ConfigParser.NoOptionError:
-            self.rsv.log("DEBUG", "metric.config_get - no key '%s'" % key)
+            self.rsv.log("DEBUG", "metric.config_get - no key '%s'", key)
             return None
 
 
@@ -217,10 +201,10 @@ class Metric:
         try:
             return self.config.getboolean(self.name, key)
         except ConfigParser.NoOptionError:
-            self.rsv.log("DEBUG", "metric.config_getboolean - no key '%s'" % key)
+            self.rsv.log("DEBUG", "metric.config_getboolean - no key '%s'", key)
             return None
         except ValueError:
-            self.rsv.log("DEBUG", "metric.config_getboolean - invalid boolean value for key '%s' (%s)" % (key, self.config.get(self.name, key)))
+            self.rsv.log("DEBUG", "metric.config_getboolean - invalid boolean value for key '%s' (%s)", key, self.config.get(self.name, key))
             return None
 
 
@@ -260,20 +244,20 @@ class Metric:
                 valid_actions = ["SET", "UNSET", "APPEND", "PREPEND"]
                 actions_without_value = ["UNSET"]
                 if action not in valid_actions:
-                    self.rsv.log("WARNING", "Invalid environment config setting in section '%s'" % section)
-                    self.rsv.log("WARNING", "Invalid entry: %s = %s" % (var, setting))
-                    self.rsv.log("WARNING", "Action '%s' must be one of (%s)" %
-                                 (action, " ".join(valid_actions)))
+                    self.rsv.log("WARNING", "Invalid environment config setting in section '%s'", section)
+                    self.rsv.log("WARNING", "Invalid entry: %s = %s", var, setting)
+                    self.rsv.log("WARNING", "Action '%s' must be one of (%s)",
+                                 action, " ".join(valid_actions))
                 elif not value and action not in actions_without_value:
-                    self.rsv.log("WARNING", "Invalid environment config setting in section '%s'" % section)
-                    self.rsv.log("WARNING", "Invalid entry: %s = %s" % (var, setting))
+                    self.rsv.log("WARNING", "Invalid environment config setting in section '%s'", section)
+                    self.rsv.log("WARNING", "Invalid entry: %s = %s", var, setting)
                     self.rsv.log("WARNING", "Format must be VAR = ACTION | VALUE")
                     self.rsv.log("WARNING", "\t(VALUE may be blank if ACTION is 'UNSET')")
                 else:
                     env[var] = [action, value]
 
         except ConfigParser.NoSectionError:
-            self.rsv.log("INFO", "No environment section in metric configuration", 4)
+            self.rsv.log("INFO", "No environment section in metric configuration", indent=4)
 
         return env
 
@@ -288,21 +272,21 @@ class Metric:
             for option in self.config.options(args_section):
                 args += ["--%s" % option, self.config.get(args_section, option)]
         except ConfigParser.NoSectionError:
-            self.rsv.log("INFO", "No '%s' section found" % args_section, 4)
+            self.rsv.log("INFO", "No '%s' section found", args_section, indent=4)
 
         # RSVv3 requires a few more arguments
         if self.config_val("probe-spec", "v3"):
             # We always need to tell RSVv3 about where the proxy is
             proxy_file = self.rsv.get_proxy()
             if proxy_file:
-                self.rsv.log("INFO", "Adding -x because probe version is v3", 4)
+                self.rsv.log("INFO", "Adding -x because probe version is v3", indent=4)
                 args += ["-x", proxy_file]
 
-            self.rsv.log("INFO", "Adding --verbose because probe version is v3", 4)
+            self.rsv.log("INFO", "Adding --verbose because probe version is v3", indent=4)
             args += ["--verbose"]
 
 
-        self.rsv.log("INFO", "Arguments: '%s'" % args, 4)
+        self.rsv.log("INFO", "Arguments: '%s'", args, indent=4)
 
         return args
 
@@ -343,7 +327,7 @@ class Metric:
 
         cron = {}
         if len(arr) != 5:
-            self.rsv.log("ERROR", "cron-interval is invalid: '%s'" % interval)
+            self.rsv.log("ERROR", "cron-interval is invalid: '%s'", interval)
         else:
             cron["Minute"]     = arr[0]
             cron["Hour"]       = arr[1]
@@ -365,7 +349,7 @@ class Metric:
         try:
             return int(interval)
         except (TypeError, ValueError):
-            self.rsv.log("ERROR", "probe-interval is invalid: '%s'" % interval)
+            self.rsv.log("ERROR", "probe-interval is invalid: '%s'", interval)
             return 0
 
     def get_timeout(self):
@@ -374,12 +358,12 @@ class Metric:
         # check 'timeout' option first, but generate a warning if used
         try:
             timeout = self.config.getint(self.name, 'timeout')
-            self.rsv.log("INFO", "Custom timeout (%s seconds) is set for metric '%s'" % (timeout, self.name))
+            self.rsv.log("INFO", "Custom timeout (%s seconds) is set for metric '%s'", timeout, self.name)
             self.rsv.log("WARNING", ("Deprecated 'timeout' option used for metric '%s', " 
-                                     "please use 'job-timeout' instead") % self.name)
+                                     "please use 'job-timeout' instead"), self.name)
             return timeout
         except ValueError:
-            self.rsv.log("WARNING", "A non-integer value is set for timeout for metric '%s'" % self.name)
+            self.rsv.log("WARNING", "A non-integer value is set for timeout for metric '%s'", self.name)
         except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
             # It's expected that this won't be defined most of the time
             pass
@@ -387,10 +371,10 @@ class Metric:
         # then try 'job-timeout'
         try:
             timeout = self.config.getint(self.name, 'job-timeout')
-            self.rsv.log("INFO", "Custom job-timeout (%s seconds) is set for metric '%s'" % (timeout, self.name))
+            self.rsv.log("INFO", "Custom job-timeout (%s seconds) is set for metric '%s'", timeout, self.name)
             return timeout
         except ValueError:
-            self.rsv.log("WARNING", "A non-integer value is set for job-timeout for metric '%s'" % self.name)
+            self.rsv.log("WARNING", "A non-integer value is set for job-timeout for metric '%s'", self.name)
             return None
         except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
             # It's expected that this won't be defined most of the time
@@ -422,7 +406,7 @@ class Metric:
         """ Return the list of required files to transfer for a probe. """
         try:
             transfer_files = self.config.get(self.name, "transfer-files")
-            self.rsv.log("INFO", "List of files to transfer: %s" % transfer_files)
+            self.rsv.log("INFO", "List of files to transfer: %s", transfer_files)
         except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
             self.rsv.log("INFO", "No files to transfer are declared.")
             return None
@@ -501,20 +485,93 @@ class Metric:
 
         for knob in knobs:
             if knob.find('=') == -1:
-                self.rsv.log("WARNING", "Invalid knob supplied (%s).  Must be Key=Value" % knob)
+                self.rsv.log("WARNING", "Invalid knob supplied (%s).  Must be Key=Value", knob)
                 continue
 
             (key, val) = knob.split('=', 1)
-            self.rsv.log("INFO", "Setting config value (%s=%s)" % (key, val))
+            self.rsv.log("INFO", "Setting config value (%s=%s)", key, val)
             local_config.set(section, key, val)
 
         fp = open(file, 'w')
         local_config.write(fp)
         fp.close()
+        self.rsv.config_snapshot.invalidate(file)
 
         return
 
 
+def new_config():
+    """ Return an empty metric configuration object """
+    config = ConfigParser.RawConfigParser()
+    config.optionxform = str
+    return config
+
+
+def copy_config(config):
+    """ Return a private copy of a metric configuration object """
+    new = new_config()
+    for (option, value) in config.defaults().items():
+        new.set(ConfigParser.DEFAULTSECT, option, value)
+    for section in config.sections():
+        new.add_section(section)
+        for (option, value) in config.items(section):
+            new.set(section, option, value)
+    return new
+
+
+def read_config_file(rsv, config, file, required=0):
+    """ Load a single configuration file into config """
+    log_level = "INFO"
+    prefix = "Optional"
+    if required:
+        log_level = "ERROR"
+        prefix = "Mandatory"
+
+    snapshot = rsv.config_snapshot
+    if not snapshot.exists(file):
+        rsv.log(log_level, "%s config file '%s' does not exist", prefix, file)
+    elif not snapshot.is_readable(file):
+        rsv.log("WARNING", "Config file '%s' is not readable by RSV user", file)
+    else:
+        rsv.log("INFO", "Loading config file '%s'", file)
+        try:
+            ret = snapshot.read(config, file)
+            # Python 2.3 (RHEL-4) does not return anything so we can only do this check
+            # if we get an array back.
+            if ret is not None:
+                if file not in ret:
+                    rsv.log("ERROR", "An unknown error occurred while trying to load config file '%s'",
+                            file)
+        except ConfigParser.ParsingError, err:
+            rsv.log("CRITICAL", err)
+            sys.exit(1)
+
+    return
+
+
+def load_base_config(rsv, metric_name):
+    """ Load the host-independent definition of a metric: its defaults, its meta
+    information file and its general configuration file """
+
+    config = new_config()
+
+    defaults = get_metric_defaults(metric_name)
+    for section in defaults.keys():
+        if not config.has_section(section):
+            config.add_section(section)
+
+        for item in defaults[section].keys():
+            config.set(section, item, defaults[section][item])
+
+    # Load the metric's meta information file
+    read_config_file(rsv, config, os.path.join(META_DIR, metric_name + ".meta"), required=1)
+
+    # Load the metric's general configuration file
+    read_config_file(rsv, config, os.path.join(CONF_DIR, metric_name + ".conf"), required=0)
+
+    return config
+
+
 def get_metric_defaults(metric_name):
     """ Load metric default values """
     defaults = {}
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+import Metric
+
+class MetricCatalog:
+    """ Dictionary-like table of every installed metric.
+
+    The host-independent definition of each metric (defaults, meta file and
+    general configuration file) is loaded at most once and shared.  Metrics
+    requested without a host share that definition outright; metric/host pairs
+    get a private copy with the host configuration layered on top, and only
+    when they are asked for. """
+
+    def __init__(self, rsv):
+        self.rsv = rsv
+        self.names = None
+        self.installed = {}
+        self.base_configs = {}
+        self.metrics = {}
+
+
+    def get_names(self):
+        """ Return the sorted list of installed metrics """
+        if self.names is None:
+            self.names = self.rsv.get_installed_metrics()
+            self.installed = dict.fromkeys(self.names, 1)
+        return self.names
+
+
+    def is_installed(self, metric_name):
+        """ Return true if the metric is installed """
+        self.get_names()
+        return metric_name in self.installed
+
+
+    def get_base_config(self, metric_name):
+        """ Return the shared, host-independent configuration of a metric """
+        if metric_name not in self.base_configs:
+            self.base_configs[metric_name] = Metric.load_base_config(self.rsv, metric_name)
+        return self.base_configs[metric_name]
+
+
+    def get_metric(self, metric_name, host=None, options=None):
+        """ Return a Metric object, optionally for a specific host.  Metrics that
+        are not installed are handed to the Metric constructor so that they are
+        reported the same way as always. """
+
+        if not self.is_installed(metric_name):
+            return Metric.Metric(metric_name, self.rsv, host, options)
+
+        base_config = self.get_base_config(metric_name)
+
+        if not host and not (options and options.extra_config_file):
+            if metric_name not in self.metrics:
+                self.metrics[metric_name] = Metric.Metric(metric_name, self.rsv, base_config=base_config)
+            return self.metrics[metric_name]
+
+        metric = Metric.Metric(metric_name, self.rsv, host, options, base_config=base_config)
+        metric.check_executable()
+        return metric
+
+
+    def rescan(self):
+        """ List the installed metrics again the next time they are needed """
+        self.names = None
+        self.installed = {}
+        return
+
+
+    def invalidate(self, metric_name=None):
+        """ Forget the definition of a metric (or of every metric, including the
+        list of installed metrics) so that it is loaded again when next needed """
+
+        if metric_name is None:
+            self.rescan()
+            self.base_configs = {}
+            self.metrics = {}
+            return
+
+        for table in (self.base_configs, self.metrics):
+            if metric_name in table:
+                del table[metric_name]
+        return
+
+
+    #
+    # Dictionary interface, so this can be used in place of the old
+    # { metric_name : Metric } dictionary returned by RSV.get_metric_info()
+    #
+    def __contains__(self, metric_name):
+        return self.is_installed(metric_name)
+
+    def __iter__(self):
+        return iter(self.get_names())
+
+    def __len__(self):
+        return len(self.get_names())
+
+    def __getitem__(self, metric_name):
+        if not self.is_installed(metric_name):
+            raise KeyError(metric_name)
+        return self.get_metric(metric_name)
+
+    def keys(self):
+        return list(self.get_names())
@@ -4,23 +4,53 @@
 import os
 import re
 import sys
+import time
 import logging
+import calendar
 import ConfigParser
 from pwd import getpwnam
 
 # RSV libraries
-import Host
-import Metric
 import Results
 import Sysutils
 import Consumer
+import HostRegistry
+import StateFile
+import MetricCatalog
+import ConfigSnapshot
 
 # Define base system paths
 OPENSSL_EXE = "/usr/bin/openssl"
 CONFIG_DIR = os.path.join("/", "etc", "rsv")
 LIBEXEC_DIR = os.path.join("/", "usr", "libexec", "rsv")
 LOG_DIR = os.path.join("/", "var", "log", "rsv")
+STATE_DIR = os.path.join("/", "var", "lib", "rsv")
 CONSUMER_CONFIG_FILE = os.path.join(CONFIG_DIR, "consumers.conf")
+CONFIG_SNAPSHOT_FILE = os.path.join(STATE_DIR, "config-snapshot")
+PROXY_STATE_FILE = os.path.join(STATE_DIR, "proxy-state")
+PROXY_RENEWAL_LOCK = os.path.join(STATE_DIR, "proxy-renewal.lock")
+REACHABILITY_FILE = os.path.join(STATE_DIR, "reachability")
+LEDGER_FILE = os.path.join(STATE_DIR, "ledger")
+EMISSION_STATE_FILE = os.path.join(STATE_DIR, "emitted")
+SHAR_CACHE_DIR = os.path.join("/", "var", "tmp", "rsv", "shar-cache")
+
+LOG_LEVELS = {"debug"    : logging.DEBUG,
+              "info"     : logging.INFO,
+              "warning"  : logging.WARNING,
+              "error"    : logging.ERROR,
+              "critical" : logging.CRITICAL}
+# Callers almost always use upper case, so save them the lower() call
+for _name in LOG_LEVELS.keys():
+    LOG_LEVELS[_name.upper()] = LOG_LEVELS[_name]
+del _name
+
+# rsv-control --verbose level -> logging level
+VERBOSITY_LEVELS = {0 : logging.CRITICAL,
+                    1 : logging.WARNING,
+                    2 : logging.INFO,
+                    3 : logging.DEBUG}
+RSVD_SOCKET = os.path.join(STATE_DIR, "rsvd.sock")
+RSVD_CLIENT = os.path.join(LIBEXEC_DIR, "misc", "rsvd-client")
 
 class RSV:
     """ Class to load and store configuration information about this install
@@ -33,9 +63,21 @@ class RSV:
 
         # Initialize some instance vars
         self.consumer_config = None
+        self.config_snapshot = None
+        self.metric_catalog = None
+        self.host_registry = None
         self.config = None
         self.logger = None
+        self.log_handler = None
+        self.log_format = "text"
+        self.log_context = {}
         self.proxy = None
+        self.proxy_state = None
+        self.reachability = None
+        self.ledger = None
+        self.shar_cache = None
+        self.spool = None
+        self.emission_state = None
 
         # For any messages that won't go through the logger
         self.quiet = 0
@@ -47,14 +89,32 @@ class RSV:
         self.results  = Results.Results(self, options)
 
         # Setup the logger
+        self.new_run_id()
         self.init_logging(self.options.verbose)
 
         # Setup the initial configuration
+        self.config_snapshot = ConfigSnapshot.ConfigSnapshot(self, CONFIG_DIR, CONFIG_SNAPSHOT_FILE)
         self.setup_config()
+        self.setup_log_format()
         self.setup_consumer_config()
         return
 
 
+    def set_options(self, options):
+        """ Switch to a new set of command line options.  rsvd uses this to reuse one
+        loaded configuration for every request it handles. """
+        self.options = options
+        self.results.options = options
+
+        self.quiet = 0
+        if self.options.verbose == 0:
+            self.quiet = 1
+
+        self.new_run_id()
+        self.init_logging(self.options.verbose)
+        return
+
+
     def setup_config(self):
         """ Load configuration """
         self.config = ConfigParser.RawConfigParser()
@@ -85,16 +145,16 @@ class RSV:
 
         self.log("INFO", "Reading configuration file " + config_file)
 
-        if not os.path.exists(config_file):
+        if not self.config_snapshot.exists(config_file):
             if required:
-                self.log("ERROR", "missing required configuration file '%s'" % config_file)
+                self.log("ERROR", "missing required configuration file '%s'", config_file)
                 sys.exit(1)
             else:
-                self.log("INFO", "configuration file does not exist '%s'" % config_file, 4)
+                self.log("INFO", "configuration file does not exist '%s'", config_file, indent=4)
                 return
 
         try:
-            config_obj.read(config_file)
+            self.config_snapshot.read(config_obj, config_file)
         except ConfigParser.ParsingError, err:
             self.log("CRITICAL", err)
             sys.exit(1)
@@ -117,8 +177,8 @@ class RSV:
                     metrics.append(entry)
             return metrics
         except OSError, err:
-            self.log("ERROR", "The metrics directory (%s) could not be accessed.  Error msg: %s" %
-                     (metrics_dir, err))
+            self.log("ERROR", "The metrics directory (%s) could not be accessed.  Error msg: %s",
+                     metrics_dir, err)
             return []
 
 
@@ -134,19 +194,21 @@ class RSV:
                     consumers.append(entry)
             return consumers
         except OSError, err:
-            self.log("ERROR", "The consumers directory (%s) could not be accessed.  Error msg: %s" %
-                     (consumers_dir, err))
+            self.log("ERROR", "The consumers directory (%s) could not be accessed.  Error msg: %s",
+                     consumers_dir, err)
             return []
 
 
-    def get_metric_info(self):
-        """ Return a dictionary with information about each installed metric """
+    def get_metric_catalog(self):
+        """ Return the MetricCatalog shared by everything in this process """
+        if self.metric_catalog is None:
+            self.metric_catalog = MetricCatalog.MetricCatalog(self)
+        return self.metric_catalog
 
-        metrics = {}
-        for metric in self.get_installed_metrics():
-            metrics[metric] = Metric.Metric(metric, self)
 
-        return metrics
+    def get_metric_info(self):
+        """ Return a dictionary-like object with information about each installed metric """
+        return self.get_metric_catalog()
 
 
 
@@ -167,18 +229,20 @@ class RSV:
             return hosts
         except OSError:
             # todo - check for permission problem
-            self.log("ERROR", "The conf directory does not exist (%s)" % conf_dir)
+            self.log("ERROR", "The conf directory does not exist (%s)", conf_dir)
 
 
 
-    def get_host_info(self):
-        """ Return a list containing one Host instance for each configured host """
+    def get_host_registry(self):
+        """ Return the HostRegistry shared by everything in this process """
+        if self.host_registry is None:
+            self.host_registry = HostRegistry.HostRegistry(self)
+        return self.host_registry
 
-        hosts = []
-        for host in self.get_hosts():
-            hosts.append(Host.Host(host, self))
 
-        return hosts
+    def get_host_info(self):
+        """ Return a list containing one Host instance for each configured host """
+        return self.get_host_registry().get_hosts()
 
 
 
@@ -186,44 +250,96 @@ class RSV:
         """ Initialize the logger """
 
         self.logger = logging.getLogger()
-        if verbosity == 0:
-            self.logger.setLevel(logging.CRITICAL)
-        elif verbosity == 1:
-            self.logger.setLevel(logging.WARNING)
-        elif verbosity == 2:
-            self.logger.setLevel(logging.INFO)
-        elif verbosity == 3:
-            self.logger.setLevel(logging.DEBUG)
+        self.logger.setLevel(VERBOSITY_LEVELS.get(verbosity, logging.WARNING))
+
+        # Replace our handler if we are called again so messages are not duplicated.
+        # sys.stderr is looked up each time in case it has been replaced (rsvd does).
+        if self.log_handler:
+            self.logger.removeHandler(self.log_handler)
 
         stream = logging.StreamHandler(sys.stderr)
-        formatter = logging.Formatter("%(levelname)s: %(message)s")
-        stream.setFormatter(formatter)
+        stream.setFormatter(self.get_log_formatter())
 
         self.logger.addHandler(stream)
+        self.log_handler = stream
+
+
+    def get_log_formatter(self):
+        """ Return the formatter selected by log-format in rsv.conf """
+        if self.log_format == "json":
+            import JSONFormatter
+            return JSONFormatter.JSONFormatter(self.log_context)
+        return logging.Formatter("%(levelname)s: %(message)s")
 
 
-    def log(self, level, message, indent=0):
+    def setup_log_format(self):
+        """ Switch the log format to the one in rsv.conf.  Called once rsv.conf has
+        been read, since logging has to work while it is being read. """
+
+        try:
+            log_format = self.config.get("rsv", "log-format").lower()
+        except ConfigParser.NoOptionError:
+            log_format = "text"
+
+        if log_format not in ("text", "json"):
+            self.log("WARNING", "Invalid value for log-format: must be 'text' or 'json'")
+            log_format = "text"
+
+        if log_format != self.log_format:
+            self.log_format = log_format
+            self.log_handler.setFormatter(self.get_log_formatter())
+        return
+
+
+    def set_log_context(self, **context):
+        """ Set fields (metric, host, phase) that are added to every log line in
+        the JSON log format.  A value of None removes the field. """
+        for key in context.keys():
+            if context[key] is None:
+                if key in self.log_context:
+                    del self.log_context[key]
+            else:
+                self.log_context[key] = context[key]
+        return
+
+
+    def new_run_id(self):
+        """ Start a new run id, which ties together the log lines of one run """
+        self.log_context.clear()
+        self.log_context["run_id"] = "%x-%x" % (int(time.time()), os.getpid())
+        return
+
+
+    def log_enabled(self, level):
+        """ Return true if messages at this level would be logged.  Use it to skip
+        building expensive messages. """
+        return self.logger.isEnabledFor(LOG_LEVELS.get(level) or LOG_LEVELS.get(level.lower(), 0))
+
+
+    def log(self, level, message, *args, **kwargs):
         """ Interface to logger. Accepted logging levels are (case insensitive):
         debug, info, warning, error, critical.
+
+        As with the logging module, message is a format string which is only
+        combined with args if the message is going to be logged.  The only
+        keyword argument is indent, the number of spaces to indent the message.
         """
-        level = level.lower()
 
+        levelno = LOG_LEVELS.get(level)
+        if levelno is None:
+            levelno = LOG_LEVELS.get(level.lower())
+            if levelno is None:
+                self.logger.warning("Invalid level (%s) passed to RSV.log.", level)
+                levelno = logging.WARNING
+
+        if not self.logger.isEnabledFor(levelno):
+            return
+
+        indent = kwargs.get("indent", 0)
         if indent > 0:
             message = " "*indent + message
 
-        if level == "debug":
-            self.logger.debug(message)
-        elif level == "info":
-            self.logger.info(message)
-        elif level == "warning":
-            self.logger.warning(message)
-        elif level == "error":
-            self.logger.error(message)
-        elif level == "critical":
-            self.logger.critical(message)
-        else:
-            self.logger.warning("Invalid level (%s) passed to RSV.log." % level)
-            self.logger.warning(message)
+        self.logger.log(levelno, message, *args)
 
     def echo(self, message, indent=0):
         """ Print a message unless verbosity level==0 (quiet) """
@@ -324,13 +440,20 @@ class RSV:
             self.set_enabled_consumers(enabled_consumers)
             self.write_consumer_config_file()
 
+        # Records written from now on are not for this consumer, and the ones
+        # it has not processed yet do not need to be kept for it
+        try:
+            self.get_spool().unsubscribe(consumer_name)
+        except OSError, err:
+            self.log("WARNING", "Cannot remove the spool cursor of consumer '%s': %s", consumer_name, err)
+
         return
 
 
     def write_consumer_config_file(self):
         """ Write out the consumers.conf file to disk """
 
-        self.log("INFO", "Writing consumer configuration file '%s'" % CONSUMER_CONFIG_FILE)
+        self.log("INFO", "Writing consumer configuration file '%s'", CONSUMER_CONFIG_FILE)
 
         if not os.path.exists(CONSUMER_CONFIG_FILE):
             self.echo("Creating configuration file '%s'" % CONSUMER_CONFIG_FILE)
@@ -338,6 +461,7 @@ class RSV:
         config_fp = open(CONSUMER_CONFIG_FILE, 'w')
         self.consumer_config.write(config_fp)
         config_fp.close()
+        self.config_snapshot.invalidate(CONSUMER_CONFIG_FILE)
 
 
     def get_extra_globus_rsl(self):
@@ -350,9 +474,99 @@ class RSV:
 
     def get_wrapper(self):
         """ Return the wrapper script that will run the metrics """
+        if self.use_rsvd():
+            return RSVD_CLIENT
         return os.path.join("/", "usr", "bin", "rsv-control")
 
 
+    def use_rsvd(self):
+        """ Return True if metric jobs should hand their runs to rsvd instead of
+        starting rsv-control themselves.  Defaults to False. """
+
+        try:
+            value = self.config.get("rsv", "use-rsvd")
+            if value.lower() == "true":
+                return True
+        except ConfigParser.NoOptionError:
+            pass
+
+        return False
+
+
+    def use_performance_data(self):
+        """ Return True if records should include the resources used by the metric
+        run as performanceData.  Defaults to False. """
+
+        try:
+            value = self.config.get("rsv", "performance-data")
+            if value.lower() == "true":
+                return True
+        except ConfigParser.NoOptionError:
+            pass
+
+        return False
+
+
+    def get_ledger(self):
+        """ Return the ledger of the resources used by metric runs """
+        if self.ledger is None:
+            import Ledger
+            self.ledger = Ledger.Ledger(self, LEDGER_FILE)
+        return self.ledger
+
+
+    def get_shar_cache(self):
+        """ Return the cache of shar files for globus-job-run, or None if
+        shar-cache-size is 0 """
+
+        if self.shar_cache is None:
+            try:
+                size = self.config.getint("rsv", "shar-cache-size")
+            except (ConfigParser.NoOptionError, ValueError):
+                self.log("WARNING", "shar-cache-size must be an integer.  Not caching shar files.")
+                size = 0
+
+            if size <= 0:
+                return None
+
+            import SharCache
+            self.shar_cache = SharCache.SharCache(self, SHAR_CACHE_DIR, size * 1024 * 1024)
+
+        return self.shar_cache
+
+
+    def get_emission_state(self):
+        """ Return the state file with the last record sent to each consumer that
+        only gets changes (see Results.select_consumers) """
+        if self.emission_state is None:
+            self.emission_state = StateFile.StateFile(self, EMISSION_STATE_FILE)
+        return self.emission_state
+
+
+    def get_spool_durability(self):
+        """ Return spool-durability: 'none', 'batch' or 'always' """
+
+        try:
+            durability = self.config.get("rsv", "spool-durability").lower()
+        except ConfigParser.NoOptionError:
+            return "batch"
+
+        if durability not in ("none", "batch", "always"):
+            self.log("WARNING", "Invalid value for spool-durability: must be 'none', 'batch' or 'always'")
+            return "batch"
+        return durability
+
+
+    def get_spool(self):
+        """ Return the spool the result records for consumers are written to """
+        if self.spool is None:
+            import Spool
+            def log(message):
+                self.log("WARNING", "%s", message)
+            self.spool = Spool.Spool(log=log)
+        return self.spool
+
+
     def get_proxy(self):
         """ Return the path of the proxy file being used """
         return self.proxy
@@ -365,7 +579,7 @@ class RSV:
         self.log("INFO", "Checking proxy:")
 
         if metric.config_val("need-proxy", "false"):
-            self.log("INFO", "Skipping proxy check because need-proxy=false", 4)
+            self.log("INFO", "Skipping proxy check because need-proxy=false", indent=4)
             return
 
         # First look for the service certificate.  Since this is the preferred option,
@@ -378,7 +592,7 @@ class RSV:
             self.proxy = service_proxy
             return
         except ConfigParser.NoOptionError:
-            self.log("INFO", "Not using service certificate.  Checking for user proxy", 4)
+            self.log("INFO", "Not using service certificate.  Checking for user proxy", indent=4)
             pass
 
         # If the service certificate is not available, look for a user proxy file
@@ -398,34 +612,40 @@ class RSV:
     def renew_service_certificate_proxy(self, metric, cert, key, proxy):
         """ Check the service certificate.  If it is expiring soon, renew it. """
 
-        self.log("INFO", "Using service certificate proxy", 4)
+        self.log("INFO", "Using service certificate proxy", indent=4)
 
         hours_til_expiry = 6
-        seconds_til_expiry = str(hours_til_expiry * 60 * 60)
-        (ret, out, err) = self.run_command([OPENSSL_EXE, "x509", "-in", proxy, "-noout", "-enddate", "-checkend", seconds_til_expiry])
+        seconds_til_expiry = hours_til_expiry * 60 * 60
+        (valid, out) = self.check_proxy_lifetime(proxy, seconds_til_expiry)
 
-        if ret == 0:
-            self.log("INFO", "Service certificate valid for at least %s hours." % hours_til_expiry, 4)
+        if valid:
+            self.log("INFO", "Service certificate valid for at least %s hours.", hours_til_expiry, indent=4)
         else:
-            self.log("INFO", "Service certificate proxy expired or expiring within %s hours.  Renewing it." %
-                    hours_til_expiry, 4)
-
-            cmd = ["grid-proxy-init", "-cert", cert, "-key", key, "-valid", "12:00", "-bits", "1024", "-debug", "-out", proxy]
-            if self.use_legacy_proxy():
-                self.log("INFO", "Generating a legacy Globus proxy because it was requested.", 4)
-                # This should come right after "grid-proxy-init"
-                cmd.insert(1, "-old")
-
-            (ret, out, err) = self.run_command(cmd)
-
-            if ret:
-                self.results.service_proxy_renewal_failed(metric, cert, key, proxy, out, err)
-                sys.exit(1)
-
-        # Globus needs help finding the service proxy since it probably does not have the
-        # default naming scheme of /tmp/x509_u<UID>
-        os.environ["X509_USER_PROXY"] = proxy
-        os.environ["X509_PROXY_FILE"] = proxy
+            # Only one process renews the proxy at a time.  Metrics that start at the
+            # same time would otherwise all run grid-proxy-init on the same file.
+            lock = StateFile.lock_file(self, PROXY_RENEWAL_LOCK)
+            try:
+                # Another process may have renewed it while we waited for the lock
+                (valid, out) = self.check_proxy_lifetime(proxy, seconds_til_expiry)
+                if valid:
+                    self.log("INFO", "Service certificate proxy was renewed by another process.", indent=4)
+                else:
+                    self.log("INFO", "Service certificate proxy expired or expiring within %s hours.  Renewing it.",
+                             hours_til_expiry, indent=4)
+
+                    cmd = ["grid-proxy-init", "-cert", cert, "-key", key, "-valid", "12:00", "-bits", "1024", "-debug", "-out", proxy]
+                    if self.use_legacy_proxy():
+                        self.log("INFO", "Generating a legacy Globus proxy because it was requested.", indent=4)
+                        # This should come right after "grid-proxy-init"
+                        cmd.insert(1, "-old")
+
+                    (ret, out, err) = self.run_command(cmd)
+
+                    if ret:
+                        self.results.service_proxy_renewal_failed(metric, cert, key, proxy, out, err)
+                        sys.exit(1)
+            finally:
+                StateFile.unlock_file(lock)
 
         return
 
@@ -434,7 +654,7 @@ class RSV:
     def check_user_proxy(self, metric, proxy_file):
         """ Check that a proxy file is valid """
 
-        self.log("INFO", "Using user proxy", 4)
+        self.log("INFO", "Using user proxy", indent=4)
 
         # Check that the file exists on disk
         if not os.path.exists(proxy_file):
@@ -445,29 +665,92 @@ class RSV:
         # doesn't seem to like a proxy that has a lifetime of less than 3 hours anyways,
         # so this check might need to be adjusted if that behavior is more understood.
         minutes_til_expiration = 10
-        seconds_til_expiration = str(minutes_til_expiration * 60)
-        (ret, out, err) = self.run_command([OPENSSL_EXE, "x509", "-in", proxy_file, "-noout", "-enddate", "-checkend", seconds_til_expiration])
+        seconds_til_expiration = minutes_til_expiration * 60
+        (valid, out) = self.check_proxy_lifetime(proxy_file, seconds_til_expiration)
 
-        if ret:
+        if not valid:
             self.results.expired_user_proxy(metric, proxy_file, out, minutes_til_expiration)
             sys.exit(1)
 
-        # Just in case this isn't the default /tmp/x509_u<UID> we'll explicitly set it
-        os.environ["X509_USER_PROXY"] = proxy_file
-        os.environ["X509_PROXY_FILE"] = proxy_file
-
         return
 
 
-    def run_command(self, command, timeout=None):
+    def get_proxy_state(self):
+        """ Return the StateFile that caches the expiration time of proxies """
+        if self.proxy_state is None:
+            self.proxy_state = StateFile.StateFile(self, PROXY_STATE_FILE)
+        return self.proxy_state
+
+
+    def get_reachability(self):
+        """ Return the shared cache of host reachability checks """
+
+        if self.reachability is None:
+            import Reachability
+
+            try:
+                ttl = self.config.getint("rsv", "ping-cache-ttl")
+            except (ConfigParser.NoOptionError, ValueError):
+                self.log("WARNING", "ping-cache-ttl must be an integer.  Not caching ping results.")
+                ttl = 0
+
+            self.reachability = Reachability.Reachability(self, REACHABILITY_FILE, ttl)
+
+        return self.reachability
+
+
+    def check_proxy_lifetime(self, proxy, seconds):
+        """ Return (valid, openssl_output) where valid is true if the proxy will be
+        valid for at least the given number of seconds.
+
+        The expiration time of each proxy is cached in the proxy state file along
+        with the proxy's inode, mtime and size, and shared by every RSV process.
+        openssl only runs if the proxy file changed or the cached expiration time
+        falls inside the window. """
+
+        try:
+            stat = os.stat(proxy)
+            fingerprint = (stat.st_dev, stat.st_ino, stat.st_mtime, stat.st_size)
+        except OSError:
+            fingerprint = None
+
+        if fingerprint:
+            entry = self.get_proxy_state().read().get(proxy)
+            if entry and entry[0] == fingerprint and entry[1] - time.time() > seconds:
+                self.log("INFO", "Proxy '%s' is valid until %s (cached)", proxy,
+                         time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(entry[1])), indent=4)
+                return True, ""
+
+        (ret, out, err) = self.run_command([OPENSSL_EXE, "x509", "-in", proxy, "-noout", "-enddate", "-checkend", str(seconds)])
+
+        not_after = parse_openssl_enddate(out)
+        if fingerprint and not_after:
+            def store(data):
+                data[proxy] = (fingerprint, not_after)
+            self.get_proxy_state().update(store)
+
+        return ret == 0, out
+
+
+    def run_command(self, command, timeout=None, env=None, limit=None, stdout=None):
         """ Wrapper for Sysutils.system """
 
         if not timeout:
             # Use the timeout declared in the config file
             timeout = self.config.getint("rsv", "job-timeout")
 
-        self.log("INFO", "Running command with timeout (%s seconds):\n\t%s" % (timeout, " ".join(command)))
-        return self.sysutils.system(command, timeout)
+        if self.log_enabled("INFO"):
+            self.log("INFO", "Running command with timeout (%s seconds):\n\t%s", timeout, " ".join(command))
+        return self.sysutils.system(command, timeout, env, limit, stdout)
+
+
+    def get_trim_length(self):
+        """ Return details-data-trim-length: the number of bytes of detailsData to
+        keep, or 0 to keep everything """
+        try:
+            return self.config.getint("rsv", "details-data-trim-length")
+        except (ConfigParser.NoOptionError, ValueError):
+            return 10000
 
 
     def use_condor_g(self):
@@ -542,9 +825,31 @@ def get_rsv_defaults():
     # Set the job timeout default in seconds
     set_default_value("rsv", "job-timeout", 1200)
 
+    # How long (seconds) the result of pinging a host is reused by later metric
+    # runs against the same host.  A value of 0 means always ping.
+    set_default_value("rsv", "ping-cache-ttl", 300)
+
+    # The most disk space (MB) used to keep shar files for globus-job-run
+    # between metric runs.  A value of 0 means build a new one for every run.
+    set_default_value("rsv", "shar-cache-size", 16)
+
     return defaults
 
 
+def parse_openssl_enddate(output):
+    """ Return the notAfter time printed by 'openssl x509 -enddate' as seconds since
+    the epoch, or None if it cannot be found """
+
+    match = re.search("notAfter=(.+?)\s*$", output, re.MULTILINE)
+    if not match:
+        return None
+
+    try:
+        return calendar.timegm(time.strptime(match.group(1), "%b %d %H:%M:%S %Y GMT"))
+    except ValueError:
+        return None
+
+
 def validate_config(rsv):
     """ Perform validation on config values.  Note that this is not a class method that
     is called every time we load the configuration because this validation is specific
@@ -560,13 +865,13 @@ def validate_config(rsv):
     try:
         user = rsv.config.get("rsv", "user")
     except ConfigParser.NoOptionError:
-        rsv.log("ERROR", "'user' is missing in rsv.conf.  Set this value to your RSV user", 4)
+        rsv.log("ERROR", "'user' is missing in rsv.conf.  Set this value to your RSV user", indent=4)
         sys.exit(1)
 
     try:
         (desired_uid, desired_gid) = getpwnam(user)[2:4]
     except KeyError:
-        rsv.log("ERROR", "The '%s' user defined in rsv.conf does not exist" % user, 4)
+        rsv.log("ERROR", "The '%s' user defined in rsv.conf does not exist", user, indent=4)
         sys.exit(1)
 
     # If appropriate, switch UID/GID
@@ -574,17 +879,17 @@ def validate_config(rsv):
 
 
     #
-    # "details_data_trim_length" must be an integer because we will use it later
+    # "details-data-trim-length" must be an integer because we will use it later
     # in a splice
     #
     try:
-        rsv.config.getint("rsv", "details_data_trim_length")
+        rsv.config.getint("rsv", "details-data-trim-length")
     except ConfigParser.NoOptionError:
         # We set a default for this, but just to be safe set it again here.
-        rsv.config.set("rsv", "details_data_trim_length", "10000")
+        rsv.config.set("rsv", "details-data-trim-length", "10000")
     except ValueError:
-        rsv.log("ERROR: details_data_trim_length must be an integer.  It is set to '%s'"
-                % rsv.config.get("rsv", "details_data_trim_length"))
+        rsv.log("ERROR", "details-data-trim-length must be an integer.  It is set to '%s'",
+                rsv.config.get("rsv", "details-data-trim-length"))
         sys.exit(1)
 
 
@@ -597,7 +902,7 @@ def validate_config(rsv):
         # We set a default for this, but just to be safe...
         rsv.config.set("rsv", "job-timeout", "1200")
     except ValueError:
-        rsv.log("ERROR", "job-timeout must be an integer.  It is set to '%s'" %
+        rsv.log("ERROR", "job-timeout must be an integer.  It is set to '%s'",
                 rsv.config.get("rsv", "job-timeout"))
         sys.exit(1)
 
@@ -607,7 +912,7 @@ def validate_config(rsv):
     #
     try:
         consumers = rsv.consumer_config.get("consumers", "enabled")
-        rsv.log("INFO", "Registered consumers: %s" % consumers, 0)
+        rsv.log("INFO", "Registered consumers: %s", consumers)
     except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
         if not rsv.consumer_config.has_section("consumers"):
             rsv.consumer_config.add_section("consumers")
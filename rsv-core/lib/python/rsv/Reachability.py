@@ -0,0 +1,79 @@
+#!/usr/bin/python
+
+import time
+
+import StateFile
+
+class Reachability:
+    """ A shared record of whether each monitored host could be reached.
+
+    Before running a metric, rsv-control pings the host it runs against.  With
+    many metrics enabled on a host that used to mean a ping for every one of
+    them.  The outcome of each check is now kept in a state file under
+    /var/lib/rsv that every rsv-control process reads, and is reused until it
+    is older than the TTL (ping-cache-ttl in rsv.conf).
+
+    Each entry is a dictionary with the time of the check, the status ('ok',
+    'failed' or 'timeout'), the method used and whatever details are needed to
+    report a failure the same way as the original check did. """
+
+    def __init__(self, rsv, path, ttl):
+        self.rsv = rsv
+        self.ttl = ttl
+        self.state = StateFile.StateFile(rsv, path)
+
+
+    def lookup(self, host):
+        """ Return the entry for host if it is still fresh, otherwise None """
+
+        if self.ttl <= 0:
+            return None
+
+        entry = self.state.read().get(host)
+        return self.fresh(entry)
+
+
+    def fresh(self, entry):
+        """ Return entry if it is younger than the TTL, otherwise None """
+
+        if not entry:
+            return None
+
+        try:
+            age = time.time() - entry["time"]
+        except (KeyError, TypeError):
+            return None
+
+        if age < 0 or age >= self.ttl:
+            return None
+        return entry
+
+
+    def record(self, host, status, method, **details):
+        """ Store the outcome of a check of host """
+
+        if self.ttl <= 0:
+            return
+
+        entry = {"time" : time.time(), "status" : status, "method" : method}
+        entry.update(details)
+        self.record_many({host : entry})
+        return
+
+
+    def record_many(self, entries):
+        """ Store several entries at once, and drop those that have expired """
+
+        def merge(data):
+            now = time.time()
+            for host in data.keys():
+                try:
+                    if now - data[host]["time"] >= self.ttl:
+                        del data[host]
+                except (KeyError, TypeError):
+                    del data[host]
+            data.update(entries)
+
+        self.state.update(merge)
+        return
+
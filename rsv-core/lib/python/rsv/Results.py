@@ -5,15 +5,29 @@ import os
 import re
 import sys
 import time
-import socket
+import zlib
 import calendar
-import tempfile
 import ConfigParser
 from time import localtime, strftime, strptime, gmtime
 
+# socket is imported where it is used: it is slow to import and many
+# rsv-control commands never generate a record.
+
 UTC_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 LOCAL_TIME_FORMAT = "%Y-%m-%d %H:%M:%S %Z"
 
+TIMESTAMP_RE = re.compile("^timestamp: ([\w:\-]+)", re.MULTILINE)
+
+# emit-policy (for metrics and consumers): 'all' sends every record, 'changes'
+# only sends a record when metricStatus changed since the last one that was
+# sent, or emit-heartbeat seconds have passed since then
+EMIT_POLICIES = ("all", "changes")
+DEFAULT_EMIT_HEARTBEAT = 6 * 3600
+
+# The fields every WLCG record needs (consumers reject records without them)
+REQUIRED_FIELDS = ("metricName", "metricType", "metricStatus", "timestamp", "serviceType",
+                   "summaryData", "detailsData")
+
 def timestamp(local=False):
     """ When generating timestamps, we want to use UTC when communicating with
     the remote collector.  For example:
@@ -50,6 +64,196 @@ def utc_to_epoch(utc_timestamp):
     return calendar.timegm(time_struct)
 
 
+def trim_details_data(record, trim_length):
+    """ Trim the detailsData of a WLCG record to trim_length bytes, leaving the
+    other fields and the EOT terminator alone """
+
+    match = re.search("^detailsData: ?", record, re.MULTILINE)
+    if not match:
+        return record
+
+    start = match.end()
+    end = len(record)
+    match = re.search("\nEOT\s*$", record)
+    if match and match.start() >= start:
+        end = match.start()
+
+    if end - start <= trim_length:
+        return record
+    return record[:start + trim_length] + record[end:]
+
+
+def check_wlcg_record(record):
+    """ Return None if record looks like a valid WLCG record, or else the reason
+    why it is not.  Only the fields before detailsData are looked at. """
+
+    fields = {}
+    start = 0
+    while start < len(record):
+        end = record.find("\n", start)
+        if end < 0:
+            end = len(record)
+        line = record[start:end]
+        start = end + 1
+
+        if line.strip() == "EOT":
+            break
+        match = re.match("(\w+):(.*)$", line)
+        if not match:
+            return "Invalid line: %s" % line[:80]
+        fields[match.group(1)] = match.group(2).strip()
+        if match.group(1) == "detailsData":
+            break
+
+    for field in REQUIRED_FIELDS:
+        if field not in fields:
+            return "Missing %s" % field
+    if not fields["timestamp"]:
+        return "timestamp field is empty"
+    if "hostName" not in fields and not ("serviceURI" in fields and "gatheredAt" in fields):
+        return "Missing either hostName or (serviceURI + gatheredAt)"
+    return None
+
+
+class ResultRecord:
+    """ A WLCG record, parsed once and rendered in the time format each consumer
+    asks for (the 'timestamp' option of the consumer's configuration).
+
+    The record is kept as the text before its timestamp value, the text after
+    it up to detailsData (which must come last), and the detailsData and EOT.
+    Rendering a record joins these around the timestamp in the requested
+    format, and each rendering is kept.  Records are spooled in UTC, and the
+    consumers use this class to render them the way they want.
+
+    A record read from the spool may have its detailsData compressed (packed,
+    with details None).  It is only inflated when the details are needed, so
+    a consumer that only looks at the other fields never pays for it. """
+
+    def __init__(self, before, utc, after, details, epoch=None, packed=None):
+        self.before = before
+        self.utc = utc
+        self.after = after
+        self.details = details
+        self.packed = packed
+        self.epoch = epoch
+        self.extra = ""
+        self.renderings = {}
+
+
+    def get_details(self):
+        """ Return the text from detailsData to the end of the record """
+        if self.details is None:
+            self.details = zlib.decompress(self.packed)
+            self.packed = None
+        return self.details
+
+
+    def has_details(self):
+        return bool(self.packed or self.details)
+
+
+    def get_timestamp(self, time_format):
+        """ Return the timestamp in the given format: 'local', 'epoch' or UTC
+        (anything else).  A timestamp that cannot be parsed is left as it is. """
+
+        if self.utc is None or time_format not in ("local", "epoch"):
+            return self.utc
+
+        if self.epoch is None:
+            try:
+                self.epoch = utc_to_epoch(self.utc)
+            except ValueError:
+                return self.utc
+
+        if time_format == "epoch":
+            return str(self.epoch)
+        return strftime(LOCAL_TIME_FORMAT, localtime(self.epoch))
+
+
+    def render(self, time_format=""):
+        """ Return the text of the record with its timestamp in time_format """
+
+        if time_format not in ("local", "epoch"):
+            time_format = ""
+
+        if time_format not in self.renderings:
+            self.renderings[time_format] = self.get_head(time_format) + self.get_details()
+        return self.renderings[time_format]
+
+
+    def get_head(self, time_format=""):
+        """ Return the text of the record before detailsData, with its timestamp
+        in time_format """
+
+        timestamp_ = self.get_timestamp(time_format)
+        if timestamp_ is None:
+            return self.before + self.after + self.extra
+        return "".join((self.before, timestamp_, self.after, self.extra))
+
+
+    def add_field(self, name, value):
+        """ Add a field to the record, before detailsData """
+        self.extra += "%s: %s\n" % (name, value)
+        self.renderings = {}
+
+
+    def get_field(self, name):
+        """ Return the value of a field that comes before detailsData, or None """
+        match = re.search("^%s:(.*)$" % re.escape(name), self.before + self.after + self.extra, re.MULTILINE)
+        if not match:
+            return None
+        return match.group(1).strip()
+
+
+def get_emit_settings(rsv, name, config_get):
+    """ Return (emit-policy, emit-heartbeat) using config_get, the config_get()
+    of the metric or consumer called name.  Either is None if it is not set or
+    not valid. """
+
+    policy = config_get("emit-policy")
+    if policy is not None:
+        policy = policy.strip().lower()
+        if policy not in EMIT_POLICIES:
+            rsv.log("WARNING", "Invalid value for emit-policy in %s: must be 'all' or 'changes'", name)
+            policy = None
+
+    heartbeat = config_get("emit-heartbeat")
+    if heartbeat is not None:
+        try:
+            heartbeat = int(heartbeat)
+        except ValueError:
+            rsv.log("WARNING", "Invalid value for emit-heartbeat in %s: must be an integer", name)
+            heartbeat = None
+
+    return (policy, heartbeat)
+
+
+def parse_wlcg_record(text, packed=None):
+    """ Return a ResultRecord for the text of a WLCG record.  If packed is
+    given, text is only the part before detailsData and packed is the rest,
+    compressed with zlib.  It is not inflated until it is needed. """
+
+    if packed is not None:
+        head = text
+        details = None
+    else:
+        # Everything from detailsData on stays as it is
+        start = text.find("\ndetailsData:")
+        if text.startswith("detailsData:"):
+            start = 0
+        elif start >= 0:
+            start += 1
+        else:
+            start = len(text)
+        head = text[:start]
+        details = text[start:]
+
+    match = TIMESTAMP_RE.search(head)
+    if not match:
+        return ResultRecord(head, None, "", details, packed=packed)
+    return ResultRecord(head[:match.start(1)], match.group(1), head[match.end(1):], details, packed=packed)
+
+
 class Results:
     """ A class containing code to handle publishing the result records """
     rsv = None
@@ -57,43 +261,70 @@ class Results:
     def __init__(self, rsv, options):
         self.rsv = rsv
         self.options = options
+        self.usage = None
+        self.this_host = None
+        # Records waiting to be written to the spool by flush(), and the
+        # consumers each one is for (None for all of them)
+        self.pending = []
+        self.recipients = []
+        # For each of pending, the emission state entries to record once it
+        # is written (see select_consumers), and those entries by key
+        self.emissions = []
+        self.unwritten = {}
+        # consumer name -> (emit-policy, emit-heartbeat), read once
+        self.consumer_emit_settings = None
+
+
+    def set_usage(self, usage):
+        """ Set the resources used by the current metric run (see Ledger.new_usage),
+        to be included in its records as performanceData.  None leaves it out. """
+        self.usage = usage
 
 
     def wlcg_result(self, metric, record, stderr):
         """ Handle WLCG formatted output """
+        return self.create_records(metric, self.prepare_wlcg_record(record), stderr)
+
+
+    def wlcg_results(self, metric, records, stderr):
+        """ Handle a batch of WLCG records from a wlcg-multiple metric.  Records
+        that are not valid are logged and left out. """
+
+        result_records = []
+        for record in records:
+            error = check_wlcg_record(record)
+            if error:
+                self.rsv.log("WARNING", "Skipping invalid record from %s: %s", metric.name, error)
+                continue
+            result_records.append(self.prepare_wlcg_record(record))
+
+        return self.create_record_batch(metric, result_records, stderr)
+
+
+    def prepare_wlcg_record(self, record):
+        """ Trim a WLCG record and return it as a ResultRecord """
 
         # Trim detailsData using details-data-trim-length
-        trim_length = self.rsv.config.get("rsv", "details-data-trim-length")
+        trim_length = self.rsv.get_trim_length()
         if trim_length > 0:
-            pass
-            #self.rsv.log("INFO", "Trimming data to %s bytes because details-data-trim-length is set" %
-            #        trim_length)
-            # TODO - trim detailsData
+            trimmed_record = trim_details_data(record, trim_length)
+            if len(trimmed_record) < len(record):
+                self.rsv.log("INFO", "Trimming detailsData to %s bytes because details-data-trim-length is set",
+                             trim_length)
+                record = trimmed_record
+
+        result_record = parse_wlcg_record(record)
 
         # A bug was discovered in RSV 3.3.5 that sometimes reads only 2048 bytes of STDOUT.
         # This results in a truncated record.  We will check our record now and if it has a
         # detailsData section but does not end in EOT we are going to add EOT to the end of
         # it.  This could be removed when we fix the Sysutils.System() function but it might
         # be worth leaving in anyways to ensure records are always valid.
-        if re.search("^detailsData:", record, re.MULTILINE):
-            if not re.search("EOT\s*$", record):
-                record += "\nEOT\n"
-
-        # Create a record with a local timestamp.
-        local_record = record
-        match = re.search("timestamp: ([\w:\-]+)", local_record)
-        if match:
-            local_timestamp = utc_to_local(match.group(1))
-            local_record = re.sub("timestamp: [\w\-:]+", "timestamp: %s" % local_timestamp, local_record)
+        details = result_record.details
+        if details and details.rstrip()[-3:] != "EOT":
+            result_record.details += "\nEOT\n"
 
-        # Create a record with the epoch timestamp
-        epoch_record = record
-        match = re.search("timestamp: ([\w:\-]+)", epoch_record)
-        if match:
-            local_timestamp = utc_to_epoch(match.group(1))
-            epoch_record = re.sub("timestamp: [\w\-:]+", "timestamp: %s" % local_timestamp, epoch_record)
-
-        return self.create_records(metric, record, local_record, epoch_record, stderr)
+        return result_record
 
 
     def brief_result(self, metric, status, data, stderr):
@@ -105,42 +336,61 @@ class Results:
         # Trim the data appropriately based on details-data-trim-length.
         # A value of 0 means do not trim it.
         #
-        trim_length = self.rsv.config.get("rsv", "details-data-trim-length")
+        trim_length = self.rsv.get_trim_length()
         if trim_length > 0:
-            self.rsv.log("INFO", "Trimming data to %s bytes because details-data-trim-length is set" %
+            self.rsv.log("INFO", "Trimming data to %s bytes because details-data-trim-length is set",
                          trim_length)
             data = data[:trim_length]
 
-        #
-        # We want to print the time different depending on the consumer
-        #
-        utc_timestamp   = timestamp()
-        local_timestamp = timestamp(local=True)
-        epoch_timestamp = int(time.time())
+        if self.this_host is None:
+            import socket
+            self.this_host = socket.getfqdn()
+
+        record = self.get_summary(metric, status, self.this_host, int(time.time()), data)
+        return self.create_records(metric, record, stderr)
+
+
+    def create_records(self, metric, record, stderr):
+        """ Generate a result record for each consumer from a ResultRecord, and
+        print it to the screen """
+        return self.create_record_batch(metric, [record], stderr)
 
-        this_host = socket.getfqdn()
 
-        utc_summary   = self.get_summary(metric, status, this_host, utc_timestamp,   data)
-        local_summary = self.get_summary(metric, status, this_host, local_timestamp, data)
-        epoch_summary = self.get_summary(metric, status, this_host, epoch_timestamp, data)
+    def create_record_batch(self, metric, records, stderr):
+        """ Generate a result record for each consumer from each ResultRecord,
+        and print them to the screen """
 
-        return self.create_records(metric, utc_summary, local_summary, epoch_summary, stderr)
+        self.rsv.set_log_context(phase="results")
 
+        performance_data = None
+        if self.usage:
+            import Ledger
+            performance_data = Ledger.format_performance_data(self.usage)
 
-    def create_records(self, metric, utc_summary, local_summary, epoch_summary, stderr):
-        """ Generate a result record for each consumer, and print to the screen """
+        self.rsv.log("DEBUG", "STDERR from metric:\n%s\n", stderr)
 
-        # Print the local summary to the screen
-        self.rsv.log("DEBUG", "STDERR from metric:\n%s\n" % stderr)
-        self.rsv.log("INFO", "Result:\n") # separate final output from debug output
-        self.rsv.echo(local_summary)
+        texts = []
+        for record in records:
+            if performance_data:
+                record.add_field("performanceData", performance_data)
+
+            # Print the local summary to the screen
+            self.rsv.log("INFO", "Result:\n") # separate final output from debug output
+            self.rsv.echo(record.render("local"))
+
+            # Records are spooled once for all of the consumers, in UTC.  Each
+            # consumer puts the timestamp in the format it wants when it reads
+            # the record.  The details are kept apart so the spool can compress
+            # them.
+            texts.append((record.get_head(), record.get_details()))
 
         # We don't generate records when run with --test
+        if not self.options.test:
+            (recipients, emissions) = self.select_consumers(metric, records)
+            self.spool_records(texts, recipients, emissions)
+
         if self.options.test:
             self.rsv.echo('No records have been generated because --test was used.')
-        else:
-            for consumer in self.rsv.get_enabled_consumers():
-                self.create_consumer_record(metric, consumer, utc_summary, local_summary, epoch_summary)
 
         # enhance - should we have different exit codes based on status?  I think
         # that just running a probe successfully should be a 0 exit status, but
@@ -149,8 +399,113 @@ class Results:
 
 
 
-    def get_summary(self, metric, status, this_host, time, data):
-        """ Generate a summary string
+    def select_consumers(self, metric, records):
+        """ Apply the emission policies of the metric and of each consumer.
+        Returns two lists with an item for each record: the list of consumers
+        it is for, or None if it is for all of them, and the emission state
+        entries to record once it is written (see record_emissions).
+
+        Where the policy is 'changes', a record is only for the consumer if its
+        metricStatus is not the one last sent to it for the same metric and
+        host, or if emit-heartbeat seconds have passed since then.  What was
+        last sent is kept in a state file, so this holds across runs.  It only
+        goes in the state file once the record is in the spool, so a record
+        that is never written is sent again next time. """
+
+        consumers = self.rsv.get_enabled_consumers(want_objects=0)
+
+        (metric_policy, metric_heartbeat) = get_emit_settings(self.rsv, metric.name, metric.config_get)
+        settings = {}
+        watched = []
+        for consumer in consumers:
+            (policy, heartbeat) = self.get_consumer_emit_settings().get(consumer, (None, None))
+            policy = policy or metric_policy or "all"
+            if heartbeat is None:
+                heartbeat = metric_heartbeat
+            if heartbeat is None:
+                heartbeat = DEFAULT_EMIT_HEARTBEAT
+            settings[consumer] = (policy, heartbeat)
+            if policy == "changes":
+                watched.append(consumer)
+
+        if not watched:
+            return ([None] * len(records), [[]] * len(records))
+
+        now = time.time()
+        # Entries this old are for metrics that stopped running
+        max_age = 2 * max([settings[consumer][1] for consumer in watched] + [86400])
+        data = self.rsv.get_emission_state().read()
+        selections = []
+        emissions = []
+        for record in records:
+            status = record.get_field("metricStatus")
+            host = record.get_field("serviceURI") or record.get_field("hostName")
+            name = record.get_field("metricName") or metric.name
+
+            selected = []
+            emitted = []
+            for consumer in consumers:
+                (policy, heartbeat) = settings[consumer]
+                if policy == "changes":
+                    key = "%s %s %s" % (consumer, name, host)
+                    # Records from earlier in this run are not in the state
+                    # file until they are written
+                    last = self.unwritten.get(key) or data.get(key)
+                    if last and last[0] == status and now - last[1] < heartbeat:
+                        self.rsv.log("INFO", "Not sending %s record for %s on %s to %s: unchanged since %s",
+                                     status, name, host, consumer, strftime(LOCAL_TIME_FORMAT, localtime(last[1])))
+                        continue
+                    self.unwritten[key] = (status, now)
+                    emitted.append((key, status, now, max_age))
+                selected.append(consumer)
+
+            if len(selected) == len(consumers):
+                selections.append(None)
+            else:
+                selections.append(selected)
+            emissions.append(emitted)
+
+        return (selections, emissions)
+
+
+    def record_emissions(self, emissions):
+        """ Record in the emission state what was sent to the consumers with the
+        'changes' policy.  emissions is a list of (key, status, time, max_age)
+        from select_consumers, for records that are now in the spool. """
+
+        if not emissions:
+            return
+
+        # Forget entries that no record in emissions would look at any more
+        now = time.time()
+        max_age = max([entry[3] for entry in emissions])
+
+        def record(data):
+            for (key, status, when, age) in emissions:
+                data[key] = (status, when)
+
+            for key in data.keys():
+                if now - data[key][1] > max_age:
+                    del data[key]
+
+        self.rsv.get_emission_state().update(record)
+        return
+
+
+    def get_consumer_emit_settings(self):
+        """ Return a dictionary with the (emit-policy, emit-heartbeat) of each
+        enabled consumer """
+
+        if self.consumer_emit_settings is None:
+            self.consumer_emit_settings = {}
+            for consumer in self.rsv.get_enabled_consumers():
+                self.consumer_emit_settings[consumer.name] = get_emit_settings(self.rsv, consumer.name,
+                                                                               consumer.config_get)
+        return self.consumer_emit_settings
+
+
+    def get_summary(self, metric, status, this_host, epoch, data):
+        """ Generate a summary record (a ResultRecord) for the time epoch
         Currently metricStatus and summaryData are identical (per RSVv3)
         """
 
@@ -161,74 +516,108 @@ class Results:
             self.rsv.log("CRITICAL", "gs1: metric-type or service-type not defined in config")
             sys.exit(1)
 
-        result  = "metricName: %s\n"   % metric.name
-        result += "metricType: %s\n"   % metric_type
-        result += "timestamp: %s\n"    % time
-        result += "metricStatus: %s\n" % status
-        result += "serviceType: %s\n"  % service_type
-        result += "serviceURI: %s\n"   % metric.host
-        result += "gatheredAt: %s\n"   % this_host
-        result += "summaryData: %s\n"  % status
-        result += "detailsData: %s\n"  % data
-        result += "EOT\n"
+        before = "metricName: %s\nmetricType: %s\ntimestamp: " % (metric.name, metric_type)
+        after  = "\nmetricStatus: %s\nserviceType: %s\nserviceURI: %s\ngatheredAt: %s\nsummaryData: %s\n" % \
+                 (status, service_type, metric.host, this_host, status)
+        details = "detailsData: %s\nEOT\n" % data
 
-        return result
+        return ResultRecord(before, strftime(UTC_TIME_FORMAT, gmtime(epoch)), after, details, epoch)
 
 
 
-    def create_consumer_record(self, metric, consumer, utc_summary, local_summary, epoch_summary):
-        """ Make a file in the consumer records area """
+    def spool_records(self, texts, recipients, emissions):
+        """ Queue the records for the spool, with the consumers each one is for
+        and the emission state entries to record once it is written (see
+        select_consumers).  They are written by flush(), which is called at
+        the end of the run, unless spool-durability is 'always'. """
 
-        # Check/create the directory that we'll put record into
-        output_dir = os.path.join("/", "var", "spool", "rsv", consumer.name)
-
-        if not self.validate_directory(output_dir):
-            self.rsv.log("WARNING", "Cannot write record for consumer '%s'" % consumer.name)
-        else:
-            prefix = metric.name + "."
-            (file_handle, file_path) = tempfile.mkstemp(prefix=prefix, dir=output_dir)
+        for (text, consumers, emitted) in zip(texts, recipients, emissions):
+            if consumers == []:
+                # Not for anybody
+                continue
+            self.pending.append(text)
+            self.recipients.append(consumers)
+            self.emissions.append(emitted)
 
-            self.rsv.log("INFO", "Creating record for %s consumer at '%s'" % (consumer.name, file_path))
+        durability = self.rsv.get_spool_durability()
+        if durability == "always":
+            self.flush(durability)
+        return
 
-            time_format = consumer.requested_time_format()
-            if time_format == "local":
-                os.write(file_handle, local_summary)
-            elif time_format == "epoch":
-                os.write(file_handle, epoch_summary)
-            else:
-                os.write(file_handle, utc_summary)
 
-            os.close(file_handle)
+    def flush(self, durability=None):
+        """ Write the queued records to the spool, once for every enabled
+        consumer.  They all go in one write, unless spool-durability is
+        'always'.  The emission state is only updated for the records that
+        were written. """
+
+        texts = self.pending
+        recipients = self.recipients
+        emissions = self.emissions
+        self.pending = []
+        self.recipients = []
+        self.emissions = []
+        self.unwritten = {}
+
+        consumers = self.rsv.get_enabled_consumers(want_objects=0)
+        if not consumers or not texts:
+            return
+
+        spool = self.rsv.get_spool()
+        if not self.validate_directory(spool.journal_dir) or not self.validate_directory(spool.cursor_dir):
+            self.rsv.log("WARNING", "Cannot write records for consumers: %s", ", ".join(consumers))
+            return
+
+        if durability is None:
+            durability = self.rsv.get_spool_durability()
+        if durability == "always":
+            batches = [([texts[i]], [recipients[i]], [emissions[i]]) for i in range(len(texts))]
+        else:
+            batches = [(texts, recipients, emissions)]
 
+        for (batch, batch_recipients, batch_emissions) in batches:
+            try:
+                (first, last) = spool.add(batch, consumers, durability != "none", batch_recipients)
+            except (IOError, OSError, ValueError), err:
+                self.rsv.log("WARNING", "Failed to write records to the spool in '%s': %s", spool.journal_dir, err)
+                return
+
+            self.rsv.log("INFO", "Wrote records %s to %s for consumers (%s) to the spool in '%s'",
+                         first, last, ", ".join(consumers), spool.journal_dir)
+
+            emitted = []
+            for entries in batch_emissions:
+                emitted.extend(entries)
+            self.record_emissions(emitted)
         return
 
 
     def validate_directory(self, output_dir):
         """ Validate the directory and create it if it does not exist """
 
-        self.rsv.log("DEBUG", "Validating directory '%s'" % output_dir)
+        self.rsv.log("DEBUG", "Validating directory '%s'", output_dir)
 
         if os.path.exists(output_dir):
-            self.rsv.log("DEBUG", "Directory '%s' already exists" % output_dir, 4)
+            self.rsv.log("DEBUG", "Directory '%s' already exists", output_dir, indent=4)
             if os.access(output_dir, os.W_OK):
-                self.rsv.log("DEBUG", "Directory '%s' is writable" % output_dir, 4)
+                self.rsv.log("DEBUG", "Directory '%s' is writable", output_dir, indent=4)
                 return True
             else:
-                self.rsv.log("WARNING", "Directory '%s'is NOT writable by user '%s'" %
-                             (output_dir, self.rsv.get_user()), 4)
+                self.rsv.log("WARNING", "Directory '%s'is NOT writable by user '%s'",
+                             output_dir, self.rsv.get_user(), indent=4)
                 return False
 
 
-        self.rsv.log("INFO", "Creating directory '%s'" % output_dir, 0)
+        self.rsv.log("INFO", "Creating directory '%s'", output_dir)
 
         if not os.access(os.path.dirname(output_dir), os.W_OK):
-            self.rsv.log("WARNING", "insufficient privileges to make directory '%s'." % output_dir, 4)
+            self.rsv.log("WARNING", "insufficient privileges to make directory '%s'.", output_dir, indent=4)
             return False
         else:
             try:
                 os.mkdir(output_dir, 0755)
             except OSError:
-                self.rsv.log("WARNING", "Failed to make directory '%s'." % output_dir, 4)
+                self.rsv.log("WARNING", "Failed to make directory '%s'.", output_dir, indent=4)
                 return False
 
         return True
@@ -335,7 +724,7 @@ class Results:
         data   = "Failed to run job via Condor-G\n\n"
         data  += "Stdout:\n%s\n" % stdout
         data  += "Stderr:\n%s\n" % stderr
-        data  += "Log:\n%s\n" % log
+        data  += "Condor-G job events:\n%s\n" % log
         
         self.brief_result(metric, status, data, stderr="")
 
@@ -344,7 +733,7 @@ class Results:
         """ Condor-G job was aborted while trying to run metric """
         status = "CRITICAL"
         data   = "Condor-G job aborted\n\n"
-        data  += "Log:\n%s\n" % log
+        data  += "Condor-G job events:\n%s\n" % log
 
         self.brief_result(metric, status, data, stderr="")
 
@@ -367,7 +756,7 @@ class Results:
         data   = "Condor-G submission failed to remote host\n\n"
 
         if details:
-            data += "Condor log file:\n%s" % details
+            data += "Condor-G job events:\n%s" % details
 
         self.brief_result(metric, status, data, stderr="")
 
@@ -377,7 +766,7 @@ class Results:
         status = "CRITICAL"
         data   = "Condor-G submission failed because the remote side is down.\n"
         data  += "Make sure that the resource you are trying to monitor is online.\n\n"
-        data  += "Log:\n%s\n" % log
+        data  += "Condor-G job events:\n%s\n" % log
 
         self.brief_result(metric, status, data, stderr="")
 
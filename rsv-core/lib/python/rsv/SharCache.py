@@ -0,0 +1,174 @@
+#!/usr/bin/python
+
+import os
+import pwd
+import time
+import errno
+import tempfile
+
+try:
+    from hashlib import sha1
+except ImportError:
+    # Python 2.4
+    from sha import new as sha1
+
+# A bundle used this recently (seconds) is never evicted, so a job that just
+# got it from the cache can still hand it to globus-job-run
+EVICTION_GRACE = 300
+
+SUFFIX = ".pl"
+
+
+class SharCache:
+    """ Shar bundles for globus-job-run, kept between metric runs.
+
+    A bundle is named after a hash of everything that goes into it: the
+    header that unpacks and runs it, and the name and contents of the metric's
+    executable and of each of its transfer-files.  When any of these change
+    the bundle gets a new name, so a bundle found in the cache is always
+    current and is never rewritten once it is there.  New bundles are written
+    to a temporary file and renamed into place, so concurrent metric runs
+    never see a partial one.
+
+    Every use touches the bundle, and once the cache grows past max_size bytes
+    the least recently used bundles are removed, except those used in the last
+    EVICTION_GRACE seconds. """
+
+    def __init__(self, rsv, directory, max_size):
+        self.rsv = rsv
+        self.directory = directory
+        self.max_size = max_size
+
+
+    def get_key(self, header, files):
+        """ Return the hash naming the bundle of files with header, or None if
+        one of the files cannot be read """
+
+        digest = sha1()
+        digest.update(header)
+        for path in files:
+            try:
+                fp = open(path, 'rb')
+                try:
+                    contents = fp.read()
+                finally:
+                    fp.close()
+            except IOError, err:
+                self.rsv.log("WARNING", "Cannot read %s for the shar cache: %s", path, err)
+                return None
+
+            # Lengths keep the boundaries between names and contents unambiguous
+            digest.update("\0%d\0%s\0%d\0" % (len(path), path, len(contents)))
+            digest.update(contents)
+
+        return digest.hexdigest()
+
+
+    def lookup(self, key):
+        """ Return the path of the bundle named key, or None if it is not cached """
+
+        path = os.path.join(self.directory, key + SUFFIX)
+        try:
+            os.utime(path, None)
+        except OSError, err:
+            if err.errno != errno.ENOENT:
+                self.rsv.log("WARNING", "Cannot use cached shar file %s: %s", path, err)
+            return None
+
+        self.rsv.log("INFO", "Using cached shar file %s", path)
+        return path
+
+
+    def store(self, key, contents):
+        """ Add a bundle to the cache and return its path, or None if it could not
+        be written """
+
+        path = os.path.join(self.directory, key + SUFFIX)
+        try:
+            self.make_directory()
+            (fd, temp_path) = tempfile.mkstemp(prefix=".shar-", dir=self.directory)
+            try:
+                os.write(fd, contents)
+            finally:
+                os.close(fd)
+            os.chmod(temp_path, 0644)
+            # Owned like the cache, so lookup() can touch it whoever runs next
+            stat = os.stat(self.directory)
+            os.chown(temp_path, stat.st_uid, stat.st_gid)
+            os.rename(temp_path, path)
+        except (OSError, IOError), err:
+            self.rsv.log("WARNING", "Cannot add shar file to the cache in %s: %s", self.directory, err)
+            return None
+
+        self.rsv.log("INFO", "Cached shar file %s", path)
+        self.evict()
+        return path
+
+
+    def evict(self, now=None):
+        """ Remove the least recently used bundles until the cache fits in max_size """
+
+        if now is None:
+            now = time.time()
+
+        entries = []
+        total = 0
+        try:
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                if name.startswith(".shar-"):
+                    # Left behind by a run that died while writing
+                    if stat.st_mtime < now - EVICTION_GRACE:
+                        remove(path)
+                    continue
+                if not name.endswith(SUFFIX):
+                    continue
+
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        except OSError, err:
+            self.rsv.log("WARNING", "Cannot clean the shar cache in %s: %s", self.directory, err)
+            return
+
+        entries.sort()
+        for (mtime, size, path) in entries:
+            if total <= self.max_size:
+                break
+            if mtime >= now - EVICTION_GRACE:
+                # Everything from here on is in use
+                break
+            self.rsv.log("DEBUG", "Removing %s from the shar cache", path)
+            remove(path)
+            total -= size
+
+        return
+
+
+    def make_directory(self):
+        """ /var/tmp can be cleaned up by the system, so create the cache
+        directory whenever it is missing.  It belongs to rsv, like its parent,
+        whoever creates it, so metric runs as rsv can add to it after a run as
+        root. """
+
+        try:
+            os.mkdir(self.directory, 0755)
+        except OSError, err:
+            if err.errno != errno.EEXIST:
+                raise
+            return
+
+        (uid, gid) = pwd.getpwnam('rsv')[2:4]
+        os.chown(self.directory, uid, gid)
+        return
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,513 @@
+#!/usr/bin/python
+
+import os
+import re
+import errno
+import fcntl
+import zlib
+import struct
+import tempfile
+
+# Records are appended to a journal in JOURNAL_DIR, and each consumer
+# remembers in CURSOR_DIR how far through it it has got
+SPOOL_DIR = os.path.join("/", "var", "spool", "rsv")
+JOURNAL_DIR = os.path.join(SPOOL_DIR, "journal")
+CURSOR_DIR = os.path.join(SPOOL_DIR, "cursors")
+
+# In JOURNAL_DIR: the index of the segments, and the lock writers take
+INDEX_FILE = "index"
+LOCK_FILE = ".lock"
+
+# e.g. 00000042.seg
+SEGMENT_FORMAT = "%08d.seg"
+SEGMENT_RE = re.compile("^(\d+)\.seg$")
+
+# Records go to a new segment once the current one is this big (bytes)
+SEGMENT_SIZE = 4 * 1024 * 1024
+
+# Every record in a segment is a header and then the record itself.  The
+# header is FRAME_MAGIC, flags (see below), the record's sequence number, the
+# length of the record and its CRC-32.
+FRAME_HEADER = "!2sHQII"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER)
+FRAME_MAGIC = "RR"
+
+# Flags: the record is only for some consumers, whose names come first on a
+# line of their own, separated by commas
+FLAG_RECIPIENTS = 0x0001
+# The record's detailsData (to the end of the record) is compressed with zlib,
+# after the rest of the record and a NUL
+FLAG_COMPRESSED = 0x0002
+
+# detailsData shorter than this (bytes) is not worth compressing
+COMPRESS_MIN_SIZE = 256
+
+# A cursor is the segment and offset of the next record to read, written in
+# place with a fixed width so it never needs a new file
+CURSOR_FORMAT = "%08d %012d\n"
+
+
+class Spool:
+    """ Result records shared by every consumer, in an append-only journal.
+
+    The journal is a series of segment files.  Records are appended to the
+    last segment, each with a length-prefixed header (see FRAME_HEADER), until
+    it reaches SEGMENT_SIZE and a new segment is started.  The index lists each
+    segment with the sequence number of its first record and the length of the
+    complete records in it, so readers never see a record that is still being
+    written, and whatever a writer that died part way through left behind is
+    cut off by the next one.  Writers take a lock while they append, and
+    publish what they wrote by renaming a new index into place.  With sync,
+    the records and the index are on disk before the index is published, and
+    the CRC in each header catches records that did not make it to disk
+    anyway.
+
+    Each consumer has a cursor: the segment and offset of the next record it
+    has to read.  A consumer picks up where it left off with one seek and
+    reads the journal sequentially, however big the backlog.  A consumer
+    subscribes when the first record is written for it after it is enabled,
+    and unsubscribes when it is disabled.  Once every subscribed consumer has
+    gone past a segment, collect() removes it.
+
+    An index that cannot be parsed (say, after a crash with
+    spool-durability 'none') is rebuilt from the records in the segments.
+    Writers and readers both do this, and log it through log(message) if it
+    is given.  The next writer saves the rebuilt index. """
+
+    def __init__(self, journal_dir=JOURNAL_DIR, cursor_dir=CURSOR_DIR, log=None):
+        self.journal_dir = journal_dir
+        self.cursor_dir = cursor_dir
+        self.log = log
+
+
+    def add(self, texts, consumers, sync=False, recipients=None):
+        """ Append each of texts as a record for every one of consumers (the
+        names of the enabled consumers), subscribing those that are not yet.
+        A text can also be a (head, details) pair, the record split at
+        detailsData, and the details are then compressed if that makes them
+        smaller.  If recipients is given, it has the list of consumers each
+        record is for, or None for all of them.  All of the records are written
+        at once, and with sync they are on disk before this returns.  Returns
+        the (first, last) sequence numbers the records were given. """
+
+        lock = self.lock()
+        try:
+            index = self.read_index()
+
+            subscribed = False
+            for consumer in consumers:
+                path = os.path.join(self.cursor_dir, consumer)
+                if read_position(path) is None:
+                    write_file(path, CURSOR_FORMAT % index.get_end(), sync)
+                    subscribed = True
+            if subscribed and sync:
+                sync_directory(self.cursor_dir)
+
+            if not index.segments or index.segments[-1][2] >= SEGMENT_SIZE:
+                index.start_segment()
+            (number, first_sequence, end) = index.segments[-1]
+
+            frames = []
+            first = index.last_sequence + 1
+            for position in range(len(texts)):
+                (flags, text) = pack(texts[position])
+                if recipients and recipients[position] is not None:
+                    flags |= FLAG_RECIPIENTS
+                    text = ",".join(recipients[position]) + "\n" + text
+
+                index.last_sequence += 1
+                frames.append(struct.pack(FRAME_HEADER, FRAME_MAGIC, flags, index.last_sequence, len(text),
+                                          checksum(text)))
+                frames.append(text)
+            data = "".join(frames)
+
+            fd = os.open(os.path.join(self.journal_dir, SEGMENT_FORMAT % number), os.O_WRONLY | os.O_CREAT, 0644)
+            try:
+                # Anything past the end in the index was left by a writer that
+                # did not finish
+                os.ftruncate(fd, end)
+                os.lseek(fd, end, 0)
+                write_all(fd, data)
+                if sync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+
+            # The records are there for readers once the index says so
+            index.segments[-1][2] = end + len(data)
+            index.write(sync)
+            if sync:
+                sync_directory(self.journal_dir)
+        finally:
+            unlock(lock)
+
+        return (first, index.last_sequence)
+
+
+    def read(self, position):
+        """ Read the records from position (a (segment, offset) pair) on.  Yields
+        (the position after the record, its sequence number, the consumers it
+        is for (None for all of them), its text) for each record.  The text of
+        a record with compressed details is a PackedRecord.  All but the
+        position are None for data that is not a record, which is skipped up
+        to the end of its segment. """
+
+        (segment, offset) = position
+        for (number, first_sequence, end) in self.read_index().segments:
+            if number < segment:
+                continue
+            if number > segment:
+                # Past the segment the position was in (or that segment is gone)
+                offset = 0
+            if offset >= end:
+                continue
+
+            fp = open(os.path.join(self.journal_dir, SEGMENT_FORMAT % number), 'rb')
+            try:
+                fp.seek(offset)
+                data = fp.read(end - offset)
+            finally:
+                fp.close()
+
+            start = 0
+            while start < len(data):
+                frame = read_frame(data, start)
+                if frame is None:
+                    yield ((number, end), None, None, None)
+                    break
+                (flags, sequence, text) = frame
+                start += FRAME_HEADER_SIZE + len(text)
+
+                recipients = None
+                if flags & FLAG_RECIPIENTS:
+                    (names, text) = text.split("\n", 1)
+                    recipients = [name for name in names.split(",") if name]
+                if flags & FLAG_COMPRESSED:
+                    (head, packed) = text.split("\0", 1)
+                    text = PackedRecord(head, packed)
+                yield ((number, offset + start), sequence, recipients, text)
+
+        return
+
+
+    def open_cursor(self, consumer):
+        """ Return consumer's Cursor, or None if it is not subscribed """
+        try:
+            return Cursor(os.path.join(self.cursor_dir, consumer))
+        except (IOError, OSError, ValueError):
+            return None
+
+
+    def collect(self):
+        """ Remove the segments that every subscribed consumer has gone past.
+        Returns how many were removed. """
+
+        lock = self.lock()
+        try:
+            index = self.read_index()
+            if not index.segments:
+                return 0
+
+            positions = []
+            for consumer in os.listdir(self.cursor_dir):
+                if consumer.startswith("."):
+                    continue
+                position = read_position(os.path.join(self.cursor_dir, consumer))
+                if position is not None:
+                    positions.append(position)
+
+            # The last segment is kept for the next records.  With no consumers
+            # nobody will read the rest.
+            oldest = index.segments[-1][0]
+            if positions:
+                oldest = min(oldest, min(positions)[0])
+
+            removed = 0
+            while index.segments[0][0] < oldest:
+                remove(os.path.join(self.journal_dir, SEGMENT_FORMAT % index.segments[0][0]))
+                del index.segments[0]
+                removed += 1
+
+            if removed:
+                index.write()
+        finally:
+            unlock(lock)
+
+        return removed
+
+
+    def unsubscribe(self, consumer):
+        """ Forget consumer's cursor, so records are not kept for it any more """
+        remove(os.path.join(self.cursor_dir, consumer))
+        return
+
+
+    def read_index(self):
+        index = Index(os.path.join(self.journal_dir, INDEX_FILE))
+        try:
+            index.read()
+        except ValueError, err:
+            if self.log:
+                self.log("The spool index %s is corrupt (%s).  Rebuilding it from the segments." % (index.path, err))
+            index = self.rebuild_index()
+        return index
+
+
+    def rebuild_index(self):
+        """ Return an Index listing every segment in the journal, up to the last
+        complete record in each """
+
+        index = Index(os.path.join(self.journal_dir, INDEX_FILE))
+        numbers = []
+        for name in os.listdir(self.journal_dir):
+            match = SEGMENT_RE.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+        numbers.sort()
+
+        for number in numbers:
+            fp = open(os.path.join(self.journal_dir, SEGMENT_FORMAT % number), 'rb')
+            try:
+                data = fp.read()
+            finally:
+                fp.close()
+
+            first_sequence = None
+            end = 0
+            while 1:
+                frame = read_frame(data, end)
+                if frame is None:
+                    break
+                (flags, sequence, text) = frame
+                if first_sequence is None:
+                    first_sequence = sequence
+                index.last_sequence = max(index.last_sequence, sequence)
+                end += FRAME_HEADER_SIZE + len(text)
+
+            if first_sequence is None:
+                first_sequence = index.last_sequence + 1
+            index.segments.append([number, first_sequence, end])
+
+        return index
+
+
+    def lock(self):
+        fd = os.open(os.path.join(self.journal_dir, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except IOError:
+            os.close(fd)
+            raise
+        return fd
+
+
+class Index:
+    """ The segments of the journal.  Each segment is a list of its number, the
+    sequence number of its first record, and the length of the complete
+    records in it.  The file has a line with the last sequence number handed
+    out, then a line for each segment. """
+
+    def __init__(self, path):
+        self.path = path
+        self.last_sequence = 0
+        self.segments = []
+
+
+    def read(self):
+        try:
+            fp = open(self.path, 'r')
+            try:
+                lines = fp.read().split("\n")
+            finally:
+                fp.close()
+        except IOError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            return
+
+        # Raises ValueError if the file is not a whole index
+        self.last_sequence = int(lines[0])
+        self.segments = [[int(field) for field in line.split()] for line in lines[1:] if line.strip()]
+        for segment in self.segments:
+            if len(segment) != 3:
+                raise ValueError("bad segment line %s" % segment)
+        return
+
+
+    def write(self, sync=False):
+        lines = ["%d" % self.last_sequence]
+        for segment in self.segments:
+            lines.append("%d %d %d" % tuple(segment))
+        write_file(self.path, "\n".join(lines) + "\n", sync)
+        return
+
+
+    def start_segment(self):
+        if self.segments:
+            number = self.segments[-1][0] + 1
+        else:
+            number = 1
+        self.segments.append([number, self.last_sequence + 1, 0])
+        return
+
+
+    def get_end(self):
+        """ The position after the last record """
+        if not self.segments:
+            return (1, 0)
+        return (self.segments[-1][0], self.segments[-1][2])
+
+
+class Cursor:
+    """ The position of the next record a consumer has to read.  It is updated
+    in place, so moving it past a record costs a single write. """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR)
+        try:
+            self.position = parse_position(os.read(self.fd, 64))
+        except ValueError:
+            self.close()
+            raise
+
+
+    def set(self, position, sync=False):
+        """ Move the cursor to position.  With sync, it is on disk before this
+        returns. """
+        os.lseek(self.fd, 0, 0)
+        write_all(self.fd, CURSOR_FORMAT % position)
+        if sync:
+            os.fsync(self.fd)
+        self.position = position
+        return
+
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        return
+
+
+class PackedRecord:
+    """ A record from the spool whose details are compressed.  head is the text
+    before detailsData, and packed is the rest, compressed with zlib.
+    Results.parse_wlcg_record(head, packed) only inflates it when the details
+    are used. """
+
+    def __init__(self, head, packed):
+        self.head = head
+        self.packed = packed
+
+
+    def get_text(self):
+        return self.head + zlib.decompress(self.packed)
+
+
+def pack(text):
+    """ Return the flags and the data to spool for text, a record or a (head,
+    details) pair """
+
+    if not isinstance(text, tuple):
+        return (0, text)
+
+    (head, details) = text
+    if len(details) >= COMPRESS_MIN_SIZE and head.find("\0") < 0:
+        packed = zlib.compress(details)
+        if len(packed) < len(details):
+            return (FLAG_COMPRESSED, head + "\0" + packed)
+    return (0, head + details)
+
+
+def read_frame(data, start):
+    """ Return (flags, sequence number, text) for the record at start in data,
+    or None if there is not a whole record there """
+
+    if len(data) - start < FRAME_HEADER_SIZE:
+        return None
+    (magic, flags, sequence, length, crc) = struct.unpack(FRAME_HEADER, data[start:start + FRAME_HEADER_SIZE])
+    if magic != FRAME_MAGIC:
+        return None
+    text = data[start + FRAME_HEADER_SIZE:start + FRAME_HEADER_SIZE + length]
+    if len(text) != length or checksum(text) != crc:
+        return None
+    return (flags, sequence, text)
+
+
+def unlock(fd):
+    try:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+    return
+
+
+def parse_position(text):
+    (segment, offset) = text.split()
+    return (int(segment), int(offset))
+
+
+def read_position(path):
+    """ Return the position in the cursor file path, or None if it does not
+    exist or does not hold a position """
+
+    try:
+        fp = open(path, 'r')
+        try:
+            return parse_position(fp.read())
+        finally:
+            fp.close()
+    except (IOError, ValueError):
+        return None
+
+
+def checksum(text):
+    return zlib.crc32(text) & 0xffffffff
+
+
+def sync_directory(path):
+    """ Make sure renames in the directory path are on disk """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return
+
+
+def write_all(fd, data):
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+    return
+
+
+def write_file(path, contents, sync=False):
+    """ Atomically replace path with contents.  A temporary file in the same
+    directory is renamed over it, so readers see all of contents or none. """
+
+    directory = os.path.dirname(path)
+    (fd, temp_path) = tempfile.mkstemp(prefix=".", dir=directory)
+    try:
+        try:
+            write_all(fd, contents)
+            if sync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, path)
+    except:
+        remove(temp_path)
+        raise
+    return
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError, err:
+        if err.errno != errno.ENOENT:
+            raise
+    return
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+import os
+import fcntl
+import marshal
+import tempfile
+
+class StateFile:
+    """ A small dictionary kept in a file under /var/lib/rsv and shared by every
+    RSV process.
+
+    Readers never block: the file is always replaced atomically, so they see
+    either the old or the new contents.  Writers take an exclusive lock on a
+    separate '.lock' file so that concurrent read-modify-write cycles do not
+    lose each other's updates.  State files are only caches, so a missing,
+    corrupt or unwritable file is never an error. """
+
+    def __init__(self, rsv, path):
+        self.rsv = rsv
+        self.path = path
+        self.lock_path = path + ".lock"
+
+
+    def read(self):
+        """ Return the stored dictionary, or an empty one """
+        try:
+            fp = open(self.path, 'rb')
+            try:
+                data = marshal.load(fp)
+            finally:
+                fp.close()
+        except (IOError, EOFError, ValueError, TypeError):
+            return {}
+
+        if not isinstance(data, dict):
+            return {}
+        return data
+
+
+    def write(self, data):
+        """ Atomically replace the stored dictionary.  Returns True on success. """
+
+        state_dir = os.path.dirname(self.path)
+        if not os.access(state_dir, os.W_OK):
+            self.rsv.log("DEBUG", "Cannot write state file '%s'", self.path)
+            return False
+
+        temp_path = None
+        try:
+            (file_handle, temp_path) = tempfile.mkstemp(prefix="." + os.path.basename(self.path) + ".",
+                                                        dir=state_dir)
+            try:
+                os.write(file_handle, marshal.dumps(data))
+            finally:
+                os.close(file_handle)
+            os.chmod(temp_path, 0644)
+            os.rename(temp_path, self.path)
+        except (IOError, OSError, ValueError), err:
+            self.rsv.log("WARNING", "Failed to write state file '%s': %s", self.path, err)
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+        return True
+
+
+    def update(self, function):
+        """ Read the dictionary, let function(data) modify it in place and write it
+        back, all under the lock.  Returns the updated dictionary. """
+
+        lock = lock_file(self.rsv, self.lock_path)
+        try:
+            data = self.read()
+            function(data)
+            self.write(data)
+        finally:
+            unlock_file(lock)
+
+        return data
+
+
+def lock_file(rsv, path, exclusive=True):
+    """ Lock path (creating it if needed) and return the open file descriptor.
+    Blocks until the lock is available.  Returns None if the file cannot be
+    locked, in which case the caller carries on without the lock. """
+
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+    except OSError, err:
+        rsv.log("DEBUG", "Cannot open lock file '%s': %s", path, err)
+        return None
+
+    if exclusive:
+        operation = fcntl.LOCK_EX
+    else:
+        operation = fcntl.LOCK_SH
+
+    try:
+        fcntl.flock(fd, operation)
+    except IOError, err:
+        rsv.log("DEBUG", "Cannot lock '%s': %s", path, err)
+        os.close(fd)
+        return None
+
+    return fd
+
+
+def unlock_file(fd):
+    """ Release a lock taken by lock_file() """
+    if fd is None:
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+    return
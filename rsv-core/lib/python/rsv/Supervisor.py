@@ -0,0 +1,259 @@
+#!/usr/bin/python
+
+import os
+import time
+import errno
+import select
+import signal
+import subprocess
+
+import Capture
+
+# Seconds between SIGTERM and SIGKILL for a child that ran out of time
+DEFAULT_GRACE = 5
+
+# How often (seconds) to check on children that closed their output but have
+# not exited yet
+REAP_INTERVAL = 0.1
+
+
+class Child:
+    """ A command started by a Supervisor.  Once it has finished, exit_code is
+    set like subprocess.Popen.returncode (negative for a signal), and elapsed
+    (wall clock seconds) and rusage (from wait4, or None where that is not
+    available) describe what it used.  timed_out is true if it was killed
+    because it ran past its deadline. """
+
+    def __init__(self, command, process, timeout, stdout, stderr):
+        self.command = command
+        self.process = process
+        self.pid = process.pid
+        self.stdout = stdout
+        self.stderr = stderr
+
+        self.start = time.time()
+        self.deadline = None
+        if timeout:
+            self.deadline = self.start + timeout
+        self.timeout = timeout
+        self.kill_time = None
+
+        # file descriptor -> (pipe, buffer), for the pipes that are still open
+        self.pipes = {}
+
+        self.exit_code = None
+        self.elapsed = None
+        self.rusage = None
+        self.timed_out = False
+
+
+    def finished(self):
+        return self.exit_code is not None
+
+
+class Supervisor:
+    """ Run any number of commands at once, each with its own deadline.
+
+    All output pipes are read with a single poll() loop, into the buffers
+    supplied for each child (see Capture).  A child that runs past its deadline
+    has its whole process group sent SIGTERM, and SIGKILL if it is still there
+    grace seconds later, so processes it started are cleaned up too.  Every
+    child is reaped with wait4(), which also gives its resource usage.
+
+    No signals or alarms are used, so the Supervisor does not interfere with
+    the rest of the process and several children can be timed at once. """
+
+    def __init__(self, grace=DEFAULT_GRACE):
+        self.grace = grace
+        self.children = []
+        self.fds = {}
+        self.poller = select.poll()
+
+
+    def spawn(self, command, timeout=None, env=None, stdout=None, stderr=None, merge_stderr=False):
+        """ Start command in its own process group.  stdout and stderr are buffers
+        (anything with write() and getvalue()) to collect the output in.  With
+        merge_stderr, STDERR goes to the same pipe as STDOUT. """
+
+        if stdout is None:
+            stdout = Capture.BoundedBuffer()
+        if stderr is None and not merge_stderr:
+            stderr = Capture.BoundedBuffer()
+
+        if merge_stderr:
+            stderr_pipe = subprocess.STDOUT
+        else:
+            stderr_pipe = subprocess.PIPE
+
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr_pipe,
+                                   env=env, preexec_fn=os.setpgrp)
+        process.stdin.close()
+
+        child = Child(command, process, timeout, stdout, stderr)
+        self.add_pipe(child, process.stdout, stdout)
+        if not merge_stderr:
+            self.add_pipe(child, process.stderr, stderr)
+
+        self.children.append(child)
+        return child
+
+
+    def add_pipe(self, child, pipe, buffer_):
+        fd = pipe.fileno()
+        child.pipes[fd] = (pipe, buffer_)
+        self.fds[fd] = child
+        self.poller.register(fd, select.POLLIN | select.POLLHUP | select.POLLERR)
+        return
+
+
+    def close_pipe(self, fd):
+        child = self.fds[fd]
+        del self.fds[fd]
+        self.poller.unregister(fd)
+        child.pipes[fd][0].close()
+        del child.pipes[fd]
+        return
+
+
+    def wait(self, child=None):
+        """ Supervise until child (or, without one, every child) has finished """
+
+        while 1:
+            if child is None:
+                running = [c for c in self.children if not c.finished()]
+            elif child.finished():
+                running = []
+            else:
+                running = [child]
+            if not running:
+                return
+
+            self.step()
+
+
+    def step(self):
+        """ Read whatever output is waiting, enforce deadlines and reap children """
+
+        now = time.time()
+        wait = None
+        for child in self.children[:]:
+            if child.finished():
+                continue
+            if not child.pipes:
+                # Output is closed, it should be exiting
+                wait = REAP_INTERVAL
+            next_action = child.kill_time or child.deadline
+            if next_action is not None:
+                remaining = max(0, next_action - now)
+                if wait is None or remaining < wait:
+                    wait = remaining
+
+        if wait is None:
+            timeout = -1
+        else:
+            timeout = int(wait * 1000) + 1
+
+        try:
+            events = self.poller.poll(timeout)
+        except select.error, err:
+            if err[0] != errno.EINTR:
+                raise
+            events = []
+
+        for (fd, event) in events:
+            if fd not in self.fds:
+                continue
+            child = self.fds[fd]
+            buffer_ = child.pipes[fd][1]
+            try:
+                data = os.read(fd, Capture.CHUNK_SIZE)
+            except OSError, err:
+                if err.errno in (errno.EINTR, errno.EAGAIN):
+                    continue
+                data = ""
+            if data:
+                buffer_.write(data)
+            else:
+                self.close_pipe(fd)
+
+        now = time.time()
+        for child in self.children[:]:
+            if child.finished():
+                continue
+            if child.kill_time is not None and now >= child.kill_time:
+                self.signal_group(child, signal.SIGKILL)
+                child.kill_time = None
+            elif child.deadline is not None and now >= child.deadline and not child.timed_out:
+                child.timed_out = True
+                self.signal_group(child, signal.SIGTERM)
+                child.kill_time = now + self.grace
+
+            if not child.pipes or child.timed_out:
+                self.reap(child)
+
+        return
+
+
+    def reap(self, child, block=False):
+        """ Collect the exit status of child if it has exited """
+
+        if block:
+            options = 0
+        else:
+            options = os.WNOHANG
+
+        try:
+            if hasattr(os, "wait4"):
+                (pid, status, rusage) = os.wait4(child.pid, options)
+            else:
+                # Python 2.4
+                (pid, status) = os.waitpid(child.pid, options)
+                rusage = None
+        except OSError, err:
+            if err.errno == errno.EINTR:
+                return
+            if err.errno != errno.ECHILD:
+                raise
+            # Someone else reaped it
+            (pid, status, rusage) = (child.pid, 0, None)
+
+        if pid == 0:
+            return
+
+        if os.WIFSIGNALED(status):
+            child.exit_code = -os.WTERMSIG(status)
+        else:
+            child.exit_code = os.WEXITSTATUS(status)
+        child.elapsed = time.time() - child.start
+        child.rusage = rusage
+
+        # Keep subprocess from waiting for it again
+        child.process.returncode = child.exit_code
+
+        # Anything still holding the pipes open (e.g. a process the child left
+        # behind) does not keep us waiting
+        if child.timed_out:
+            self.signal_group(child, signal.SIGKILL)
+        for fd in child.pipes.keys():
+            self.close_pipe(fd)
+
+        self.children.remove(child)
+        return
+
+
+    def signal_group(self, child, signum):
+        """ Send a signal to the process group of child """
+        try:
+            os.killpg(child.pid, signum)
+        except OSError, err:
+            if err.errno != errno.ESRCH:
+                raise
+        return
+
+
+    def kill_all(self):
+        """ Kill every child that is still running and reap it """
+        for child in self.children[:]:
+            self.signal_group(child, signal.SIGKILL)
+            self.reap(child, block=True)
+        return
@@ -0,0 +1,410 @@
+#!/usr/bin/python
+
+import os
+import time
+import errno
+import select
+import socket
+import struct
+import ConfigParser
+
+# Ports that answer for each service-type.  When a host does not answer ICMP
+# (or we are not allowed to send it) a TCP connection to one of these shows
+# that the host is up.  A refused connection counts: the host answered.
+SERVICE_PORTS = {
+    "OSG-CE"          : (2119, 9619),
+    "OSG-GRAM-CE"     : (2119,),
+    "OSG-HTCondor-CE" : (9619,),
+    "OSG-SRM"         : (8443,),
+    "xroot"           : (1094,),
+    "GridFTP"         : (2811,),
+    }
+
+# Seconds each host has to answer, like 'ping -W 3'
+DEFAULT_TIMEOUT = 3
+
+# Never use more than this many sockets at once
+MAX_SOCKETS = 1024
+
+ICMP_ECHO_REPLY   = 0
+ICMP_DEST_UNREACH = 3
+ICMP_ECHO_REQUEST = 8
+ICMP_HEADER = "!BBHHH"
+ICMP_HEADER_SIZE = struct.calcsize(ICMP_HEADER)
+
+
+class Sweep:
+    """ Check whether many hosts can be reached, concurrently, from one process.
+
+    Every host gets an ICMP echo request (if we are allowed to send one) and a
+    non-blocking TCP connection to each of its service ports.  The first answer
+    marks the host as up.  A host that has not answered when its deadline
+    passes, or whose probes all failed, is down.  All of the sockets are
+    multiplexed with poll(), so the time taken depends on the timeout rather
+    than on the number of hosts.
+
+    get_targets resolves every host name, one at a time, before any host is
+    probed, so a slow DNS server delays the start of the whole sweep.
+
+    A host whose probes all failed without an ICMP echo request having been
+    sent is recorded with the method 'sweep-tcp'.  That only shows that its
+    service ports did not answer, so metric runs ping it themselves rather
+    than trust the result (see run_metric.ping_test). """
+
+    def __init__(self, rsv, timeout=DEFAULT_TIMEOUT):
+        self.rsv = rsv
+        self.timeout = timeout
+        self.max_sockets = get_socket_limit()
+
+        self.icmp = None
+        self.icmp_raw = False
+        self.ident = os.getpid() & 0xFFFF
+        self.seq = 0
+
+        # host -> probe state of the hosts being checked
+        self.active = {}
+        # ICMP sequence number -> host
+        self.sequences = {}
+        # file descriptor -> (host, socket, port)
+        self.connections = {}
+        # host -> result entry
+        self.results = {}
+
+        self.poller = None
+
+
+    def open_icmp(self):
+        """ Open a socket for sending ICMP echo requests.  The unprivileged 'ping
+        socket' is tried first (allowed by net.ipv4.ping_group_range), then a
+        raw socket which needs root.  Call this before dropping privileges.
+        Returns True if ICMP can be used. """
+
+        for (kind, raw) in ((socket.SOCK_DGRAM, False), (socket.SOCK_RAW, True)):
+            try:
+                sock = socket.socket(socket.AF_INET, kind, socket.IPPROTO_ICMP)
+            except socket.error, err:
+                self.rsv.log("DEBUG", "Cannot open ICMP socket (raw=%s): %s", raw, err)
+                continue
+
+            sock.setblocking(0)
+            self.icmp = sock
+            self.icmp_raw = raw
+            return True
+
+        self.rsv.log("INFO", "Not permitted to send ICMP.  Hosts will be checked with TCP connections only.")
+        return False
+
+
+    def run(self, targets):
+        """ Check each (host, address, ports) target.  Returns a dictionary of
+        host -> entry in the format used by the Reachability table, leaving out
+        hosts that there was no way to check. """
+
+        self.poller = select.poll()
+        if self.icmp:
+            self.poller.register(self.icmp.fileno(), select.POLLIN)
+
+        pending = list(targets)
+        pending.reverse()
+        while pending or self.active:
+            while pending and (not self.active or
+                               len(self.connections) + len(pending[-1][2]) < self.max_sockets):
+                (host, address, ports) = pending.pop()
+                self.start(host, address, ports)
+
+            if not self.active:
+                continue
+
+            now = time.time()
+            deadline = min([state["deadline"] for state in self.active.values()])
+            wait = max(0, int((deadline - now) * 1000) + 1)
+            try:
+                events = self.poller.poll(wait)
+            except select.error, err:
+                if err[0] == errno.EINTR:
+                    continue
+                raise
+
+            for (fd, event) in events:
+                if self.icmp and fd == self.icmp.fileno():
+                    self.read_icmp()
+                elif fd in self.connections:
+                    self.check_connection(fd)
+
+            now = time.time()
+            for host in self.active.keys():
+                if self.active[host]["deadline"] <= now:
+                    self.fail(host, "No answer within %s seconds" % self.timeout)
+
+        if self.icmp:
+            self.poller.unregister(self.icmp.fileno())
+        return self.results
+
+
+    def start(self, host, address, ports):
+        """ Send the probes for one host """
+
+        state = {"address" : address, "start" : time.time(), "probes" : 0, "errors" : []}
+        state["deadline"] = state["start"] + self.timeout
+        self.active[host] = state
+
+        if address is None:
+            self.fail(host, "Unknown host")
+            return
+
+        if self.icmp:
+            self.send_echo(host, state)
+
+        for port in ports:
+            if host not in self.active:
+                return
+            self.connect(host, state, port)
+
+        if host in self.active and state["probes"] == 0:
+            if state["errors"]:
+                self.fail(host)
+            else:
+                # Nothing we could try for this host
+                del self.active[host]
+        return
+
+
+    def send_echo(self, host, state):
+        """ Send an ICMP echo request to host """
+
+        self.seq = (self.seq + 1) & 0xFFFF
+        packet = echo_request(self.ident, self.seq)
+        try:
+            self.icmp.sendto(packet, (state["address"], 0))
+        except socket.error, err:
+            state["errors"].append("icmp: %s" % err[-1])
+            return
+
+        self.sequences[self.seq] = host
+        state["seq"] = self.seq
+        state["icmp"] = True
+        state["probes"] += 1
+        return
+
+
+    def read_icmp(self):
+        """ Read every pending ICMP packet and act on replies to our requests """
+
+        while 1:
+            try:
+                (packet, sender) = self.icmp.recvfrom(2048)
+            except socket.error, err:
+                if err[0] in (errno.EAGAIN, errno.EINTR):
+                    return
+                raise
+
+            if self.icmp_raw:
+                # Raw sockets include the IP header
+                packet = packet[(ord(packet[0]) & 0x0F) * 4:]
+            if len(packet) < ICMP_HEADER_SIZE:
+                continue
+
+            (kind, code, checksum_, ident, seq) = struct.unpack(ICMP_HEADER, packet[:ICMP_HEADER_SIZE])
+
+            if kind == ICMP_ECHO_REPLY:
+                # Ping sockets choose the identifier themselves and only
+                # deliver replies to our own requests
+                if self.icmp_raw and ident != self.ident:
+                    continue
+                host = self.sequences.get(seq)
+                if host in self.active and self.active[host]["address"] == sender[0]:
+                    self.succeed(host, "icmp")
+
+            elif kind == ICMP_DEST_UNREACH and self.icmp_raw:
+                # The original IP header and ICMP header follow
+                original = packet[ICMP_HEADER_SIZE:]
+                original = original[(ord(original[0]) & 0x0F) * 4:]
+                if len(original) < ICMP_HEADER_SIZE:
+                    continue
+                (kind, code, checksum_, ident, seq) = struct.unpack(ICMP_HEADER, original[:ICMP_HEADER_SIZE])
+                host = self.sequences.get(seq)
+                if ident == self.ident and host in self.active:
+                    self.probe_failed(host, "icmp: Destination unreachable from %s" % sender[0])
+
+
+    def connect(self, host, state, port):
+        """ Start a non-blocking TCP connection to port on host """
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        ret = sock.connect_ex((state["address"], port))
+
+        if ret in (0, errno.ECONNREFUSED):
+            sock.close()
+            self.succeed(host, "tcp/%s" % port)
+        elif ret in (errno.EINPROGRESS, errno.EALREADY, errno.EWOULDBLOCK):
+            self.connections[sock.fileno()] = (host, sock, port)
+            self.poller.register(sock.fileno(), select.POLLOUT)
+            state["probes"] += 1
+        else:
+            sock.close()
+            state["errors"].append("tcp/%s: %s" % (port, os.strerror(ret)))
+        return
+
+
+    def check_connection(self, fd):
+        """ A connection finished, one way or the other """
+
+        (host, sock, port) = self.close_connection(fd)
+        ret = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        sock.close()
+
+        if host not in self.active:
+            return
+        if ret in (0, errno.ECONNREFUSED):
+            self.succeed(host, "tcp/%s" % port)
+        else:
+            self.probe_failed(host, "tcp/%s: %s" % (port, os.strerror(ret)))
+        return
+
+
+    def close_connection(self, fd):
+        (host, sock, port) = self.connections[fd]
+        del self.connections[fd]
+        self.poller.unregister(fd)
+        return (host, sock, port)
+
+
+    def probe_failed(self, host, error):
+        """ One way of reaching host failed.  Give up once they all have. """
+
+        state = self.active[host]
+        state["errors"].append(error)
+        state["probes"] -= 1
+        if state["probes"] <= 0:
+            self.fail(host)
+        return
+
+
+    def succeed(self, host, method):
+        state = self.finish(host)
+        self.results[host] = {"time" : time.time(), "status" : "ok", "method" : method,
+                              "latency" : time.time() - state["start"]}
+        return
+
+
+    def fail(self, host, reason=None):
+        state = self.finish(host)
+        errors = state["errors"]
+        if reason:
+            errors.append(reason)
+
+        method = "sweep"
+        if not state.get("icmp"):
+            method = "sweep-tcp"
+
+        # stdout/stderr are reported the same way as a failed ping
+        self.results[host] = {"time" : time.time(), "status" : "failed", "method" : method,
+                              "latency" : time.time() - state["start"],
+                              "stdout" : "Host %s could not be reached:\n%s\n" % (host, "\n".join(errors)),
+                              "stderr" : ""}
+        return
+
+
+    def finish(self, host):
+        """ Stop checking host and close its sockets """
+
+        state = self.active[host]
+        del self.active[host]
+
+        if "seq" in state and self.sequences.get(state["seq"]) == host:
+            del self.sequences[state["seq"]]
+
+        for fd in self.connections.keys():
+            if self.connections[fd][0] == host:
+                (host_, sock, port) = self.close_connection(fd)
+                sock.close()
+
+        return state
+
+
+    def close(self):
+        if self.icmp:
+            self.icmp.close()
+            self.icmp = None
+        return
+
+
+
+def get_targets(rsv):
+    """ Return a (host, address, ports) tuple for each configured host, where
+    ports are those of the services the host's enabled metrics test and of the
+    port in the host name, if any """
+
+    registry = rsv.get_host_registry()
+    catalog = rsv.get_metric_catalog()
+
+    # Hosts configured with different ports are checked once
+    ports = {}
+    order = []
+    for name in registry.get_host_names():
+        host = name
+        host_ports = {}
+        if name.find(":") > 0:
+            (host, port) = name.split(":", 1)
+            if port.isdigit():
+                host_ports[int(port)] = 1
+
+        for metric_name in registry.get_enabled_metrics(name):
+            if not catalog.is_installed(metric_name):
+                continue
+            try:
+                service_type = catalog.get_base_config(metric_name).get(metric_name, "service-type")
+            except ConfigParser.Error:
+                continue
+            for port in SERVICE_PORTS.get(service_type, ()):
+                host_ports[port] = 1
+
+        if host not in ports:
+            order.append(host)
+            ports[host] = {}
+        ports[host].update(host_ports)
+
+    targets = []
+    for host in order:
+        try:
+            address = socket.gethostbyname(host)
+        except socket.error, err:
+            rsv.log("INFO", "Cannot resolve %s: %s", host, err)
+            address = None
+
+        host_ports = ports[host].keys()
+        host_ports.sort()
+        targets.append((host, address, host_ports))
+
+    return targets
+
+
+def get_socket_limit():
+    """ Leave plenty of file descriptors free for everything else """
+    try:
+        import resource
+        soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    except (ImportError, ValueError):
+        return 256
+    if soft < 0:
+        return MAX_SOCKETS
+    return max(16, min(MAX_SOCKETS, soft - 64))
+
+
+def checksum(data):
+    """ The Internet checksum (RFC 1071) """
+    if len(data) % 2:
+        data += "\0"
+    total = sum(struct.unpack("!%dH" % (len(data) / 2), data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def echo_request(ident, seq):
+    """ Build an ICMP echo request """
+    payload = struct.pack("!d", time.time())
+    header = struct.pack(ICMP_HEADER, ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    header = struct.pack(ICMP_HEADER, ICMP_ECHO_REQUEST, 0, checksum(header + payload), ident, seq)
+    return header + payload
@@ -2,14 +2,15 @@
 
 import os
 import re
+import time
 
-import Host
 import Table
-import Condor
-import Metric
 import Consumer
 import Sysutils
 
+# Condor is imported by the functions that talk to Condor-Cron, so that
+# 'rsv-control --list' does not have to load it.
+
 def new_table(header, options):
     """ Return a new table with default dimensions """
     table_ = Table.Table((58, 20))
@@ -34,17 +35,17 @@ def list_metrics(rsv, options, pattern):
     num_metrics_displayed = 0
 
     metrics = rsv.get_metric_info()
-    hosts   = rsv.get_host_info()
+    registry = rsv.get_host_registry()
     used_metrics = {}
 
     # Form a table for each host listing enabled metrics
-    for host in hosts:
+    for host in registry.get_hosts():
         table = new_table("Metrics enabled for host: %s" % host.host, options)
 
-        enabled_metrics = host.get_enabled_metrics()
+        enabled_metrics = registry.get_enabled_metrics(host.host)
 
         if enabled_metrics:
-            for metric in host.get_enabled_metrics():
+            for metric in enabled_metrics:
                 used_metrics[metric] = 1
                 if pattern and not re.search(pattern, metric):
                     continue
@@ -52,7 +53,7 @@ def list_metrics(rsv, options, pattern):
                 if options.list_cron:
                     # We need to load in the Metric with specific host so that
                     # we get the right cron time information.
-                    tmp_metric = Metric.Metric(metric, rsv, host.host)
+                    tmp_metric = metrics.get_metric(metric, host.host)
                     cron = tmp_metric.get_cron_string()
                     table.addToBuffer(metric, cron)
                 else:
@@ -66,8 +67,8 @@ def list_metrics(rsv, options, pattern):
         # We don't skip this host earlier in the loop so that we can get
         # a correct number for the disabled hosts.
         if options.host and options.host != host.host:
-            rsv.log("DEBUG", "Not displaying host '%s' because --host %s was supplied." %
-                    (host.host, options.host))
+            rsv.log("DEBUG", "Not displaying host '%s' because --host %s was supplied.",
+                    host.host, options.host)
             continue
 
         if not table.isBufferEmpty():
@@ -120,6 +121,7 @@ def list_metrics(rsv, options, pattern):
 
 def job_list(rsv, parsable=False, hostname=None):
     """ Display jobs running similar to condor_cron_q but in a better format """
+    import Condor
     condor = Condor.Condor(rsv)
 
     if not condor.is_condor_running():
@@ -154,6 +156,7 @@ def dispatcher(rsv, action, options, jobs=None):
     """ Handle on, off, enable, disable.  Determine if jobs are metrics or
     consumers. """
 
+    import Condor
     condor = Condor.Condor(rsv)
 
     hostname = None
@@ -170,8 +173,7 @@ def dispatcher(rsv, action, options, jobs=None):
     # and stopping, but not to enabling and disabling (since we couldn't know the
     # metric list in those cases)
     if action in ('start', 'stop') and hostname and not jobs:
-        host = Host.Host(hostname, rsv)
-        jobs = host.get_enabled_metrics()
+        jobs = rsv.get_host_registry().get_enabled_metrics(hostname)
 
 
     # 
@@ -196,12 +198,12 @@ def dispatcher(rsv, action, options, jobs=None):
     else:
         # Since a user can input either metric of consumer names we need to get a list
         # of the installed metrics and consumers and check which category each job is in.
-        available_metrics   = rsv.get_installed_metrics()
+        available_metrics   = rsv.get_metric_catalog()
         available_consumers = rsv.get_installed_consumers()
 
         host = None
         if hostname:
-            host = Host.Host(hostname, rsv)
+            host = rsv.get_host_registry().get_host(hostname)
 
         num_errors = 0
         write_config_file = False
@@ -215,7 +217,7 @@ def dispatcher(rsv, action, options, jobs=None):
                         "Not starting either one" % job)
                 num_errors += 1
             elif not is_metric and not is_consumer:
-                rsv.log("WARNING", "Supplied job '%s' is not an installed metric or consumer" % job)
+                rsv.log("WARNING", "Supplied job '%s' is not an installed metric or consumer", job)
                 num_errors += 1
             elif is_metric:
                 if not host:
@@ -223,7 +225,7 @@ def dispatcher(rsv, action, options, jobs=None):
                     num_errors += 1
                     continue
 
-                metric = Metric.Metric(job, rsv, hostname)
+                metric = available_metrics.get_metric(job, hostname)
 
                 if action == "start":
                     num_errors += start_metric(rsv, condor, metric, host)
@@ -264,7 +266,7 @@ def dispatcher(rsv, action, options, jobs=None):
             plural  = ""
             if len(jobs) > 1:
                 plural = "s"
-            rsv.log("ERROR", "Problem %s %s job%s." % (actions[action], num_errors, plural))
+            rsv.log("ERROR", "Problem %s %s job%s.", actions[action], num_errors, plural)
             return False
         else:
             return True
@@ -277,12 +279,14 @@ def start_all_jobs(rsv, condor):
     num_errors = 0
 
     # Start all the metrics for each host
-    for host in rsv.get_host_info():
-        enabled_metrics = host.get_enabled_metrics()
+    catalog = rsv.get_metric_catalog()
+    registry = rsv.get_host_registry()
+    for host in registry.get_hosts():
+        enabled_metrics = registry.get_enabled_metrics(host.host)
         if len(enabled_metrics) > 0:
             rsv.echo("Starting %s metrics for host '%s'." % (len(enabled_metrics), host.host))
             for metric_name in enabled_metrics:
-                metric = Metric.Metric(metric_name, rsv, host.host)
+                metric = catalog.get_metric(metric_name, host.host)
                 if not condor.start_metric(metric, host):
                     num_errors += 1
 
@@ -344,7 +348,6 @@ def stop_all_jobs(rsv, condor):
 def stop_metric(rsv, condor, metric, host):
     """ Stop a single metric against the specified host """
     rsv.echo("Stopping metric '%s' for host '%s'" % (metric.name, host.host))
-    metric = Metric.Metric(metric.name, rsv, host.host)
     if not condor.stop_jobs("OSGRSVUniqueName==\"%s\"" % metric.get_unique_name()):
         return 1
 
@@ -423,6 +426,7 @@ def show_config_consumer(rsv, consumer):
 def verify(rsv):
     """ Perform some basic verification tasks to determine if RSV is functioning correctly """
 
+    import Condor
     condor = Condor.Condor(rsv)
     num_errors = 0
 
@@ -467,3 +471,88 @@ def verify(rsv):
         return True
     else:
         return False
+
+
+def sweep(rsv, options):
+    """ Check whether every configured host can be reached and publish the
+    results in the reachability table used by metric runs and the html-consumer """
+
+    import RSV
+    import Sweep
+
+    sweeper = Sweep.Sweep(rsv, options.sweep_timeout)
+
+    # Raw ICMP sockets need root, so open one before switching to the RSV user
+    sweeper.open_icmp()
+    RSV.validate_config(rsv)
+
+    targets = Sweep.get_targets(rsv)
+    if not targets:
+        rsv.echo("No hosts are configured.")
+        return True
+
+    start = time.time()
+    try:
+        results = sweeper.run(targets)
+    finally:
+        sweeper.close()
+    elapsed = time.time() - start
+
+    reachability = rsv.get_reachability()
+    if reachability.ttl <= 0:
+        rsv.echo("WARNING: ping-cache-ttl is 0, so metric runs will not use these results.")
+    reachability.record_many(results)
+
+    table_ = Table.Table((40, 8, 12, 10))
+    table_.makeFormat()
+    table_.makeHeader("Host", "Status", "Method", "Time (ms)")
+    num_failed = 0
+    for (host, address, ports) in targets:
+        if host not in results:
+            table_.addToBuffer(host, "UNKNOWN", "", "")
+            continue
+        entry = results[host]
+        if entry["status"] != "ok":
+            num_failed += 1
+        table_.addToBuffer(host, entry["status"].upper(), entry["method"], "%d" % (entry["latency"] * 1000))
+    rsv.echo(table_.getHeader())
+    rsv.echo("\n".join(table_.formatBuffer()))
+
+    rsv.echo("\nChecked %s hosts in %.1f seconds: %s reachable, %s unreachable" %
+             (len(targets), elapsed, len(results) - num_failed, num_failed))
+    if len(results) < len(targets):
+        rsv.echo("Hosts marked UNKNOWN have no service ports to try and ICMP is not permitted.")
+
+    return num_failed == 0
+
+
+def cost_report(rsv):
+    """ Rank metrics by the CPU time their runs use per day, from the ledger of
+    metric runs """
+
+    import Ledger
+
+    costs = rsv.get_ledger().get_costs()
+    if not costs:
+        rsv.echo("No metric runs have been recorded yet.")
+        return True
+
+    rows = []
+    for (metric_name, days, totals) in costs:
+        days = float(days)
+        cpu = (totals[Ledger.USER_CPU] + totals[Ledger.SYSTEM_CPU]) / days
+        rows.append((cpu, metric_name, totals[Ledger.RUNS] / days, totals[Ledger.WALL] / days,
+                     totals[Ledger.MAX_RSS] / 1024.0, totals[Ledger.OUTPUT_BYTES] / days / 1024))
+    rows.sort()
+    rows.reverse()
+
+    table_ = Table.Table((50, 10, 12, 12, 12, 14))
+    table_.makeFormat()
+    table_.makeHeader("Metric", "Runs/day", "CPU s/day", "Wall s/day", "Max RSS MB", "Output KB/day")
+    rsv.echo(table_.getHeader())
+    for (cpu, metric_name, runs, wall, max_rss, output) in rows:
+        rsv.echo(table_.format(metric_name, "%.1f" % runs, "%.2f" % cpu, "%.2f" % wall,
+                               "%.1f" % max_rss, "%.1f" % output))
+
+    rsv.echo("\nAverages over the days each metric ran on, in the last %s days." % Ledger.LEDGER_DAYS)
+    return True
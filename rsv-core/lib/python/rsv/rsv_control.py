@@ -4,13 +4,17 @@
 import os 
 import pwd
 import sys
+import time
 import signal
 from optparse import OptionParser, OptionGroup
 
-# Custom RSV libraries
-import RSV
-import actions
-import run_metric
+# The RSV libraries are imported lazily in main_rsv_control() so that each
+# command only pays for the modules it actually uses.  Condor-Cron starts a new
+# interpreter for every metric run, so import time adds up quickly.
+
+# Used by --startup-profile
+START_TIME = time.time()
+import_times = []
 
 
 def process_options(arguments=None):
@@ -21,7 +25,7 @@ def process_options(arguments=None):
     Level settings - 0=print nothing, 1=normal, 2=info, 3=debug
 
     Run a one-time test:
-    --run [--all-enabled] [--gatekeeper-type|--gk-type gram|condor-ce|cream|nordugrid] --host <HOST> METRIC [METRIC ...]
+    --run [--all-enabled] [--parallel N [--max-per-host N]] [--batch] [--gatekeeper-type|--gk-type gram|condor-ce|cream|nordugrid] --host <HOST> METRIC [METRIC ...]
     --test (same options and behavior as --run but w/o generating records)
     
     Show information about enabled and installed metrics:
@@ -38,6 +42,9 @@ def process_options(arguments=None):
     --on  [--host <host-name> [METRIC|CONSUMER ...]]
     --off [--host <host-name> [METRIC|CONSUMER ...]]
 
+    Check whether every configured host can be reached:
+    --sweep [--sweep-timeout SECONDS]
+
     Other commands are available, run with --help to see full usage.
     """
 
@@ -59,7 +66,16 @@ def process_options(arguments=None):
                      help="Same as --run but do not generate records " +
                           "(therefore nothing goes to Gratia, HTML page, etc).")
     group.add_option("--all-enabled", action="store_true", dest="all_enabled", default=False,
-                     help="Run all enabled metrics serially.")
+                     help="Run all enabled metrics serially (or in parallel, see --parallel).")
+    group.add_option("--parallel", dest="parallel", default=1, type="int", metavar="N",
+                     help="Run up to N metrics at the same time.  The output of each metric is " +
+                          "printed once it and every metric before it have finished. [Default=%default]")
+    group.add_option("--max-per-host", dest="max_per_host", default=2, type="int", metavar="N",
+                     help="With --parallel, run at most N metrics against the same host at the " +
+                          "same time. [Default=%default]")
+    group.add_option("--batch", action="store_true", dest="batch", default=False,
+                     help="Submit the grid metrics that use Condor-G together, one Condor-G cluster " +
+                          "for each CE, before running the other metrics.")
     group.add_option("--extra-config-file", dest="extra_config_file", default=None,
                      help="Path to another INI-format file containing metric configuration (with --run)")
     parser.add_option_group(group)
@@ -98,6 +114,16 @@ def process_options(arguments=None):
                      help="KEY=VAL to pass to the metric.  This can be specified multiple times.")
     parser.add_option_group(group)
 
+    group = OptionGroup(parser, "Check Hosts", "Check whether every configured host can be reached, "
+                        "all at once, and share the results with metric runs for ping-cache-ttl seconds.  "
+                        "Uses ICMP when permitted and TCP connections to the ports of the services "
+                        "each host is monitored for.")
+    group.add_option("--sweep", action="store_true", dest="sweep", default=False,
+                     help="Check every configured host and publish the results")
+    group.add_option("--sweep-timeout", dest="sweep_timeout", default=3, type="int", metavar="SECONDS",
+                     help="Seconds each host has to answer. [Default=%default]")
+    parser.add_option_group(group)
+
     group = OptionGroup(parser, "Other Options")
     group.add_option("--verify", action="store_true", dest="verify", default=False,
                      help="Run some basic tests to validate your RSV install.")
@@ -105,6 +131,10 @@ def process_options(arguments=None):
                      help="Show the configuration for specific metrics.")
     group.add_option("--profile", action="store_true", dest="profile", default=None,
                      help="Run the RSV profiler")
+    group.add_option("--cost-report", action="store_true", dest="cost_report", default=False,
+                     help="Show the metrics that use the most CPU time per day")
+    group.add_option("--startup-profile", action="store_true", dest="startup_profile", default=False,
+                     help="Print the time spent importing each module before running the command")
     group.add_option("--no-ping", action="store_true", dest="no_ping", default=False,
                      help="Skip the ping test against the host being monitored")
     group.add_option("--ce-type", "--gatekeeper-type", "--gk-type", dest="ce_type", default="gram",
@@ -130,7 +160,8 @@ def process_options(arguments=None):
     # Check that we got exactly one command
     number_of_commands = len([i for i in [options.run, options.enable, options.disable, options.on,
                                           options.off, options.list, options.job_list, options.verify,
-                                          options.show_config, options.profile] if i])
+                                          options.show_config, options.profile, options.sweep,
+                                          options.cost_report] if i])
 
     if number_of_commands > 1:
         parser.error("You can use only one command.")
@@ -151,6 +182,12 @@ def process_options(arguments=None):
             parser.error("You must provide a list of metrics to run or else pass the " +
                          "--all-enabled flag to run all enabled metrics")
 
+    if options.parallel < 1 or options.max_per_host < 1:
+        parser.error("--parallel and --max-per-host must be at least 1")
+
+    if options.sweep_timeout < 1:
+        parser.error("--sweep-timeout must be at least 1")
+
     if options.ce_type and options.ce_type not in ('gram', 'condor-ce', 'htcondor-ce', 'cream', 'nordugrid'):
         parser.error("Invalid value for --ce-type. "
                      "Valid values are 'gram' for Globus GRAM, 'htcondor-ce' (or 'condor-ce') for HTCondor-CE, 'cream' for CREAM-CE and 'nordugrid' for Nordugrid")
@@ -165,13 +202,77 @@ def sigint_handler(signal, frame):
     sys.exit(1)
 
 
+def install_import_timer():
+    """ Wrap __import__ so that the time spent loading each module is recorded in
+    import_times.  Time spent in nested imports is charged to the nested module. """
+
+    import __builtin__
+    original_import = __builtin__.__import__
+
+    # Time spent in nested imports, one entry per import in progress
+    nested = []
+
+    def timed_import(name, *args, **kwargs):
+        num_modules = len(sys.modules)
+        nested.append(0.0)
+        start = time.time()
+        try:
+            return original_import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            own_time = elapsed - nested.pop()
+            if nested:
+                nested[-1] += elapsed
+            # Only record imports that actually loaded something
+            if len(sys.modules) != num_modules:
+                import_times.append((own_time, elapsed, name))
+
+    __builtin__.__import__ = timed_import
+    return
+
+
+def print_import_times():
+    """ Print the times recorded by install_import_timer() """
+
+    total = 0.0
+    lines = []
+    for (own_time, elapsed, name) in sorted(import_times, reverse=True):
+        total += own_time
+        lines.append("%8.2f %8.2f  %s" % (own_time * 1000, elapsed * 1000, name))
+
+    print >> sys.stderr, "%8s %8s  %s" % ("SELF(ms)", "TOTAL(ms)", "MODULE")
+    print >> sys.stderr, "\n".join(lines)
+    print >> sys.stderr, "Time spent importing modules: %.2f ms" % (total * 1000)
+    print >> sys.stderr, "Time from start of rsv-control to running the command: %.2f ms" % \
+          ((time.time() - START_TIME) * 1000)
+    return
+
+
+def initialize(options):
+    """ Import the RSV libraries and load the configuration """
+    import RSV
+    return RSV.RSV(options)
+
+
 def main_rsv_control():
     """ Drive the program """
 
     # Process the command line
     options, args = process_options()
 
-    rsv = RSV.RSV(options)
+    if options.startup_profile:
+        install_import_timer()
+
+    rsv = initialize(options)
+
+    # Only import the module implementing the requested command
+    if options.run:
+        import run_metric
+    else:
+        import actions
+
+    if options.startup_profile:
+        print_import_times()
 
     # List the metrics
     if options.list:
@@ -185,6 +286,8 @@ def main_rsv_control():
         return actions.dispatcher(rsv, "show-config", options, args)
     elif options.profile:
         return actions.profile(rsv)
+    elif options.cost_report:
+        return actions.cost_report(rsv)
     elif options.verify:
         return actions.verify(rsv)
     else:
@@ -192,7 +295,7 @@ def main_rsv_control():
         this_uid = os.getuid()
         rsv_user = rsv.get_user()
         if this_uid != 0 and this_uid != pwd.getpwnam(rsv_user).pw_uid:
-            rsv.echo("ERROR: You must be either root or %s to run these commands: run, on, off, enable, disable" % rsv_user)
+            rsv.echo("ERROR: You must be either root or %s to run these commands: run, on, off, enable, disable, sweep" % rsv_user)
             return False
             
         if options.run:
@@ -208,6 +311,8 @@ def main_rsv_control():
             return actions.dispatcher(rsv, "enable", options, args)
         elif options.disable:
             return actions.dispatcher(rsv, "disable", options, args)
+        elif options.sweep:
+            return actions.sweep(rsv, options)
 
     # We didn't find the request?
     return False
@@ -0,0 +1,389 @@
+#!/usr/bin/python
+
+""" rsvd - a resident RSV process that runs metrics on request.
+
+Condor-Cron normally starts a new rsv-control for every metric run, and each
+one has to start Python, import the RSV libraries, load the configuration and
+validate the RSV user before it can start the metric.  rsvd does all of that
+once and then listens on a local Unix socket.  Each request is handled by a
+forked worker that runs the usual run_metric code and streams its output and
+exit status back to the client (libexec/misc/rsvd-client).
+
+Protocol: the client sends a 4-byte big-endian length followed by its command
+line arguments joined with NUL characters.  The server answers with frames made
+of a 1-byte channel, a 4-byte big-endian length and the data.  Channel 'o' is
+STDOUT, 'e' is STDERR and 'x' carries the exit status and ends the stream. """
+
+# System libraries
+import os
+import sys
+import time
+import errno
+import select
+import signal
+import socket
+import struct
+import traceback
+from optparse import OptionParser
+
+# RSV libraries
+import RSV
+import run_metric
+import rsv_control
+import ConfigWatcher
+
+FRAME_HEADER = "!cI"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER)
+REQUEST_HEADER = "!I"
+REQUEST_HEADER_SIZE = struct.calcsize(REQUEST_HEADER)
+
+# Refuse requests larger than this (bytes) rather than trusting the length prefix
+MAX_REQUEST_SIZE = 65536
+
+
+class FrameWriter:
+    """ File-like object that sends everything written to it as frames on one
+    channel of a client connection.  Used in place of sys.stdout/sys.stderr in
+    the workers. """
+
+    def __init__(self, conn, channel):
+        self.conn = conn
+        self.channel = channel
+        self.softspace = 0
+
+    def write(self, data):
+        if data:
+            send_frame(self.conn, self.channel, data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+
+def send_frame(conn, channel, data):
+    """ Send one frame to the client """
+    conn.sendall(struct.pack(FRAME_HEADER, channel, len(data)) + data)
+
+
+def recv_exactly(conn, size):
+    """ Read exactly size bytes from a socket.  Returns None on EOF. """
+    chunks = []
+    while size > 0:
+        chunk = conn.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return "".join(chunks)
+
+
+def read_request(conn):
+    """ Read the client's command line.  Returns a list of arguments or None. """
+    header = recv_exactly(conn, REQUEST_HEADER_SIZE)
+    if header is None:
+        return None
+
+    (length,) = struct.unpack(REQUEST_HEADER, header)
+    if length > MAX_REQUEST_SIZE:
+        return None
+    if length == 0:
+        return []
+
+    request = recv_exactly(conn, length)
+    if request is None:
+        return None
+    return request.split("\0")
+
+
+class RSVDaemon:
+    """ Accept run requests on a Unix socket and hand each one to a worker """
+
+    def __init__(self, options):
+        self.options = options
+        self.rsv = None
+        self.listener = None
+        self.watcher = None
+        self.workers = {}
+        self.done = False
+        self.reload_requested = False
+
+
+    def load(self):
+        """ Load the configuration and warm up the metric catalog """
+        self.rsv = RSV.RSV(self.options)
+        RSV.validate_config(self.rsv)
+
+        catalog = self.rsv.get_metric_catalog()
+        for metric_name in catalog:
+            catalog.get_base_config(metric_name)
+
+        self.rsv.log("INFO", "rsvd loaded %s metrics", len(catalog))
+
+        # Pick up changes made by 'rsv-control --enable' etc. without a restart
+        if self.watcher:
+            self.watcher.close()
+        self.watcher = ConfigWatcher.ConfigWatcher(self.rsv, RSV.CONFIG_DIR,
+                                                   os.path.join(RSV.LIBEXEC_DIR, "metrics"))
+        return
+
+
+    def listen(self):
+        """ Create the listening socket.  Only the RSV user may connect. """
+
+        path = self.options.socket
+        if os.path.exists(path):
+            # Refuse to steal the socket from a daemon that is still running
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                try:
+                    probe.connect(path)
+                    self.rsv.log("CRITICAL", "rsvd is already listening on '%s'", path)
+                    sys.exit(1)
+                except socket.error:
+                    os.remove(path)
+            finally:
+                probe.close()
+
+        old_umask = os.umask(0077)
+        try:
+            self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.listener.bind(path)
+            self.listener.listen(64)
+        finally:
+            os.umask(old_umask)
+
+        self.rsv.log("INFO", "rsvd listening on '%s'", path)
+        return
+
+
+    def register_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.sigterm_handler)
+        signal.signal(signal.SIGINT, self.sigterm_handler)
+        signal.signal(signal.SIGHUP, self.sighup_handler)
+        return
+
+
+    def sigterm_handler(self, signum, frame):
+        self.done = True
+
+    def sighup_handler(self, signum, frame):
+        self.reload_requested = True
+
+
+    def serve(self):
+        """ Main loop """
+
+        self.register_signal_handlers()
+
+        while not self.done:
+            self.reap_workers()
+
+            if self.reload_requested:
+                self.reload_requested = False
+                self.rsv.log("INFO", "Caught SIGHUP.  Reloading configuration.")
+                self.load()
+
+            if len(self.workers) >= self.options.workers:
+                # Let the backlog queue up until a worker finishes
+                time.sleep(0.1)
+                continue
+
+            watched = [self.listener]
+            if self.watcher.fileno() is not None:
+                watched.append(self.watcher.fileno())
+
+            try:
+                (readable, writable, errors) = select.select(watched, [], [], 1.0)
+            except select.error, err:
+                if err[0] == errno.EINTR:
+                    continue
+                raise
+
+            # Always check, the polling fallback has no file descriptor
+            self.watcher.check()
+
+            if self.listener in readable:
+                try:
+                    (conn, address) = self.listener.accept()
+                except socket.error, err:
+                    if err[0] == errno.EINTR:
+                        continue
+                    raise
+                self.start_worker(conn)
+
+        self.shutdown()
+        return
+
+
+    def start_worker(self, conn):
+        """ Fork a worker for a connection """
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                try:
+                    self.listener.close()
+                    self.watcher.close()
+                    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                        signal.signal(signum, signal.SIG_DFL)
+                    status = self.run_request(conn)
+                except Exception:
+                    self.rsv.log("ERROR", "rsvd worker failed:\n%s", traceback.format_exc())
+            finally:
+                os._exit(status)
+
+        conn.close()
+        self.workers[pid] = time.time()
+        return
+
+
+    def reap_workers(self):
+        """ Collect finished workers """
+        while self.workers:
+            try:
+                (pid, status) = os.waitpid(-1, os.WNOHANG)
+            except OSError, err:
+                if err.errno == errno.ECHILD:
+                    self.workers = {}
+                    return
+                raise
+            if pid == 0:
+                return
+            if pid in self.workers:
+                del self.workers[pid]
+        return
+
+
+    def run_request(self, conn):
+        """ Run one request in a worker.  Everything the metric run prints is sent
+        back to the client. """
+
+        args = read_request(conn)
+        if args is None:
+            conn.close()
+            return 1
+
+        sys.stdout = FrameWriter(conn, "o")
+        sys.stderr = FrameWriter(conn, "e")
+
+        status = 1
+        try:
+            try:
+                (options, metrics) = rsv_control.process_options(args)
+                if not options.run:
+                    print >> sys.stderr, "ERROR: rsvd only handles --run and --test"
+                else:
+                    self.rsv.set_options(options)
+                    if run_metric.main(self.rsv, options, metrics):
+                        status = 0
+            except SystemExit, err:
+                status = exit_status(err.code)
+            except Exception:
+                print >> sys.stderr, "ERROR: unexpected exception in rsvd worker:"
+                print >> sys.stderr, traceback.format_exc()
+        finally:
+            try:
+                send_frame(conn, "x", str(status))
+                conn.close()
+            except socket.error:
+                pass
+
+        return status
+
+
+    def shutdown(self):
+        """ Stop listening and remove the socket """
+        self.rsv.log("INFO", "rsvd shutting down")
+        self.listener.close()
+        self.watcher.close()
+        try:
+            os.remove(self.options.socket)
+        except OSError:
+            pass
+        return
+
+
+def exit_status(code):
+    """ Convert a SystemExit code to an exit status the same way Python would """
+    if code is None:
+        return 0
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        print >> sys.stderr, code
+        return 1
+
+
+def daemonize(log_file):
+    """ Detach from the terminal and send output to log_file """
+
+    if os.fork() > 0:
+        os._exit(0)
+    os.setsid()
+    if os.fork() > 0:
+        os._exit(0)
+
+    os.chdir("/")
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    log_fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    return
+
+
+def process_options(arguments=None):
+    parser = OptionParser(usage="rsvd [options]",
+                          description="Run RSV metrics on request from rsvd-client.")
+    parser.add_option("-v", "--verbose", dest="verbose", default=1, type="int", metavar="LEVEL",
+                      help="Verbosity level (0-3) 0=no output, 1=normal, 2=info, 3=debug. [Default=%default]")
+    parser.add_option("--socket", dest="socket", default=RSV.RSVD_SOCKET,
+                      help="Path of the Unix socket to listen on [Default=%default]")
+    parser.add_option("--workers", dest="workers", default=8, type="int",
+                      help="Maximum number of metrics to run at the same time [Default=%default]")
+    parser.add_option("--foreground", action="store_true", dest="foreground", default=False,
+                      help="Do not detach from the terminal")
+    parser.add_option("--pidfile", dest="pidfile", default=None,
+                      help="Write the daemon's PID to this file")
+    parser.add_option("--log-file", dest="log_file", default=os.path.join(RSV.LOG_DIR, "rsvd.log"),
+                      help="Where to write output when running in the background [Default=%default]")
+
+    if arguments is None:
+        (options, args) = parser.parse_args()
+    else:
+        (options, args) = parser.parse_args(arguments)
+
+    if options.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    # RSV() expects these
+    options.test = False
+    options.extra_config_file = None
+    options.ce_type = None
+    return options
+
+
+def main():
+    options = process_options()
+
+    daemon = RSVDaemon(options)
+    daemon.load()
+    daemon.listen()
+
+    if not options.foreground:
+        daemonize(options.log_file)
+
+    if options.pidfile:
+        pid_fp = open(options.pidfile, 'w')
+        pid_fp.write("%s\n" % os.getpid())
+        pid_fp.close()
+
+    daemon.serve()
+    sys.exit(0)
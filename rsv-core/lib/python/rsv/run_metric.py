@@ -5,15 +5,26 @@ import re
 import os
 import pwd
 import sys
-import copy
-import shutil
-import tempfile
+import time
+import errno
 
 # RSV libraries
 import RSV
-import Metric
-import CondorG
+import Ledger
+import Capture
 import Sysutils
+import JobEnvironment
+
+# shutil, tempfile and CondorG are imported by the functions that use them,
+# because most metric runs are local and never need them.
+
+# wlcg-multiple records are handed to Results this many at a time
+RECORD_BATCH_SIZE = 100
+
+# With --parallel N, a metric is only started if its output can be printed
+# within N * HELD_OUTPUTS_PER_WORKER metrics of the next one to print.  This
+# bounds how many outputs are kept waiting behind a slow metric.
+HELD_OUTPUTS_PER_WORKER = 4
 
 
 
@@ -27,7 +38,19 @@ def ping_test(rsv, metric):
     else:
         host = uri
 
-    rsv.log("INFO", "Pinging host %s:" % host)
+    rsv.log("INFO", "Pinging host %s:", host)
+
+    # Another metric run may have checked this host recently
+    reachability = rsv.get_reachability()
+    entry = reachability.lookup(host)
+    if entry and entry.get("status") != "ok" and entry.get("method") == "sweep-tcp":
+        # A sweep that could only try TCP ports does not show that the host
+        # does not answer ping
+        rsv.log("INFO", "Not using the failed TCP check of %s by 'rsv-control --sweep'", host, indent=4)
+        entry = None
+    if entry:
+        report_cached_ping(rsv, metric, host, entry)
+        return
 
     # Send a single ping, with a timeout.  We just want to know if we can reach
     # the remote host, we don't care about the latency unless it exceeds the timeout
@@ -35,18 +58,40 @@ def ping_test(rsv, metric):
     try:
         (ret, out, err) = rsv.run_command(cmd)
     except Sysutils.TimeoutError, err:
+        reachability.record(host, "timeout", "ping", command=" ".join(cmd), error=str(err))
         rsv.results.ping_timeout(metric, " ".join(cmd), err)
         sys.exit(1)
 
     # If we can't ping the host, don't bother doing anything else
     if ret:
+        reachability.record(host, "failed", "ping", stdout=out, stderr=err)
         rsv.results.ping_failure(metric, out, err)
         sys.exit(1)
-        
-    rsv.log("INFO", "Ping successful", 4)
+
+    reachability.record(host, "ok", "ping")
+    rsv.log("INFO", "Ping successful", indent=4)
     return
 
 
+def report_cached_ping(rsv, metric, host, entry):
+    """ Act on a cached reachability check the same way as on a fresh one """
+
+    checked = time.strftime("%Y-%m-%d %H:%M:%S %Z", time.localtime(entry["time"]))
+    rsv.log("INFO", "Using the result of checking %s (%s) at %s", host, entry.get("method"), checked, indent=4)
+
+    status = entry.get("status")
+    if status == "ok":
+        rsv.log("INFO", "Ping successful (cached)", indent=4)
+        return
+
+    note = "(Result of a check at %s, reused for ping-cache-ttl seconds)\n" % checked
+    if status == "timeout":
+        rsv.results.ping_timeout(metric, entry.get("command", ""), note + entry.get("error", ""))
+    else:
+        rsv.results.ping_failure(metric, note + entry.get("stdout", ""), entry.get("stderr", ""))
+    sys.exit(1)
+
+
 
 def parse_job_output(rsv, metric, stdout, stderr):
     """ Parse the job output from the worker script """
@@ -64,25 +109,47 @@ def parse_job_output(rsv, metric, stdout, stderr):
 
 def parse_job_output_wlcg(rsv, metric, stdout, stderr):
     """ Parse WLCG formatted output. """
+
+    # Output with more than one record is cut down like any other, which can
+    # drop whole records from the middle
+    eot_count = getattr(stdout, "eot_count", 0)
+    if eot_count > 1:
+        rsv.log("WARNING", "Metric %s printed %s WLCG records, but only one is used.  Set output-format to "
+                "wlcg-multiple to publish all of them.", metric.name, eot_count)
+
     rsv.results.wlcg_result(metric, stdout, stderr)
 
 
 def parse_job_output_multiple_wlcg(rsv, metric, stdout, stderr):
-    """ Parse multiple WLCG formatted records separated by EOT. """
+    """ Parse multiple WLCG formatted records separated by EOT.  The records
+    were split up while the output was read if stdout came from a
+    RecordSplitter (see get_stdout_buffer). """
+
+    records = getattr(stdout, "records", None)
+    if records is None:
+        splitter = Capture.RecordSplitter(trim_length=rsv.get_trim_length())
+        splitter.write(stdout)
+        records = splitter.getvalue().records
+
+    # The records are split up as the output arrives, but none are handed on
+    # until the job has exited: a job that fails or times out gets a failure
+    # record instead, and none of its records may be published.  Each batch
+    # is let go of once Results has it.
+    rsv.echo("Parsing wlcg-multiple style record.  Found %s records" % len(records))
+    while records:
+        batch = records[:RECORD_BATCH_SIZE]
+        del records[:RECORD_BATCH_SIZE]
+        rsv.results.wlcg_results(metric, batch, stderr)
 
-    rsv.log("CRITICAL", "wlcg-multiple implementation may not be fully functional")
 
-    records = stdout.split("\nEOT\n")
-    rsv.echo("Parsing wlcg-multiple style record.  Found %s records" % len(records))
-    num = 1
-    for record in records:
-        if not re.search("\S", record):
-            continue
-        record += "\nEOT\n"
-        rsv.echo("Record %s of %s:" % (num, len(records)))
-        rsv.results.wlcg_result(metric, record, stderr)
-        rsv.echo("\n")
-        num += 1
+def get_stdout_buffer(rsv, metric, head_size=None):
+    """ Return the buffer to collect the STDOUT of metric in: a RecordSplitter
+    for wlcg-multiple metrics, so records are split up as they are read, or
+    None for the default """
+
+    if metric.config_val("output-format", "wlcg-multiple"):
+        return Capture.RecordSplitter(head_size, rsv.get_trim_length())
+    return None
 
 
 def parse_job_output_brief(rsv, metric, stdout, stderr):
@@ -110,17 +177,18 @@ def parse_job_output_brief(rsv, metric, stdout, stderr):
 
         # We want to display the trimmed output
         # TODO - display non-trimmed output if we are in -v3 mode?
-        trim_length = rsv.config.get("rsv", "details-data-trim-length")
-        if not rsv.quiet:
+        trim_length = rsv.get_trim_length()
+        if not rsv.quiet and trim_length > 0:
             rsv.echo("Displaying first %s bytes of output" % trim_length, 1)
             stdout = stdout[:trim_length]
+            stderr = stderr[:trim_length]
         else:
             rsv.log("DEBUG", "Displaying full output received from command:")
 
         rsv.echo(stdout)
 
         rsv.echo("STDERR from metric:")
-        rsv.echo(stderr[:trim_length])
+        rsv.echo(stderr)
 
         sys.exit(1)
 
@@ -140,7 +208,7 @@ def execute_job(rsv, metric):
             rsv.log("INFO", "Executing job remotely using globus-job-run")
             execute_grid_job(rsv, metric)
     else:
-        rsv.log("ERROR", "The execute type of the probe is unknown: '%s'" % execute_type)
+        rsv.log("ERROR", "The execute type of the probe is unknown: '%s'", execute_type)
         sys.exit(1)
 
     return
@@ -164,17 +232,17 @@ def execute_local_job(rsv, metric):
     # can take a long time to run (many times longer than the average metric)
     job_timeout = metric.get_timeout()
 
-    original_environment = copy.copy(os.environ)
-    setup_job_environment(rsv, metric)
+    env = get_job_environment(rsv, metric)
+    limit = Capture.get_head_size(rsv.get_trim_length())
 
     try:
-        (ret, out, err) = rsv.run_command(job, job_timeout)
+        (ret, out, err) = rsv.run_command(job, job_timeout, env, limit, get_stdout_buffer(rsv, metric, limit))
     except Sysutils.TimeoutError, err:
-        os.environ = original_environment
+        record_job_usage(rsv, metric)
         rsv.results.job_timed_out(metric, " ".join(job), err)
         return
 
-    os.environ = original_environment
+    record_job_usage(rsv, metric)
 
     if ret:
         rsv.results.local_job_failed(metric, " ".join(job), out, err)
@@ -197,10 +265,12 @@ def execute_grid_job(rsv, metric):
         rsv.log("CRITICAL", "ej1: jobmanager not defined in config")
         sys.exit(1)
 
+    import shutil
+
     # If the probe depends on any modules we need to prepare a SHAR file to send
     # because globus-job-run can only send one file (it can't send supporting libraries)
     (shar_dir, shar_file) = prepare_shar_file(rsv, metric)
-    if not shar_dir:
+    if not shar_file:
         return
 
     job = ["globus-job-run", "%s/jobmanager-%s" % (metric.host, jobmanager),
@@ -217,19 +287,22 @@ def execute_grid_job(rsv, metric):
     # can take a long time to run (many times longer than the average metric)
     job_timeout = metric.get_timeout()
 
-    original_environment = copy.copy(os.environ)
-    setup_job_environment(rsv, metric)
+    env = get_job_environment(rsv, metric)
+    limit = Capture.get_head_size(rsv.get_trim_length())
 
     try:
-        (ret, out, err) = rsv.run_command(job, job_timeout)
+        (ret, out, err) = rsv.run_command(job, job_timeout, env, limit, get_stdout_buffer(rsv, metric, limit))
     except Sysutils.TimeoutError, err:
-        os.environ = original_environment
-        shutil.rmtree(shar_dir)
+        record_job_usage(rsv, metric)
+        if shar_dir:
+            shutil.rmtree(shar_dir)
         rsv.results.job_timed_out(metric, " ".join(job), err)
         return
 
-    os.environ = original_environment
-    shutil.rmtree(shar_dir)
+    record_job_usage(rsv, metric)
+
+    if shar_dir:
+        shutil.rmtree(shar_dir)
 
     if ret:
         rsv.results.grid_job_failed(metric, " ".join(job), out, err)
@@ -243,7 +316,23 @@ def prepare_shar_file(rsv, metric):
 
     globus-job-run can only send one file, so we will wrap up all the files into a
     sh archive.  But after unshar'ing we need to execute one of the files so we will
-    use a perl script to do the extraction followed by executing the necessary script """
+    use a perl script to do the extraction followed by executing the necessary script.
+
+    Returns (tempdir, shar_file).  Shar files from the shar cache are shared with
+    other runs, and tempdir is None for them; otherwise the caller removes tempdir. """
+
+    header = SHAR_HEADER % metric.name
+    transfer_files = metric.get_transfer_files() or []
+
+    # The same metric files give the same shar file, so reuse it if we can
+    cache = rsv.get_shar_cache()
+    key = None
+    if cache:
+        key = cache.get_key(header, [metric.executable] + transfer_files)
+        if key:
+            shar_file = cache.lookup(key)
+            if shar_file:
+                return None, shar_file
 
     # Check for shar
     utils = Sysutils.Sysutils(rsv)
@@ -252,6 +341,13 @@ def prepare_shar_file(rsv, metric):
         rsv.results.shar_not_installed(metric)
         return None, None
 
+    # Create the shar file
+    cmd = ["shar", "-f", metric.executable] + transfer_files
+    (ret, out, err) = rsv.run_command(cmd)
+    if ret != 0:
+        rsv.results.shar_creation_failed(metric, out, err)
+        return None, None
+
     # Make a temporary path to create the shar file
     parent_dir = os.path.join("/", "var", "tmp", "rsv")
     if not os.path.exists(parent_dir):
@@ -260,12 +356,28 @@ def prepare_shar_file(rsv, metric):
         os.mkdir(parent_dir, 0755)
         (uid, gid) = pwd.getpwnam('rsv')[2:4]
         os.chown(parent_dir, uid, gid)
+
+    if key:
+        shar_file = cache.store(key, header + out)
+        if shar_file:
+            return None, shar_file
+
+    import tempfile
+
     tempdir = tempfile.mkdtemp(prefix="shar-", dir=parent_dir)
     shar_file = os.path.join(tempdir, "shar.pl")
 
-    # Make a perl header for the shar file
     f = open(shar_file, 'w')
-    f.write("""#!/usr/bin/env perl
+    f.write(header)
+    f.write(out)
+    f.close()
+
+    return tempdir, shar_file
+    
+
+# The perl header for shar files (see prepare_shar_file), filled in with the
+# metric name
+SHAR_HEADER = """#!/usr/bin/env perl
 
 use strict;
 use warnings;
@@ -301,28 +413,15 @@ else {
     system("rm -fr $temp_dir");
 }
 
-__DATA__""" % metric.name)
-    f.close()
-
-    # Create the shar file
-    transfer_files = metric.get_transfer_files()
-    cmd = ["shar", "-f", metric.executable] + transfer_files
-    (ret, out, err) = rsv.run_command(cmd)
-    if ret != 0:
-        rsv.results.shar_creation_failed(metric, out, err)
-        return None, None
-
-    f = open(shar_file, 'a')
-    f.write(out)
-    f.close()
+__DATA__"""
 
-    return tempdir, shar_file
-    
 
 def execute_condor_g_job(rsv, metric):
     """ Execute a remote job via Condor-G.  This is the preferred format so that we
     can support both Globus and CREAM """
 
+    import CondorG
+
     # Submit the job
     condorg = CondorG.CondorG(rsv)
 
@@ -330,108 +429,379 @@ def execute_condor_g_job(rsv, metric):
     if rsv.get_extra_globus_rsl():
         attrs["globus_rsl"] = rsv.get_extra_globus_rsl()
 
-    original_environment = copy.copy(os.environ)
-    setup_job_environment(rsv, metric)
+    env = get_job_environment(rsv, metric)
 
-    ret = condorg.submit(metric, attrs)
-
-    os.environ = original_environment
+    start = time.time()
+    ret = condorg.submit(metric, attrs, env=env)
 
     if not ret:
         rsv.results.condor_g_globus_submission_failed(metric)
         return
 
     ret = condorg.wait()
+    handle_condor_g_result(rsv, metric, condorg, ret, time.time() - start)
+    return
+
+
+def handle_condor_g_result(rsv, metric, condorg, ret, wall):
+    """ Record the usage and publish the result of a finished Condor-G job.  ret
+    is the status returned by CondorG.wait() """
+
+    record_usage(rsv, metric, condorg.get_usage(wall))
 
     if ret == 0:
-        parse_job_output(rsv, metric, condorg.get_stdout(), condorg.get_stderr())
+        stdout = condorg.get_stdout(get_stdout_buffer(rsv, metric, Capture.get_head_size(rsv.get_trim_length())))
+        parse_job_output(rsv, metric, stdout, condorg.get_stderr())
     elif ret == 1:
-        rsv.results.condor_grid_job_aborted(metric, condorg.get_log_contents())
+        rsv.results.condor_grid_job_aborted(metric, condorg.get_event_history())
     elif ret == 2:
-        rsv.results.condor_grid_job_failed(metric, condorg.get_stdout(), condorg.get_stderr(), condorg.get_log_contents())
+        rsv.results.condor_grid_job_failed(metric, condorg.get_stdout(), condorg.get_stderr(), condorg.get_event_history())
     elif ret == 3:
-        rsv.results.condor_g_globus_submission_failed(metric, condorg.get_log_contents())
+        rsv.results.condor_g_globus_submission_failed(metric, condorg.get_event_history())
     elif ret == 4:
-        rsv.results.condor_g_remote_gatekeeper_down(metric, condorg.get_log_contents())
+        rsv.results.condor_g_remote_gatekeeper_down(metric, condorg.get_event_history())
     elif ret == 5:
-        rsv.results.job_timed_out(metric, "condor-g submission", "", info=condorg.get_log_contents())
+        rsv.results.job_timed_out(metric, "condor-g submission", "", info=condorg.get_event_history())
 
     return
 
 
-def setup_job_environment(rsv, metric):
-    """ Set the appropriate environment values that a metric expects """
+def record_job_usage(rsv, metric):
+    """ Record the resources used by the command that just ran the job """
+    child = rsv.sysutils.last_child
+    if child and child.finished():
+        record_usage(rsv, metric, Ledger.child_usage(child))
+    return
+
+
+def record_usage(rsv, metric, usage):
+    """ Add the resources used by a job to the ledger, and to its records if
+    performance-data is set """
+
+    rsv.log("INFO", "Resources used: %s", Ledger.format_performance_data(usage))
+    rsv.get_ledger().record(metric.name, usage)
+    if rsv.use_performance_data():
+        rsv.results.set_usage(usage)
+    return
+
+
+def get_job_environment(rsv, metric):
+    """ Return the JobEnvironment with the environment values that a metric expects """
 
     rsv.log("INFO", "Setting up job environment:")
 
-    env = metric.get_environment()
+    base = dict(os.environ)
+    proxy = rsv.get_proxy()
+    if proxy:
+        # Globus needs help finding the proxy since it probably does not have the
+        # default naming scheme of /tmp/x509_u<UID>
+        base["X509_USER_PROXY"] = proxy
+        base["X509_PROXY_FILE"] = proxy
+    env = JobEnvironment.JobEnvironment(base)
 
-    if not env:
-        rsv.log("INFO", "No environment setup declared", 4)
-        return
-    
-    for var in env.keys():
-        (action, value) = env[var]
-        action = action.upper()
-        rsv.log("INFO", "Var: '%s' Action: '%s' Value: '%s'" % (var, action, value), 4)
-        if action == "APPEND":
-            if var in os.environ:
-                os.environ[var] = os.environ[var] + ":" + value
-            else:
-                os.environ[var] = value
-            rsv.log("DEBUG", "New value of %s:\n%s" % (var, os.environ[var]), 8)
-        elif action == "PREPEND":
-            if var in os.environ:
-                os.environ[var] = value + ":" + os.environ[var]
+    settings = metric.get_environment()
+
+    if not settings:
+        rsv.log("INFO", "No environment setup declared", indent=4)
+        return env
+
+    for var in settings.keys():
+        (action, value) = settings[var]
+        rsv.log("INFO", "Var: '%s' Action: '%s' Value: '%s'", var, action.upper(), value, indent=4)
+
+    env = env.with_settings(settings)
+
+    for var in env.get_changed():
+        if var in env:
+            rsv.log("DEBUG", "New value of %s:\n%s", var, env[var], indent=8)
+
+    return env
+
+def run_single_metric(rsv, options, host, metric_name, count, total):
+    """ Check the proxy, ping the host and run one metric against it """
+
+    rsv.set_log_context(metric=metric_name, host=host, phase="setup")
+    metric = rsv.get_metric_catalog().get_metric(metric_name, host, options)
+    rsv.results.set_usage(None)
+
+    prepare_metric(rsv, options, metric)
+
+    # Run the job and parse the result
+    if total > 1:
+        rsv.echo("\nRunning metric %s (%s of %s)\n" % (metric.name, count, total))
+    else:
+        rsv.echo("\nRunning metric %s:\n" % metric.name)
+    rsv.set_log_context(phase="execute")
+    execute_job(rsv, metric)
+    return
+
+
+def prepare_metric(rsv, options, metric):
+    """ Check the proxy and ping the host before running metric.  Exits if the
+    metric cannot run, after publishing a result saying why. """
+
+    # Check for some basic error conditions
+    rsv.set_log_context(phase="proxy")
+    rsv.check_proxy(metric)
+
+    rsv.set_log_context(phase="ping")
+    if options.no_ping:
+        rsv.log("INFO", "Skipping ping check because --no-ping was supplied")
+    elif metric.config_getboolean('no-ping') == True:
+        rsv.log("INFO", "Skipping ping check because metric config contains no-ping=True")
+    else:
+        ping_test(rsv, metric)
+    return
+
+
+def uses_condor_g(rsv, metric):
+    """ Return True if metric runs remotely through Condor-G """
+    return metric.config_get("execute").lower() == "grid" and rsv.use_condor_g()
+
+
+def run_condor_g_batch(rsv, options, jobs):
+    """ Run the (host, metric) pairs in jobs that use Condor-G as a CondorGBatch:
+    one Condor-G cluster for each CE, with the result of each metric published
+    as soon as its job finishes.  Returns (the jobs that do not use Condor-G,
+    the number of metrics that failed to run). """
+
+    import CondorG
+
+    attrs = {}
+    if rsv.get_extra_globus_rsl():
+        attrs["globus_rsl"] = rsv.get_extra_globus_rsl()
+    batch = CondorG.CondorGBatch(rsv, attrs)
+
+    others = []
+    failed = []
+    for (host, metric_name) in jobs:
+        rsv.set_log_context(metric=metric_name, host=host, phase="setup")
+        metric = rsv.get_metric_catalog().get_metric(metric_name, host, options)
+        if not uses_condor_g(rsv, metric):
+            others.append((host, metric_name))
+            continue
+
+        rsv.results.set_usage(None)
+        try:
+            prepare_metric(rsv, options, metric)
+            rsv.set_log_context(phase="submit")
+            batch.add(metric, get_job_environment(rsv, metric))
+        except SystemExit:
+            failed.append(metric)
+
+    if not batch.jobs:
+        return (others, len(failed))
+
+    rsv.echo("\nSubmitting %s grid metrics to Condor-G\n" % len(batch.jobs))
+    for job in batch.submit():
+        rsv.set_log_context(metric=job.metric.name, host=job.metric.host, phase="results")
+        rsv.results.set_usage(None)
+        rsv.results.condor_g_globus_submission_failed(job.metric)
+
+    finished = []
+    def handle(job, ret):
+        metric = job.metric
+        finished.append(metric)
+        rsv.set_log_context(metric=metric.name, host=metric.host, phase="results")
+        rsv.results.set_usage(None)
+        rsv.echo("\nResult of metric %s on %s (%s of %s)\n" % (metric.name, metric.host, len(finished),
+                                                                 len(batch.jobs)))
+        try:
+            handle_condor_g_result(rsv, metric, job, ret, time.time() - job.start)
+        except SystemExit:
+            failed.append(metric)
+
+    batch.wait(handle)
+
+    if failed:
+        rsv.echo("\n%s grid metrics failed to run:" % len(failed))
+        for metric in failed:
+            rsv.echo("%s on %s" % (metric.name, metric.host), 4)
+
+    return (others, len(failed))
+
+
+def run_parallel(rsv, options, jobs):
+    """ Run the (host, metric) pairs in jobs with up to options.parallel metrics
+    at a time, and at most options.max_per_host of them against the same host.
+
+    Each metric runs in a forked child, exactly as it would in a serial run,
+    including writing its records through Results.  The STDOUT and STDERR of
+    each child are collected in files of their own and printed, to STDOUT and
+    STDERR, in the same order as a serial run would print them, as soon as
+    every earlier metric has finished.  No file is kept open once its child
+    has started, and a metric is not started while too many outputs are
+    waiting to be printed (see HELD_OUTPUTS_PER_WORKER). """
+
+    import shutil
+    import tempfile
+    import traceback
+
+    total = len(jobs)
+    rsv.log("INFO", "Running %s metrics, %s at a time (at most %s per host)",
+            total, options.parallel, options.max_per_host)
+
+    # Each child writes its own records to the spool, so they must not inherit
+    # any that are waiting to be written
+    rsv.results.flush()
+
+    running = {}        # pid -> index into jobs
+    running_hosts = {}  # host -> number of running metrics
+    statuses = {}       # index into jobs -> exit status
+    pending = range(total)
+    next_to_print = 0
+    max_held = options.parallel * HELD_OUTPUTS_PER_WORKER
+    failed = []
+
+    output_dir = tempfile.mkdtemp(prefix="rsv-parallel-")
+    try:
+        while pending or running:
+            # Start as many metrics as the limits allow, in order
+            for index in pending[:]:
+                if len(running) >= options.parallel or index >= next_to_print + max_held:
+                    break
+                (host, metric_name) = jobs[index]
+                if running_hosts.get(host, 0) >= options.max_per_host:
+                    continue
+
+                sys.stdout.flush()
+                sys.stderr.flush()
+
+                pid = os.fork()
+                if pid == 0:
+                    status = 1
+                    try:
+                        try:
+                            redirect_output(get_output_path(output_dir, index, "stdout"), 1)
+                            redirect_output(get_output_path(output_dir, index, "stderr"), 2)
+                            rsv.new_run_id()
+                            try:
+                                run_single_metric(rsv, options, host, metric_name, index + 1, total)
+                            finally:
+                                rsv.results.flush()
+                            status = 0
+                        except SystemExit, err:
+                            if err.code is None:
+                                status = 0
+                            elif isinstance(err.code, int):
+                                status = err.code
+                        except Exception:
+                            print >> sys.stderr, "ERROR: unexpected exception running metric %s:" % metric_name
+                            print >> sys.stderr, traceback.format_exc()
+                    finally:
+                        sys.stdout.flush()
+                        sys.stderr.flush()
+                        os._exit(status)
+
+                pending.remove(index)
+                running[pid] = index
+                running_hosts[host] = running_hosts.get(host, 0) + 1
+
+            # Wait for any metric to finish
+            try:
+                (pid, status) = os.waitpid(-1, 0)
+            except OSError, err:
+                if err.errno == errno.EINTR:
+                    continue
+                raise
+            if pid not in running:
+                continue
+
+            index = running.pop(pid)
+            (host, metric_name) = jobs[index]
+            running_hosts[host] -= 1
+            if os.WIFEXITED(status):
+                statuses[index] = os.WEXITSTATUS(status)
             else:
-                os.environ[var] = value
-            rsv.log("DEBUG", "New value of %s:\n%s" % (var, os.environ[var]), 8)
-        elif action == "SET":
-            os.environ[var] = value
-        elif action == "UNSET":
-            if var in os.environ:
-                del os.environ[var]
+                statuses[index] = 1
+            if statuses[index] != 0:
+                failed.append(index)
+
+            # Print everything that is now complete, in order
+            while next_to_print in statuses:
+                print_output(get_output_path(output_dir, next_to_print, "stdout"), sys.stdout)
+                print_output(get_output_path(output_dir, next_to_print, "stderr"), sys.stderr)
+                next_to_print += 1
+    finally:
+        shutil.rmtree(output_dir, True)
+
+    if failed:
+        failed.sort()
+        rsv.echo("\n%s of %s metrics failed to run:" % (len(failed), total))
+        for index in failed:
+            rsv.echo("%s on %s (exit code %s)" % (jobs[index][1], jobs[index][0], statuses[index]), 4)
+        return False
+
+    return True
+
+
+def get_output_path(output_dir, index, stream):
+    """ The file in output_dir that a child of run_parallel writes stream to """
+    return os.path.join(output_dir, "%d.%s" % (index, stream))
+
+
+def redirect_output(path, fd):
+    """ Send everything written to fd to a new file at path """
+    output = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+    os.dup2(output, fd)
+    os.close(output)
+    return
+
+
+def print_output(path, stream):
+    """ Copy the file at path (if a child got as far as creating it) to stream,
+    and remove it """
+
+    try:
+        fp = open(path, 'rb')
+    except IOError:
+        return
 
+    try:
+        while 1:
+            data = fp.read(Capture.CHUNK_SIZE)
+            if not data:
+                break
+            stream.write(data)
+    finally:
+        fp.close()
+    stream.flush()
+    os.remove(path)
     return
 
+
 def main(rsv, options, metrics):
     """ Main subroutine: directs program flow """
 
-    hosts = {}
-    total = 0
+    # A list of (host, metric) pairs, in the order that they will be run
+    jobs = []
 
     if options.all_enabled:
-        for host in rsv.get_host_info():
-            hosts[host.host] = host.get_enabled_metrics()
-            total += len(hosts[host.host])
+        registry = rsv.get_host_registry()
+        for host in registry.get_host_names():
+            for metric_name in registry.get_enabled_metrics(host):
+                jobs.append((host, metric_name))
     else:
-        hosts[options.uri] = metrics
-        total = len(metrics)
+        for metric_name in metrics:
+            jobs.append((options.uri, metric_name))
 
     RSV.validate_config(rsv)
 
-    # Process the command line and initialize
-    count = 0
-    for host in hosts:
-        for metric_name in hosts[host]:
-            count += 1
-            metric = Metric.Metric(metric_name, rsv, host, options)
-
-            # Check for some basic error conditions
-            rsv.check_proxy(metric)
+    # The records of every metric in the run are written to the spool together
+    # at the end, even if a metric exits early
+    try:
+        failed = 0
+        if options.batch:
+            (jobs, failed) = run_condor_g_batch(rsv, options, jobs)
 
-            if options.no_ping:
-                rsv.log("INFO", "Skipping ping check because --no-ping was supplied")
-            elif metric.config_getboolean('no-ping') == True:
-                rsv.log("INFO", "Skipping ping check because metric config contains no-ping=True")
-            else:
-                ping_test(rsv, metric)
+        if options.parallel > 1 and len(jobs) > 1:
+            return run_parallel(rsv, options, jobs) and not failed
 
-            # Run the job and parse the result
-            if total > 1:
-                rsv.echo("\nRunning metric %s (%s of %s)\n" % (metric.name, count, total))
-            else:
-                rsv.echo("\nRunning metric %s:\n" % metric.name)
-            execute_job(rsv, metric)
+        count = 0
+        for (host, metric_name) in jobs:
+            count += 1
+            run_single_metric(rsv, options, host, metric_name, count, len(jobs))
+    finally:
+        rsv.results.flush()
 
-    return True
+    return not failed